@@ -1,10 +1,48 @@
+import time
+STARTUP_T0 = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, messagebox, font
-import mysql.connector as c
 import re
-from datetime import datetime
-from PIL import Image, ImageTk
+from datetime import date, datetime, timedelta
+from decimal import Decimal
 import os
+import argparse
+import csv
+import sqlite3
+import threading
+import queue
+import getpass
+import json
+import gzip
+import hashlib
+import uuid
+import difflib
+import html
+import webbrowser
+import bisect
+import random
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from collections import OrderedDict, deque
+import weakref
+from array import array
+
+# Startup timing report, written once the dashboard is ready
+class StartupTimer:
+    def __init__(self, t0=STARTUP_T0):
+        self.t0 = t0
+        self.marks = []
+
+    def mark(self, name):
+        self.marks.append((name, (time.perf_counter() - self.t0) * 1000))
+
+    def report(self):
+        # Set HOSPITAL_STARTUP_LOG to a file path to collect runs for regression tracking;
+        # a windowed app has no console to print to
+        log_path = os.environ.get("HOSPITAL_STARTUP_LOG")
+        if log_path:
+            with open(log_path, "a") as log:
+                log.write(json.dumps({"at": datetime.now().isoformat(), **{name: round(ms, 1) for name, ms in self.marks}}) + "\n")
 
 # Modern Color Scheme
 class ModernColors:
@@ -32,6 +70,11 @@ class ValidationUtils:
         else:
             return False, "Phone number must be 10 digits (e.g., 9876543210 or +91-9876543210)"
     
+    @staticmethod
+    def phone_key(phone):
+        """Canonical lookup key: the last 10 digits, so +91-9876543210 and 9876543210 match"""
+        return re.sub(r'\D', '', phone or "")[-10:]
+
     @staticmethod
     def validate_email(email):
         pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -199,154 +242,3844 @@ class ModernButton(tk.Button):
     def on_leave(self, e):
         self.configure(bg=self["bg"])
 
-# Database connection
-try:
-    conn = c.connect(
-        host="localhost",
-        user="root",
-        passwd="ENTER_PASSWORD"
-    )
-    
-    if conn.is_connected():
-        csr = conn.cursor()
-        
-        # Create database if not exists
-        csr.execute("CREATE DATABASE IF NOT EXISTS HospitalManagement")
-        csr.execute("USE HospitalManagement")
-        
-        # Create tables
-        csr.execute("""
-        CREATE TABLE IF NOT EXISTS DEPT (
-            DepID INT PRIMARY KEY,
-            D_NAME VARCHAR(50),
-            FLOOR INT,
-            TELEPHONE VARCHAR(15)
+# Multi-row batch entry grid saved in one transaction
+class BatchEntryDialog(tk.Toplevel):
+    ROWS_PER_PAGE = 10
+
+    def __init__(self, parent, title, table, columns, references=None, after_insert=None, on_saved=None, derived=None):
+        """columns: list of (column, label, validator, required); references: column -> parent table;
+        derived: list of (column, function of the clean row) stored but not typed in"""
+        super().__init__(parent)
+        self.title(title)
+        self.configure(bg=ModernColors.BACKGROUND)
+        self.geometry("1100x520")
+        self.table = table
+        self.columns = columns
+        self.references = references or {}
+        self.after_insert = after_insert
+        self.on_saved = on_saved
+        self.derived = derived or []
+        self.rows = []
+
+        tk.Label(self, text=title, font=("Segoe UI", 14, "bold"), bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY).pack(pady=(10, 5))
+
+        grid_frame = tk.Frame(self, bg=ModernColors.SURFACE, relief="solid", bd=1)
+        grid_frame.pack(fill="both", expand=True, padx=15, pady=5)
+        canvas = tk.Canvas(grid_frame, bg=ModernColors.SURFACE, highlightthickness=0)
+        v_scrollbar = ttk.Scrollbar(grid_frame, orient="vertical", command=canvas.yview)
+        canvas.configure(yscrollcommand=v_scrollbar.set)
+        v_scrollbar.pack(side="right", fill="y")
+        canvas.pack(side="left", fill="both", expand=True)
+        self.grid_body = tk.Frame(canvas, bg=ModernColors.SURFACE)
+        canvas.create_window((0, 0), window=self.grid_body, anchor="nw")
+        self.grid_body.bind("<Configure>", lambda e: canvas.configure(scrollregion=canvas.bbox("all")))
+
+        tk.Label(self.grid_body, text="#", font=("Segoe UI", 10, "bold"), bg=ModernColors.SURFACE, fg=ModernColors.TEXT_SECONDARY).grid(row=0, column=0, padx=5, pady=5)
+        for col, (_, label, _, required) in enumerate(columns, start=1):
+            text = f"{label} *" if required else label
+            tk.Label(self.grid_body, text=text, font=("Segoe UI", 10, "bold"), bg=ModernColors.SURFACE, fg=ModernColors.TEXT_PRIMARY).grid(row=0, column=col, padx=5, pady=5, sticky="w")
+        self.add_rows()
+
+        self.status_label = tk.Label(self, text="Blank rows are ignored.", font=("Segoe UI", 10), bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_SECONDARY, justify="left")
+        self.status_label.pack(padx=15, anchor="w")
+
+        button_frame = tk.Frame(self, bg=ModernColors.BACKGROUND)
+        button_frame.pack(pady=10)
+        ModernButton(button_frame, "Add Rows", self.add_rows, "secondary").pack(side="left", padx=5)
+        ModernButton(button_frame, "Validate", self.validate_rows, "warning").pack(side="left", padx=5)
+        ModernButton(button_frame, "Save All", self.save_rows, "primary").pack(side="left", padx=5)
+        ModernButton(button_frame, "Close", self.destroy, "danger").pack(side="left", padx=5)
+
+    def add_rows(self):
+        for _ in range(self.ROWS_PER_PAGE):
+            row_index = len(self.rows) + 1
+            tk.Label(self.grid_body, text=str(row_index), font=("Segoe UI", 9), bg=ModernColors.SURFACE, fg=ModernColors.TEXT_SECONDARY).grid(row=row_index, column=0, padx=5)
+            entries = []
+            for col in range(len(self.columns)):
+                entry = ModernEntry(self.grid_body, width=16)
+                entry.grid(row=row_index, column=col + 1, padx=3, pady=2)
+                entries.append(entry)
+            self.rows.append(entries)
+
+    def mark(self, entry, is_valid):
+        if is_valid:
+            entry.configure(highlightbackground="#e5e7eb", highlightcolor=ModernColors.PRIMARY)
+        else:
+            entry.configure(highlightbackground=ModernColors.ERROR, highlightcolor=ModernColors.ERROR)
+
+    def validate_rows(self):
+        """Validate every non-blank row; returns (clean rows, errors) and highlights bad cells"""
+        clean_rows, errors, cells = [], [], []
+        seen_keys = {}
+        for row_number, entries in enumerate(self.rows, start=1):
+            raw = [entry.get_value().strip() for entry in entries]
+            if not any(raw):
+                for entry in entries:
+                    self.mark(entry, True)
+                continue
+
+            values = []
+            for entry, value, (column, label, validator, required) in zip(entries, raw, self.columns):
+                if not value:
+                    self.mark(entry, not required)
+                    if required:
+                        errors.append(f"Row {row_number}: {label} is required")
+                    values.append(value or None)
+                    continue
+                is_valid, result = validator(value)
+                self.mark(entry, is_valid)
+                if not is_valid:
+                    errors.append(f"Row {row_number}: {label}: {result}")
+                values.append(result if is_valid else value)
+
+            # First column is always the primary key
+            key = values[0]
+            if key in seen_keys:
+                self.mark(entries[0], False)
+                errors.append(f"Row {row_number}: {self.columns[0][1]} duplicates row {seen_keys[key]}")
+            seen_keys.setdefault(key, row_number)
+            clean_rows.append(values)
+            cells.append((row_number, entries))
+
+        if not errors and clean_rows:
+            errors = self.check_database(clean_rows, cells)
+
+        if errors:
+            self.status_label.configure(text="\n".join(errors[:8]) + (f"\n... and {len(errors) - 8} more" if len(errors) > 8 else ""), fg=ModernColors.ERROR)
+        else:
+            self.status_label.configure(text=f"{len(clean_rows)} row(s) ready to save.", fg=ModernColors.SUCCESS)
+        return clean_rows, errors
+
+    def lookup_existing(self, table, keys):
+        """The keys that are already primary keys of table"""
+        rows = Statements.query(conn, "keys_in", tuple(keys), table=table, size=len(keys))
+        return {str(row[0]) for row in rows}
+
+    def check_database(self, clean_rows, cells):
+        """Set-based duplicate and foreign-key checks: one query per column instead of per row"""
+        errors = []
+        label = self.columns[0][1]
+        existing = self.lookup_existing(self.table, [row[0] for row in clean_rows])
+        for values, (row_number, entries) in zip(clean_rows, cells):
+            if str(values[0]) in existing:
+                self.mark(entries[0], False)
+                errors.append(f"Row {row_number}: {label} {values[0]} already exists")
+
+        for index, (column, label, _, _) in enumerate(self.columns):
+            if column not in self.references:
+                continue
+            keys = {row[index] for row in clean_rows if row[index]}
+            if not keys:
+                continue
+            # Reference columns are named after the parent's primary key
+            found = self.lookup_existing(self.references[column], list(keys))
+            for values, (row_number, entries) in zip(clean_rows, cells):
+                if values[index] and str(values[index]) not in found:
+                    self.mark(entries[index], False)
+                    errors.append(f"Row {row_number}: {label} {values[index]} not found")
+        return errors
+
+    def save_rows(self):
+        try:
+            clean_rows, errors = self.validate_rows()
+        except Exception as e:
+            messagebox.showerror("Database Error", f"Error validating batch: {str(e)}", parent=self)
+            return
+        if errors or not clean_rows:
+            if not clean_rows:
+                self.status_label.configure(text="Nothing to save.", fg=ModernColors.WARNING)
+            return
+
+        # The grid's columns, then the derived ones, match the catalog INSERT's column order
+        insert_rows = [row + [derive(row) for _, derive in self.derived] for row in clean_rows]
+        try:
+            Statements.execute_many(conn, Statements.INSERTS[self.table], insert_rows)
+            if self.after_insert:
+                self.after_insert(csr, clean_rows)
+            reserve_ids(self.table, [row[0] for row in clean_rows])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            messagebox.showerror("Database Error", f"No rows were saved: {str(e)}", parent=self)
+            return
+
+        for entries in self.rows:
+            for entry in entries:
+                entry.delete(0, tk.END)
+        names = [column for column, _, _, _ in self.columns]
+        for row in clean_rows:
+            audit_event("INSERT", self.table, row[0], after=dict(zip(names, row)))
+        self.status_label.configure(text=f"Saved {len(clean_rows)} row(s) in one transaction.", fg=ModernColors.SUCCESS)
+        if self.on_saved:
+            self.on_saved()
+
+# Small least-recently-used cache
+class LRUCache:
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            return default
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+# Search result cache with TTL and per-table invalidation
+class QueryCache:
+    def __init__(self, maxsize=128, ttl=120, max_rows=5000):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Very large results are not worth holding in memory
+        self.max_rows = max_rows
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Keys are tuples whose first element is the table name"""
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value, row_count=0):
+        if row_count > self.max_rows:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, table):
+        stale = [key for key in self.entries if key[0] == table]
+        for key in stale:
+            del self.entries[key]
+        self.invalidations += len(stale)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0
+        return (f"{self.hits} hits, {self.misses} misses ({hit_rate:.0f}% hit rate), "
+                f"{len(self.entries)} cached, {self.evictions} evicted, {self.invalidations} invalidated")
+
+# Compact column-oriented copy of a loaded table for local filtering and sorting
+class ColumnStore:
+    """Every column is dictionary-encoded: one array of integer codes plus the list of
+    distinct values. Filtering and sorting work on the codes, vectorized with NumPy
+    when it is installed."""
+    # The numpy module once loaded, False when it is not installed
+    numpy = None
+
+    @staticmethod
+    def load_numpy():
+        """Import numpy on first use, so the optional dependency never slows down startup"""
+        if ColumnStore.numpy is None:
+            try:
+                import numpy
+                ColumnStore.numpy = numpy
+            except ImportError:
+                # Filtering and sorting fall back to plain Python
+                ColumnStore.numpy = False
+        return ColumnStore.numpy or None
+
+    def __init__(self, width, rows=(), archived_rows=()):
+        self.width = width
+        self.codes = [array("I") for _ in range(width)]
+        self.values = [[] for _ in range(width)]
+        self.lookup = [{} for _ in range(width)]
+        self.live = bytearray()
+        self.archived = bytearray()
+        # Per column, built on first use: lowercased text of each distinct value, and sort ranks
+        self.texts = [None] * width
+        self.ranks = [None] * width
+        # primary key (as shown in the Treeview) -> row position
+        self.positions = {}
+        for row in rows:
+            self.append(row)
+        for row in archived_rows:
+            if str(row[0]) not in self.positions:
+                self.append(row, archived=True)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def encode(self, column, value):
+        code = self.lookup[column].get(value)
+        if code is None:
+            code = len(self.values[column])
+            self.values[column].append(value)
+            self.lookup[column][value] = code
+            if self.texts[column] is not None:
+                self.texts[column].append("" if value is None else str(value).lower())
+            self.ranks[column] = None
+        return code
+
+    def append(self, row, archived=False):
+        self.positions[str(row[0])] = len(self.live)
+        for column, value in enumerate(row):
+            self.codes[column].append(self.encode(column, value))
+        self.live.append(1)
+        self.archived.append(1 if archived else 0)
+
+    def row(self, position):
+        return tuple(self.values[column][self.codes[column][position]] for column in range(self.width))
+
+    def is_archived(self, position):
+        return bool(self.archived[position])
+
+    def upsert(self, row, insert_new=True):
+        position = self.positions.get(str(row[0]))
+        if position is None:
+            if insert_new:
+                self.append(row)
+            return
+        for column, value in enumerate(row):
+            self.codes[column][position] = self.encode(column, value)
+
+    def delete(self, key):
+        position = self.positions.pop(str(key), None)
+        if position is not None:
+            self.live[position] = 0
+
+    def matching_codes(self, column, text):
+        if self.texts[column] is None:
+            self.texts[column] = ["" if value is None else str(value).lower() for value in self.values[column]]
+        return [code for code, value in enumerate(self.texts[column]) if text in value]
+
+    def sort_ranks(self, column):
+        """Rank of each distinct value, so rows sort by comparing integers"""
+        if self.ranks[column] is None:
+            values = self.values[column]
+            order = sorted(range(len(values)), key=lambda code: (values[code] is None, values[code]))
+            ranks = array("I", bytes(4 * len(order)))
+            for rank, code in enumerate(order):
+                ranks[code] = rank
+            self.ranks[column] = ranks
+        return self.ranks[column]
+
+    def select(self, text="", columns=None, sort_column=None, descending=False):
+        """Positions of live rows containing text in any of columns, in sort order"""
+        text = text.strip().lower()
+        columns = range(self.width) if columns is None else columns
+        np = ColumnStore.load_numpy()
+        if np is not None:
+            mask = np.frombuffer(self.live, dtype=np.uint8).astype(bool)
+            if text:
+                hits = np.zeros(len(mask), dtype=bool)
+                for column in columns:
+                    table = np.zeros(len(self.values[column]), dtype=bool)
+                    table[self.matching_codes(column, text)] = True
+                    hits |= table[np.frombuffer(self.codes[column], dtype=np.uint32)]
+                mask &= hits
+            positions = np.flatnonzero(mask)
+            if sort_column is not None:
+                keys = np.frombuffer(self.sort_ranks(sort_column), dtype=np.uint32)[np.frombuffer(self.codes[sort_column], dtype=np.uint32)[positions]]
+                keys = keys.astype(np.int64)
+                positions = positions[np.argsort(-keys if descending else keys, kind="stable")]
+            return positions.tolist()
+
+        positions = [position for position, alive in enumerate(self.live) if alive]
+        if text:
+            tables = [(self.codes[column], set(self.matching_codes(column, text))) for column in columns]
+            positions = [position for position in positions if any(codes[position] in hits for codes, hits in tables)]
+        if sort_column is not None:
+            ranks, codes = self.sort_ranks(sort_column), self.codes[sort_column]
+            positions.sort(key=lambda position: ranks[codes[position]], reverse=descending)
+        return positions
+
+# Sparkline Canvas for dashboard trends
+class Sparkline(tk.Canvas):
+    def __init__(self, parent, color=ModernColors.PRIMARY, width=520, height=90, *args, **kwargs):
+        super().__init__(parent, width=width, height=height, *args, **kwargs)
+        self.color = color
+        self.values = []
+        self.configure(bg=ModernColors.SURFACE, highlightthickness=0, bd=0)
+        self.bind("<Configure>", lambda e: self.redraw())
+
+    def set_values(self, values):
+        self.values = list(values)
+        self.redraw()
+
+    def redraw(self):
+        self.delete("all")
+        width = self.winfo_width() if self.winfo_width() > 1 else int(self["width"])
+        height = self.winfo_height() if self.winfo_height() > 1 else int(self["height"])
+        pad = 6
+        if len(self.values) < 2:
+            self.create_text(width // 2, height // 2, text="No data", fill=ModernColors.TEXT_SECONDARY, font=("Segoe UI", 9))
+            return
+
+        peak = max(self.values) or 1
+        step = (width - 2 * pad) / (len(self.values) - 1)
+        points = []
+        for i, value in enumerate(self.values):
+            points.append(pad + i * step)
+            points.append(height - pad - (value / peak) * (height - 2 * pad))
+
+        self.create_line(pad, height - pad, width - pad, height - pad, fill="#e5e7eb")
+        self.create_line(*points, fill=self.color, width=2, smooth=True)
+        self.create_oval(points[-2] - 3, points[-1] - 3, points[-2] + 3, points[-1] + 3, fill=self.color, outline="")
+        self.create_text(pad, pad, text=f"max {max(self.values)}", anchor="nw", fill=ModernColors.TEXT_SECONDARY, font=("Segoe UI", 8))
+
+# Day/week appointment calendar drawn on a Canvas
+class AppointmentCalendar(tk.Canvas):
+    """Only the visible days are loaded (through load_range) and kept in a small
+    per-day cache. Each half-hour cell remembers what it last drew, so a reload or
+    a delta only redraws the cells whose appointments changed."""
+    HOUR_HEIGHT = 48
+    SLOT_MINUTES = 30
+    HEADER_HEIGHT = 28
+    GUTTER_WIDTH = 52
+    # Busier cells are drawn as one count badge instead of a chip per appointment
+    MAX_LANES = 4
+    CACHED_DAYS = 60
+
+    def __init__(self, parent, load_range, accepts=None, on_select=None, **kwargs):
+        """load_range(first_day, last_day) returns APPOINTMENT rows in DeltaSync column order;
+        accepts(row) tells whether a row from a delta belongs in the current view"""
+        super().__init__(parent, bg=ModernColors.SURFACE, highlightthickness=0, **kwargs)
+        self.load_range = load_range
+        self.accepts = accepts or (lambda row: True)
+        self.on_select = on_select
+        self.mode = "week"
+        self.start = date.today() - timedelta(days=date.today().weekday())
+        self.days = LRUCache(self.CACHED_DAYS)
+        self.day_of = {}
+        # (day index, slot) -> (signature, canvas item ids)
+        self.cells = {}
+        self.layout = None
+        self.bind("<Configure>", lambda e: self.redraw())
+        self.tag_bind("appointment", "<Button-1>", self.clicked)
+
+    @staticmethod
+    def as_date(value):
+        return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+    @staticmethod
+    def minutes(value):
+        """A_TIME arrives as a timedelta from MySQL and as text from the replica"""
+        if value is None:
+            return 0
+        if isinstance(value, timedelta):
+            return int(value.total_seconds()) // 60
+        hours, minutes = str(value).split(":")[:2]
+        return int(hours) * 60 + int(minutes)
+
+    def visible_days(self):
+        count = 1 if self.mode == "day" else 7
+        return [self.start + timedelta(days=i) for i in range(count)]
+
+    def set_mode(self, mode):
+        self.mode = mode
+        if mode == "week":
+            self.start -= timedelta(days=self.start.weekday())
+        self.refresh()
+
+    def shift(self, steps):
+        self.start += timedelta(days=steps * (1 if self.mode == "day" else 7))
+        self.refresh()
+
+    def go_to(self, day):
+        self.start = day - timedelta(days=day.weekday()) if self.mode == "week" else day
+        self.refresh()
+
+    def reset(self):
+        """Forget cached days, e.g. after the doctor/department filter changed"""
+        self.days.clear()
+        self.day_of.clear()
+        self.refresh()
+
+    def refresh(self):
+        """Load the visible days that are not cached yet, with one range query, then redraw"""
+        missing = [day for day in self.visible_days() if self.days.get(day) is None]
+        if missing:
+            loaded = {day: {} for day in missing}
+            for row in self.load_range(missing[0], missing[-1]):
+                day = self.as_date(row[3])
+                if day in loaded:
+                    loaded[day][row[0]] = row
+                    self.day_of[row[0]] = day
+            for day, rows in loaded.items():
+                self.days.put(day, rows)
+        self.redraw()
+
+    def apply_changes(self, rows, deleted):
+        """Move, add or drop appointments from a delta without reloading"""
+        for aid in list(deleted) + [row[0] for row in rows]:
+            old_day = self.day_of.pop(int(aid), None)
+            cached = self.days.get(old_day) if old_day else None
+            if cached is not None:
+                cached.pop(int(aid), None)
+        for row in rows:
+            day = self.as_date(row[3]) if row[3] else None
+            cached = self.days.get(day) if day else None
+            if cached is not None and self.accepts(row):
+                cached[row[0]] = row
+                self.day_of[row[0]] = day
+        self.redraw()
+
+    def redraw(self):
+        width = max(self.winfo_width(), int(self["width"]))
+        days = self.visible_days()
+        layout = (width, tuple(days))
+        if layout != self.layout:
+            # Size or date range changed: the grid and every cell have to be redrawn
+            self.delete("all")
+            self.cells = {}
+            self.layout = layout
+            self.draw_grid(width, days)
+
+        column_width = (width - self.GUTTER_WIDTH) / len(days)
+        wanted = {}
+        for index, day in enumerate(days):
+            for row in (self.days.get(day) or {}).values():
+                slot = self.minutes(row[4]) // self.SLOT_MINUTES
+                wanted.setdefault((index, slot), []).append(row)
+
+        for key in [key for key in self.cells if key not in wanted]:
+            self.delete(*self.cells.pop(key)[1])
+        for key, rows in wanted.items():
+            rows.sort(key=lambda row: (self.minutes(row[4]), row[0]))
+            signature = tuple((row[0], row[-1], row[1], row[2], row[4]) for row in rows)
+            previous = self.cells.get(key)
+            if previous and previous[0] == signature:
+                continue
+            if previous:
+                self.delete(*previous[1])
+            self.cells[key] = (signature, self.draw_cell(key, rows, column_width))
+
+    def draw_grid(self, width, days):
+        height = self.HEADER_HEIGHT + 24 * self.HOUR_HEIGHT
+        column_width = (width - self.GUTTER_WIDTH) / len(days)
+        self.configure(scrollregion=(0, 0, width, height))
+        for hour in range(24):
+            y = self.HEADER_HEIGHT + hour * self.HOUR_HEIGHT
+            self.create_line(self.GUTTER_WIDTH, y, width, y, fill="#e5e7eb")
+            self.create_text(self.GUTTER_WIDTH - 6, y + 2, text=f"{hour:02d}:00", anchor="ne", fill=ModernColors.TEXT_SECONDARY, font=("Segoe UI", 8))
+        today = date.today()
+        for index, day in enumerate(days):
+            x = self.GUTTER_WIDTH + index * column_width
+            self.create_line(x, 0, x, height, fill="#e5e7eb")
+            self.create_text(x + column_width / 2, self.HEADER_HEIGHT / 2, text=day.strftime("%a %d %b"),
+                             fill=ModernColors.PRIMARY if day == today else ModernColors.TEXT_PRIMARY, font=("Segoe UI", 9, "bold"))
+
+    def draw_cell(self, key, rows, column_width):
+        index, slot = key
+        x0 = self.GUTTER_WIDTH + index * column_width + 2
+        y0 = self.HEADER_HEIGHT + slot * self.SLOT_MINUTES / 60 * self.HOUR_HEIGHT + 1
+        y1 = y0 + self.SLOT_MINUTES / 60 * self.HOUR_HEIGHT - 2
+        if len(rows) > self.MAX_LANES:
+            return [
+                self.create_rectangle(x0, y0, x0 + column_width - 4, y1, fill=ModernColors.WARNING, outline=""),
+                self.create_text(x0 + 4, (y0 + y1) / 2, text=f"{len(rows)} appointments", anchor="w", fill="white", font=("Segoe UI", 8, "bold")),
+            ]
+        items = []
+        lane_width = (column_width - 4) / len(rows)
+        for lane, row in enumerate(rows):
+            left = x0 + lane * lane_width
+            tags = ("appointment", f"aid:{row[0]}")
+            items.append(self.create_rectangle(left, y0, left + lane_width - 2, y1, fill=ModernColors.PRIMARY, outline="", tags=tags))
+            if lane_width > 40:
+                items.append(self.create_text(left + 4, (y0 + y1) / 2, text=f"#{row[0]} P{row[1]}", anchor="w", fill="white", font=("Segoe UI", 8), tags=tags))
+        return items
+
+    def clicked(self, event):
+        if not self.on_select:
+            return
+        for tag in self.gettags("current"):
+            if tag.startswith("aid:"):
+                aid = int(tag[4:])
+                day = self.day_of.get(aid)
+                row = (self.days.get(day) or {}).get(aid) if day else None
+                if row:
+                    self.on_select(row)
+
+# Named SQL statements, defined once and run through prepared cursors
+class Statements:
+    # {table}/{source}/{field} are the only dynamic parts and must be whitelisted;
+    # {pk} and {columns} are derived from the table, {placeholders} from a count,
+    # everything else is a bound parameter
+    SQL = {
+        "count": "SELECT COUNT(*) FROM {table}",
+        "exists": "SELECT COUNT(*) FROM {table} WHERE {pk} = %s",
+        "keys_in": "SELECT {pk} FROM {table} WHERE {pk} IN ({placeholders})",
+        "delete": "DELETE FROM {table} WHERE {pk} = %s",
+        "select_all": "SELECT {columns} FROM {source}",
+        "search_like": "SELECT {columns} FROM {source} WHERE {field} LIKE %s",
+        "search_phone_key": "SELECT {columns} FROM {source} WHERE PH_KEY = %s",
+        "diagnosis": "SELECT DIAGNOSIS FROM {source} WHERE RID = %s",
+        "dept_ids": "SELECT DepID FROM DEPT ORDER BY DepID",
+        "queue_today": """
+            SELECT A.AID, A.DID, A.PID, P.F_NAME, P.L_NAME, A.A_TIME,
+                   COALESCE(C.STATUS, 'BOOKED'), COALESCE(C.PRIORITY, 0), C.CHECKED_IN_AT
+            FROM APPOINTMENT A
+            LEFT JOIN PATIENT P ON P.PID = A.PID
+            LEFT JOIN APPOINTMENT_CHECKIN C ON C.AID = A.AID
+            WHERE A.A_DATE = %s""",
+        "queue_patient_name": "SELECT F_NAME, L_NAME FROM PATIENT WHERE PID = %s",
+        "queue_last_event": "SELECT COALESCE(MAX(SEQ), 0) FROM QUEUE_EVENT",
+        "queue_events": "SELECT SEQ, AID, STATUS, PRIORITY, CHECKED_IN_AT FROM QUEUE_EVENT WHERE SEQ > %s ORDER BY SEQ",
+        "queue_set_status": """
+            INSERT INTO APPOINTMENT_CHECKIN (AID, STATUS, PRIORITY, CHECKED_IN_AT) VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE STATUS = VALUES(STATUS), PRIORITY = VALUES(PRIORITY),
+                CHECKED_IN_AT = COALESCE(CHECKED_IN_AT, VALUES(CHECKED_IN_AT))""",
+        "queue_add_event": "INSERT INTO QUEUE_EVENT (AID, STATUS, PRIORITY, CHECKED_IN_AT) SELECT AID, STATUS, PRIORITY, CHECKED_IN_AT FROM APPOINTMENT_CHECKIN WHERE AID = %s",
+        "reminder_batch": """
+            SELECT A.AID, A.A_DATE, A.A_TIME, P.F_NAME, P.L_NAME, P.EMAIL, P.PH, D.F_NAME, D.L_NAME, DP.D_NAME
+            FROM APPOINTMENT A
+            JOIN PATIENT P ON P.PID = A.PID
+            LEFT JOIN DOCTOR D ON D.DID = A.DID
+            LEFT JOIN DEPT DP ON DP.DepID = A.DepID
+            LEFT JOIN REMINDER_LOG R ON R.AID = A.AID AND R.CHANNEL = %s
+            WHERE A.A_DATE = %s AND A.AID > %s AND (R.AID IS NULL OR R.STATUS NOT IN ('SENT', 'REJECTED'))
+            ORDER BY A.AID LIMIT %s""",
+        "reminder_log": """
+            INSERT INTO REMINDER_LOG (AID, CHANNEL, STATUS, ATTEMPTS, ERROR) VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE STATUS = VALUES(STATUS), ATTEMPTS = ATTEMPTS + VALUES(ATTEMPTS),
+                ERROR = VALUES(ERROR), UPDATED_AT = CURRENT_TIMESTAMP""",
+        "calendar_range": "SELECT {columns} FROM {source} WHERE A_DATE BETWEEN %s AND %s",
+        "calendar_range_doctor": "SELECT {columns} FROM {source} WHERE DID = %s AND A_DATE BETWEEN %s AND %s",
+        "calendar_range_dept": "SELECT {columns} FROM {source} WHERE DepID = %s AND A_DATE BETWEEN %s AND %s",
+        "visit_summary": """
+            SELECT V.LAST_VISIT, V.VISIT_COUNT, V.DIAGNOSIS_PREVIEW, D.F_NAME, D.L_NAME
+            FROM PATIENT_LAST_VISIT V LEFT JOIN DOCTOR D ON D.DID = V.LAST_DID
+            WHERE V.PID = %s""",
+        "patient_insert": "INSERT INTO PATIENT (PID, F_NAME, L_NAME, DOB, PH, EMAIL, PH_KEY) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+        "patient_update": "UPDATE PATIENT SET PID=%s, F_NAME=%s, L_NAME=%s, DOB=%s, PH=%s, EMAIL=%s, PH_KEY=%s, VERSION=VERSION+1 WHERE PID=%s AND VERSION=%s",
+        "doctor_insert": "INSERT INTO DOCTOR (DID, F_NAME, L_NAME, SPEC, PH, EMAIL, PH_KEY) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+        "doctor_update": "UPDATE DOCTOR SET DID=%s, F_NAME=%s, L_NAME=%s, SPEC=%s, PH=%s, EMAIL=%s, PH_KEY=%s, VERSION=VERSION+1 WHERE DID=%s AND VERSION=%s",
+        "dept_insert": "INSERT INTO DEPT (DepID, D_NAME, FLOOR, TELEPHONE) VALUES (%s, %s, %s, %s)",
+        "dept_update": "UPDATE DEPT SET DepID=%s, D_NAME=%s, FLOOR=%s, TELEPHONE=%s, VERSION=VERSION+1 WHERE DepID=%s AND VERSION=%s",
+        "appointment_insert": "INSERT INTO APPOINTMENT (AID, PID, DID, A_DATE, A_TIME, DepID) VALUES (%s, %s, %s, %s, %s, %s)",
+        "appointment_update": "UPDATE APPOINTMENT SET AID=%s, PID=%s, DID=%s, A_DATE=%s, A_TIME=%s, DepID=%s, VERSION=VERSION+1 WHERE AID=%s AND VERSION=%s",
+        "medrecord_insert": "INSERT INTO MED_RECORD (RID, PID, DID, LAST_VISIT, DIAGNOSIS) VALUES (%s, %s, %s, %s, %s)",
+        "medrecord_update": "UPDATE MED_RECORD SET RID=%s, PID=%s, DID=%s, LAST_VISIT=%s, DIAGNOSIS=%s, VERSION=VERSION+1 WHERE RID=%s AND VERSION=%s",
+        "audit_insert": "INSERT INTO AUDIT_LOG (AT, ACTOR, ACTION, TBL, PK, BEFORE_VALUES, AFTER_VALUES) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+        "audit_entity": """
+            SELECT AT, ACTOR, ACTION, TBL, PK, BEFORE_VALUES, AFTER_VALUES FROM AUDIT_LOG
+            WHERE TBL = %s AND PK = %s AND AT BETWEEN %s AND %s ORDER BY AT DESC, SEQ DESC LIMIT %s""",
+        "audit_table": """
+            SELECT AT, ACTOR, ACTION, TBL, PK, BEFORE_VALUES, AFTER_VALUES FROM AUDIT_LOG
+            WHERE TBL = %s AND AT BETWEEN %s AND %s ORDER BY AT DESC, SEQ DESC LIMIT %s""",
+        "audit_range": """
+            SELECT AT, ACTOR, ACTION, TBL, PK, BEFORE_VALUES, AFTER_VALUES FROM AUDIT_LOG
+            WHERE AT BETWEEN %s AND %s ORDER BY AT DESC, SEQ DESC LIMIT %s""",
+    }
+    # Columns each table may be searched on (the search boxes offer exactly these)
+    SEARCH_FIELDS = {
+        "PATIENT": ("PID", "F_NAME", "L_NAME", "PH", "EMAIL"),
+        "DOCTOR": ("DID", "F_NAME", "L_NAME", "SPEC", "PH", "EMAIL"),
+        "DEPT": ("DepID", "D_NAME", "FLOOR", "TELEPHONE"),
+        "APPOINTMENT": ("AID", "PID", "DID", "DepID", "A_DATE"),
+        "MED_RECORD": ("RID", "PID", "DID", "LAST_VISIT"),
+    }
+    # The catalog INSERT that new rows of each table go through
+    INSERTS = {
+        "PATIENT": "patient_insert",
+        "DOCTOR": "doctor_insert",
+        "DEPT": "dept_insert",
+        "APPOINTMENT": "appointment_insert",
+        "MED_RECORD": "medrecord_insert",
+    }
+    _rendered = {}
+    # connection -> {sql: prepared cursor}; entries go away with the connection
+    _cursors = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def sql(name, table=None, field=None, archive=False, size=None):
+        """Render a named statement; unknown tables or fields raise ValueError"""
+        key = (name, table, field, archive, size)
+        text = Statements._rendered.get(key)
+        if text is None:
+            parts = {}
+            if table is not None:
+                if table not in DeltaSync.TABLES:
+                    raise ValueError(f"Unknown table: {table}")
+                parts = {
+                    "table": table,
+                    "source": Archiver.archive_table(table) if archive else table,
+                    "pk": DeltaSync.TABLES[table][0],
+                    "columns": DeltaSync.select_list(table),
+                }
+            if field is not None:
+                if field not in Statements.SEARCH_FIELDS.get(table, ()):
+                    raise ValueError(f"Cannot search {table} by {field}")
+                parts["field"] = field
+            if size is not None:
+                parts["placeholders"] = ", ".join(["%s"] * size)
+            text = Statements.SQL[name].format(**parts)
+            Statements._rendered[key] = text
+        return text
+
+    @staticmethod
+    def cursor(connection, sql):
+        """One prepared cursor per statement and connection, so each statement is parsed once"""
+        cursors = Statements._cursors.setdefault(connection, {})
+        cursor = cursors.get(sql)
+        if cursor is None:
+            try:
+                cursor = connection.cursor(prepared=True)
+            except TypeError:
+                # The SQLite replica keeps its own compiled-statement cache
+                cursor = connection.cursor()
+            cursors[sql] = cursor
+        return cursor
+
+    @staticmethod
+    def query(connection, name, params=(), **parts):
+        """Run a named SELECT and return all rows"""
+        sql = Statements.sql(name, **parts)
+        cursor = Statements.cursor(connection, sql)
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    @staticmethod
+    def execute(connection, name, params=(), **parts):
+        """Run a named write and return the number of affected rows"""
+        sql = Statements.sql(name, **parts)
+        cursor = Statements.cursor(connection, sql)
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+    @staticmethod
+    def execute_many(connection, name, rows, **parts):
+        """Bulk write; a plain cursor sends an INSERT as one multi-row statement,
+        where a prepared cursor would make a round trip per row"""
+        cursor = connection.cursor()
+        cursor.executemany(Statements.sql(name, **parts), rows)
+        return cursor.rowcount
+
+# Daily appointment rollup maintained by the appointment write paths
+class AppointmentRollup:
+    @staticmethod
+    def create_table(cursor):
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS APPT_DAILY_ROLLUP (
+            A_DATE DATE NOT NULL,
+            DepID INT NOT NULL DEFAULT 0,
+            DID INT NOT NULL DEFAULT 0,
+            APPT_COUNT INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (A_DATE, DepID, DID),
+            INDEX IDX_ROLLUP_DEPT (DepID, A_DATE),
+            INDEX IDX_ROLLUP_DOCTOR (DID, A_DATE)
         )
         """)
 
-        csr.execute("""
-        CREATE TABLE IF NOT EXISTS DOCTOR (
-            DID INT PRIMARY KEY,
-            F_NAME VARCHAR(50),
-            L_NAME VARCHAR(50),
-            SPEC VARCHAR(50),
-            PH VARCHAR(15),
-            EMAIL VARCHAR(100)
-        )
+    @staticmethod
+    def backfill(cursor):
+        """Build the rollup once from APPOINTMENT if it has never been populated.
+
+        Archived appointments still count in the trends, so the archive is included.
+        """
+        cursor.execute("SELECT COUNT(*) FROM APPT_DAILY_ROLLUP")
+        if cursor.fetchone()[0] > 0:
+            return
+        cursor.execute(f"""
+        INSERT INTO APPT_DAILY_ROLLUP (A_DATE, DepID, DID, APPT_COUNT)
+        SELECT A_DATE, COALESCE(DepID, 0), COALESCE(DID, 0), COUNT(*)
+        FROM (
+            SELECT A_DATE, DepID, DID FROM APPOINTMENT
+            UNION ALL
+            SELECT A_DATE, DepID, DID FROM {Archiver.archive_table("APPOINTMENT")}
+        ) APPOINTMENTS
+        WHERE A_DATE IS NOT NULL
+        GROUP BY A_DATE, COALESCE(DepID, 0), COALESCE(DID, 0)
         """)
 
-        csr.execute("""
-        CREATE TABLE IF NOT EXISTS PATIENT (
+    @staticmethod
+    def apply(cursor, a_date, did, depid, delta):
+        """Add delta to the bucket of one appointment; call inside the write's transaction"""
+        if not a_date:
+            return
+        cursor.execute("""
+        INSERT INTO APPT_DAILY_ROLLUP (A_DATE, DepID, DID, APPT_COUNT) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE APPT_COUNT = APPT_COUNT + VALUES(APPT_COUNT)
+        """, (a_date, depid or 0, did or 0, delta))
+
+    @staticmethod
+    def apply_many(cursor, keys, delta):
+        """Bulk variant of apply for (A_DATE, DID, DepID) keys"""
+        cursor.executemany("""
+        INSERT INTO APPT_DAILY_ROLLUP (A_DATE, DepID, DID, APPT_COUNT) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE APPT_COUNT = APPT_COUNT + VALUES(APPT_COUNT)
+        """, [(a_date, depid or 0, did or 0, delta) for a_date, did, depid in keys if a_date])
+
+    @staticmethod
+    def fetch_appointment_key(cursor, aid):
+        """Return (A_DATE, DID, DepID) of a stored appointment, or None"""
+        cursor.execute("SELECT A_DATE, DID, DepID FROM APPOINTMENT WHERE AID = %s", (aid,))
+        return cursor.fetchone()
+
+    @staticmethod
+    def count_for_date(cursor, day):
+        cursor.execute("SELECT COALESCE(SUM(APPT_COUNT), 0) FROM APPT_DAILY_ROLLUP WHERE A_DATE = %s", (day,))
+        return int(cursor.fetchone()[0])
+
+    @staticmethod
+    def daily_series(cursor, days, depid=None, did=None, end=None):
+        """Return one count per day for the last `days` days, oldest first, zero-filled"""
+        end = end or datetime.now().date()
+        start = end - timedelta(days=days - 1)
+        query = "SELECT A_DATE, SUM(APPT_COUNT) FROM APPT_DAILY_ROLLUP WHERE A_DATE BETWEEN %s AND %s"
+        params = [start, end]
+        if depid is not None:
+            query += " AND DepID = %s"
+            params.append(depid)
+        if did is not None:
+            query += " AND DID = %s"
+            params.append(did)
+        cursor.execute(query + " GROUP BY A_DATE", tuple(params))
+        counts = {str(row[0]): int(row[1]) for row in cursor.fetchall()}
+        return [counts.get(str(start + timedelta(days=i)), 0) for i in range(days)]
+
+# Latest visit per patient, kept current from the medical-record write paths
+class VisitSummary:
+    """One row per patient with the most recent medical record and the number of
+    records, archived ones included. Handlers refresh the affected patients in
+    the same transaction as their write, so the patient form never has to scan
+    MED_RECORD."""
+    @staticmethod
+    def create_table(cursor):
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS PATIENT_LAST_VISIT (
             PID INT PRIMARY KEY,
-            F_NAME VARCHAR(50),
-            L_NAME VARCHAR(50),
-            DOB DATE,
-            PH VARCHAR(15),
-            EMAIL VARCHAR(100)
+            LAST_VISIT DATE,
+            LAST_DID INT,
+            LAST_RID INT,
+            DIAGNOSIS_PREVIEW VARCHAR({DeltaSync.DIAGNOSIS_PREVIEW_CHARS}),
+            VISIT_COUNT INT NOT NULL DEFAULT 0
         )
         """)
 
-        csr.execute("""
-        CREATE TABLE IF NOT EXISTS APPOINTMENT (
-            AID INT PRIMARY KEY,
-            PID INT,
-            DID INT,
-            A_DATE DATE,
-            A_TIME TIME,
-            DepID INT,
-            FOREIGN KEY (PID) REFERENCES PATIENT(PID),
-            FOREIGN KEY (DID) REFERENCES DOCTOR(DID),
-            FOREIGN KEY (DepID) REFERENCES DEPT(DepID)
+    @staticmethod
+    def backfill(cursor):
+        """Build the summary once from the medical records if it has never been populated"""
+        cursor.execute("SELECT COUNT(*) FROM PATIENT_LAST_VISIT")
+        if cursor.fetchone()[0] > 0:
+            return
+        cursor.execute(VisitSummary.insert_sql("PID IS NOT NULL"))
+
+    @staticmethod
+    def insert_sql(condition):
+        sources = " UNION ALL ".join(
+            f"SELECT PID, LAST_VISIT, DID, RID, DIAGNOSIS FROM {table} WHERE {condition}"
+            for table in ("MED_RECORD", Archiver.archive_table("MED_RECORD"))
+        )
+        return f"""
+        INSERT INTO PATIENT_LAST_VISIT (PID, LAST_VISIT, LAST_DID, LAST_RID, DIAGNOSIS_PREVIEW, VISIT_COUNT)
+        SELECT PID, LAST_VISIT, DID, RID, LEFT(DIAGNOSIS, {DeltaSync.DIAGNOSIS_PREVIEW_CHARS}), VISIT_COUNT
+        FROM (
+            SELECT PID, LAST_VISIT, DID, RID, DIAGNOSIS,
+                ROW_NUMBER() OVER (PARTITION BY PID ORDER BY LAST_VISIT DESC, RID DESC) AS RN,
+                COUNT(*) OVER (PARTITION BY PID) AS VISIT_COUNT
+            FROM ({sources}) RECORDS
+        ) RANKED
+        WHERE RN = 1
+        """
+
+    @staticmethod
+    def statements(pids):
+        """(sql, params) pairs that recompute the rows of the given patients"""
+        pids = sorted({int(pid) for pid in pids if pid not in (None, "")})
+        if not pids:
+            return []
+        placeholders = ", ".join(["%s"] * len(pids))
+        return [
+            (f"DELETE FROM PATIENT_LAST_VISIT WHERE PID IN ({placeholders})", tuple(pids)),
+            (VisitSummary.insert_sql(f"PID IN ({placeholders})"), tuple(pids) * 2),
+        ]
+
+    @staticmethod
+    def refresh(cursor, pids):
+        """Recompute the given patients' rows; call inside the write's transaction"""
+        for sql, params in VisitSummary.statements(pids):
+            cursor.execute(sql, params)
+
+# Row versioning and delta sync between clients
+class DeltaSync:
+    # table -> (primary key, displayed columns in Treeview order)
+    TABLES = {
+        "PATIENT": ("PID", ["PID", "F_NAME", "L_NAME", "DOB", "PH", "EMAIL"]),
+        "DOCTOR": ("DID", ["DID", "F_NAME", "L_NAME", "SPEC", "PH", "EMAIL"]),
+        "DEPT": ("DepID", ["DepID", "D_NAME", "FLOOR", "TELEPHONE"]),
+        "APPOINTMENT": ("AID", ["AID", "PID", "DID", "A_DATE", "A_TIME", "DepID"]),
+        "MED_RECORD": ("RID", ["RID", "PID", "DID", "LAST_VISIT", "DIAGNOSIS"]),
+    }
+    # Columns listed here are only loaded as a short preview; the full value
+    # is fetched on demand for the selected row
+    DIAGNOSIS_PREVIEW_CHARS = 80
+    PREVIEWS = {
+        ("MED_RECORD", "DIAGNOSIS"): f"LEFT(DIAGNOSIS, {DIAGNOSIS_PREVIEW_CHARS})",
+    }
+    # Columns that are not displayed but must still be copied to replicas
+    REPLICATED_EXTRAS = {
+        "PATIENT": ["PH_KEY"],
+        "DOCTOR": ["PH_KEY"],
+    }
+    POLL_INTERVAL_MS = 3000
+    # Rows stamped inside a transaction that commits after our poll would be
+    # missed by a strict "> cursor" filter, so each poll re-reads a short window.
+    OVERLAP_SECONDS = 5
+    TOMBSTONE_RETENTION_DAYS = 7
+
+    @staticmethod
+    def ensure_schema(cursor):
+        for table in DeltaSync.TABLES:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'VERSION'",
+                (table,)
+            )
+            if cursor.fetchone()[0] == 0:
+                cursor.execute(f"""
+                ALTER TABLE {table}
+                    ADD COLUMN VERSION INT NOT NULL DEFAULT 1,
+                    ADD COLUMN UPDATED_AT TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+                    ADD INDEX IDX_{table}_UPDATED_AT (UPDATED_AT)
+                """)
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS SYNC_TOMBSTONE (
+            TBL VARCHAR(20) NOT NULL,
+            PK INT NOT NULL,
+            DELETED_AT TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+            INDEX IDX_TOMBSTONE_TBL_TIME (TBL, DELETED_AT)
         )
         """)
 
-        csr.execute("""
-        CREATE TABLE IF NOT EXISTS MED_RECORD (
-            RID INT PRIMARY KEY,
-            PID INT,
-            DID INT,
-            LAST_VISIT DATE,
-            DIAGNOSIS TEXT,
-            FOREIGN KEY (PID) REFERENCES PATIENT(PID),
-            FOREIGN KEY (DID) REFERENCES DOCTOR(DID)
+    @staticmethod
+    def prune_tombstones(cursor):
+        cursor.execute(
+            "DELETE FROM SYNC_TOMBSTONE WHERE DELETED_AT < NOW(6) - INTERVAL %s DAY",
+            (DeltaSync.TOMBSTONE_RETENTION_DAYS,)
+        )
+
+    @staticmethod
+    def select_list(table, preview=True):
+        """Displayed columns followed by VERSION, which always ends up as the last Treeview value.
+
+        With preview=True, large text columns are truncated server-side (see PREVIEWS).
+        """
+        columns = DeltaSync.TABLES[table][1]
+        if preview:
+            columns = [DeltaSync.PREVIEWS.get((table, col), col) for col in columns]
+        else:
+            columns = columns + DeltaSync.REPLICATED_EXTRAS.get(table, [])
+        return ", ".join(columns + ["VERSION"])
+
+    @staticmethod
+    def server_time(cursor):
+        cursor.execute("SELECT NOW(6)")
+        now = cursor.fetchone()[0]
+        # SQLite replicas return the timestamp as text
+        return datetime.fromisoformat(now) if isinstance(now, str) else now
+
+    @staticmethod
+    def record_delete(cursor, table, pk):
+        """Leave a tombstone so other clients drop the row; call inside the delete's transaction"""
+        cursor.execute("INSERT INTO SYNC_TOMBSTONE (TBL, PK) VALUES (%s, %s)", (table, pk))
+
+    @staticmethod
+    def changes_since(cursor, table, since, preview=True):
+        """Return (changed rows, deleted primary keys, new cursor) for one table"""
+        new_cursor = DeltaSync.server_time(cursor)
+        window_start = since - timedelta(seconds=DeltaSync.OVERLAP_SECONDS)
+        pk = DeltaSync.TABLES[table][0]
+
+        cursor.execute(
+            f"SELECT {DeltaSync.select_list(table, preview)} FROM {table} WHERE UPDATED_AT > %s ORDER BY {pk}",
+            (window_start,)
+        )
+        rows = cursor.fetchall()
+
+        cursor.execute(
+            "SELECT DISTINCT PK FROM SYNC_TOMBSTONE WHERE TBL = %s AND DELETED_AT > %s",
+            (table, window_start)
+        )
+        live = {str(row[0]) for row in rows}
+        deleted = [str(row[0]) for row in cursor.fetchall() if str(row[0]) not in live]
+        return rows, deleted, new_cursor
+
+    @staticmethod
+    def patch_tree(tree, rows, deleted, insert_new=True):
+        """Apply a delta to a Treeview whose item ids are primary keys"""
+        for row in rows:
+            iid = str(row[0])
+            if tree.exists(iid):
+                current = tree.item(iid, 'values')
+                if not current or str(current[-1]) != str(row[-1]):
+                    tree.item(iid, values=row)
+            elif insert_new:
+                tree.insert("", tk.END, iid=iid, values=row)
+        for iid in deleted:
+            if tree.exists(iid):
+                tree.delete(iid)
+
+def ensure_index(cursor, table, name, columns):
+    """CREATE INDEX for MySQL versions without IF NOT EXISTS"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s",
+        (table, name)
+    )
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+
+# Recurring appointments expanded from a rule and written as one set
+class AppointmentSeries:
+    """A series is a rule (daily, weekly, monthly on the same date, or monthly on
+    the same weekday such as the 2nd Tuesday) expanded into ordinary APPOINTMENT
+    rows. The doctor's schedule is checked for all dates with one range query,
+    and the rows go in with one executemany. APPOINTMENT_SERIES_MEMBER ties the
+    rows together, so moving or cancelling the rest of a series is one UPDATE or
+    DELETE joined on it rather than a statement per appointment."""
+    FREQUENCIES = ("daily", "weekly", "monthly", "monthly-weekday")
+    MAX_OCCURRENCES = 104
+    ORDINALS = {1: "1st", 2: "2nd", 3: "3rd", 4: "4th", -1: "last"}
+    WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+    COLUMNS = DeltaSync.TABLES["APPOINTMENT"][1]
+
+    @staticmethod
+    def create_schema(cursor):
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS APPOINTMENT_SERIES (
+            SERIES_ID INT AUTO_INCREMENT PRIMARY KEY,
+            PID INT NOT NULL,
+            RULE_TEXT VARCHAR(100) NOT NULL,
+            CREATED_AT TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS APPOINTMENT_SERIES_MEMBER (
+            AID INT PRIMARY KEY,
+            SERIES_ID INT NOT NULL,
+            INDEX IDX_SERIES_MEMBER_SERIES (SERIES_ID)
         )
         """)
 
-        conn.commit()
-    else:
-        raise Exception("Failed to connect to MySQL")
+    @staticmethod
+    def month_length(year, month):
+        return (date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)).day
 
-except Exception as e:
-    messagebox.showerror("Database Error", f"Error connecting to database: {str(e)}")
+    @staticmethod
+    def ordinal(day):
+        """Which occurrence of its weekday the day is in its month; a 5th one counts as the last"""
+        ordinal = (day.day - 1) // 7 + 1
+        return -1 if ordinal == 5 else ordinal
 
-# Main Application Class
-class ModernHospitalManagement:
-    def __init__(self):
-        self.root = tk.Tk()
-        self.setup_window()
-        self.create_styles()
-        self.create_header()
-        self.create_navigation()
-        self.create_main_content()
-        self.setup_data()
-        
-        # Start the Tkinter event loop
-        self.root.mainloop()
+    @staticmethod
+    def occurrence(start, frequency, step):
+        if frequency == "daily":
+            return start + timedelta(days=step)
+        if frequency == "weekly":
+            return start + timedelta(weeks=step)
+        month = start.month - 1 + step
+        year, month = start.year + month // 12, month % 12 + 1
+        length = AppointmentSeries.month_length(year, month)
+        if frequency == "monthly":
+            # The 31st falls back to the last day of shorter months
+            return date(year, month, min(start.day, length))
+        ordinal = AppointmentSeries.ordinal(start)
+        if ordinal == -1:
+            last = date(year, month, length)
+            return last - timedelta(days=(last.weekday() - start.weekday()) % 7)
+        first = date(year, month, 1)
+        return first + timedelta(days=(start.weekday() - first.weekday()) % 7 + 7 * (ordinal - 1))
 
-    def setup_window(self):
-        self.root.title("Hospital Management System")
-        self.root.geometry("1400x900")
-        self.root.configure(bg=ModernColors.BACKGROUND)
-        self.root.state('zoomed')  # Maximize window on Windows
-        
-        # Center window
-        self.root.update_idletasks()
-        x = (self.root.winfo_screenwidth() // 2) - (1400 // 2)
-        y = (self.root.winfo_screenheight() // 2) - (900 // 2)
-        self.root.geometry(f"1400x900+{x}+{y}")
-        
-        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
-    
-    def create_styles(self):
-        # Create custom fonts
-        self.title_font = font.Font(family="Segoe UI", size=24, weight="bold")
-        self.heading_font = font.Font(family="Segoe UI", size=16, weight="bold")
-        self.subheading_font = font.Font(family="Segoe UI", size=12, weight="bold")
-        self.body_font = font.Font(family="Segoe UI", size=10)
-    
-    def create_header(self):
-        # Header frame
-        header_frame = tk.Frame(self.root, bg=ModernColors.PRIMARY, height=80)
-        header_frame.pack(fill="x", pady=(0, 2))
-        header_frame.pack_propagate(False)
-        
-        # Title
-        title_label = tk.Label(
-            header_frame, 
-            text="🏥 Hospital Management System",
-            font=self.title_font,
-            bg=ModernColors.PRIMARY,
-            fg="white"
+    @staticmethod
+    def expand(start, frequency, interval=1, count=None, until=None):
+        """Dates of the series, starting with start; give a number of occurrences, an end date or both"""
+        if frequency not in AppointmentSeries.FREQUENCIES:
+            raise ValueError(f"Unknown repeat: {frequency}")
+        if interval < 1:
+            raise ValueError("Repeat every must be at least 1")
+        if not count and not until:
+            raise ValueError("Give a number of occurrences or an end date")
+        if count is not None and count < 1:
+            raise ValueError("Occurrences must be at least 1")
+        if until and until < start:
+            raise ValueError("The end date is before the first appointment")
+        limit = min(count or AppointmentSeries.MAX_OCCURRENCES + 1, AppointmentSeries.MAX_OCCURRENCES + 1)
+        dates = []
+        while len(dates) < limit:
+            day = AppointmentSeries.occurrence(start, frequency, len(dates) * interval)
+            if until and day > until:
+                break
+            dates.append(day)
+        if len(dates) > AppointmentSeries.MAX_OCCURRENCES:
+            raise ValueError(f"A series can have at most {AppointmentSeries.MAX_OCCURRENCES} appointments")
+        return dates
+
+    @staticmethod
+    def describe(start, frequency, interval=1, count=None, until=None):
+        """Human-readable rule, stored with the series"""
+        unit = {"daily": "day", "weekly": "week"}.get(frequency, "month")
+        text = f"Every {unit}" if interval == 1 else f"Every {interval} {unit}s"
+        weekday = AppointmentSeries.WEEKDAYS[start.weekday()]
+        if frequency == "weekly":
+            text += f" on {weekday}"
+        elif frequency == "monthly":
+            text += f" on day {start.day}"
+        elif frequency == "monthly-weekday":
+            text += f" on the {AppointmentSeries.ORDINALS[AppointmentSeries.ordinal(start)]} {weekday}"
+        if count:
+            text += f", {count} times"
+        if until:
+            text += f", until {until}"
+        return text
+
+    @staticmethod
+    def conflicts(cursor, did, a_time, dates, exclude=(), lock=False):
+        """Dates (as text) on which the doctor already has an appointment in the same
+        calendar slot, mapped to that appointment's AID.
+
+        One range query over IDX_APPOINTMENT_DID_DATE covers every date. With lock=True
+        the range stays locked until the transaction ends, so nobody can book into it
+        between the check and the insert.
+        """
+        if not dates:
+            return {}
+        cursor.execute(
+            "SELECT AID, A_DATE, A_TIME FROM APPOINTMENT WHERE DID = %s AND A_DATE BETWEEN %s AND %s" + (" FOR UPDATE" if lock else ""),
+            (did, min(dates), max(dates))
         )
-        title_label.pack(pady=20)
-        
-        # Subtitle
-        subtitle_label = tk.Label(
-            header_frame,
-            text="Advanced Healthcare Management Solution",
-            font=("Segoe UI", 10),
-            bg=ModernColors.PRIMARY,
-            fg="#93c5fd"
+        slot = AppointmentCalendar.minutes(a_time) // AppointmentCalendar.SLOT_MINUTES
+        wanted = {str(day) for day in dates}
+        exclude = {str(aid) for aid in exclude}
+        clashes = {}
+        for aid, a_date, existing_time in cursor.fetchall():
+            if (str(a_date) in wanted and str(aid) not in exclude
+                    and AppointmentCalendar.minutes(existing_time) // AppointmentCalendar.SLOT_MINUTES == slot):
+                clashes.setdefault(str(a_date), aid)
+        return clashes
+
+    @staticmethod
+    def create(connection, pid, did, depid, a_time, dates, rule_text, skip_conflicts=False):
+        """Insert the whole series in one transaction; returns (SERIES_ID, inserted rows, skipped dates).
+
+        Keys come from one ID_BLOCK lease sized to the series. Dates the doctor is
+        already booked on are skipped with skip_conflicts, and fail the series otherwise.
+        """
+        if not dates:
+            raise ValueError("The series has no dates")
+        cursor = connection.cursor()
+        try:
+            clashes = AppointmentSeries.conflicts(cursor, did, a_time, dates, lock=True)
+            if clashes and not skip_conflicts:
+                raise ValueError(f"Doctor {did} is already booked at that time on {', '.join(sorted(clashes))}")
+            dates = [day for day in dates if str(day) not in clashes]
+            if not dates:
+                raise ValueError("The doctor is already booked on every date of the series")
+            # Leased only once the series will be saved, so a refused one wastes no keys;
+            # leasing commits, so it runs on a connection of its own
+            first_aid = IdAllocator.lease_over(lease_connection, "APPOINTMENT", len(dates))
+            cursor.execute("INSERT INTO APPOINTMENT_SERIES (PID, RULE_TEXT) VALUES (%s, %s)", (pid, rule_text))
+            series_id = cursor.lastrowid
+            rows = [(first_aid + index, pid, did, day, a_time, depid) for index, day in enumerate(dates)]
+            Statements.execute_many(connection, "appointment_insert", rows)
+            cursor.executemany("INSERT INTO APPOINTMENT_SERIES_MEMBER (AID, SERIES_ID) VALUES (%s, %s)",
+                               [(row[0], series_id) for row in rows])
+            AppointmentRollup.apply_many(cursor, [(day, did, depid) for day in dates], 1)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        return series_id, rows, sorted(clashes)
+
+    @staticmethod
+    def of_appointment(cursor, aid):
+        """(SERIES_ID, RULE_TEXT) of the series an appointment belongs to, or None"""
+        cursor.execute(
+            "SELECT S.SERIES_ID, S.RULE_TEXT FROM APPOINTMENT_SERIES_MEMBER M "
+            "JOIN APPOINTMENT_SERIES S ON S.SERIES_ID = M.SERIES_ID WHERE M.AID = %s",
+            (aid,)
         )
-        subtitle_label.pack()
-    
-    def create_navigation(self):
-        # Navigation frame
-        nav_frame = tk.Frame(self.root, bg=ModernColors.SURFACE, height=60)
-        nav_frame.pack(fill="x", pady=(0, 10))
-        nav_frame.pack_propagate(False)
-        
-        # Navigation buttons
+        return cursor.fetchone()
+
+    @staticmethod
+    def members(cursor, series_id, from_day=None, lock=False):
+        """The series' appointments still in APPOINTMENT, in DeltaSync column order, by date"""
+        cursor.execute(
+            f"SELECT {', '.join('A.' + column for column in AppointmentSeries.COLUMNS)} FROM APPOINTMENT A "
+            "JOIN APPOINTMENT_SERIES_MEMBER M ON M.AID = A.AID "
+            "WHERE M.SERIES_ID = %s AND A.A_DATE >= %s ORDER BY A.A_DATE, A.AID" + (" FOR UPDATE" if lock else ""),
+            (series_id, from_day or date.min)
+        )
+        return cursor.fetchall()
+
+    @staticmethod
+    def update(connection, series_id, from_day, did, a_time, depid):
+        """Move every appointment of the series on or after from_day to another doctor,
+        time or department with one UPDATE; returns (rows before, rows after)"""
+        cursor = connection.cursor()
+        try:
+            before = AppointmentSeries.members(cursor, series_id, from_day, lock=True)
+            if not before:
+                connection.rollback()
+                return [], []
+            clashes = AppointmentSeries.conflicts(cursor, did, a_time, [row[3] for row in before],
+                                                  exclude=[row[0] for row in before], lock=True)
+            if clashes:
+                raise ValueError(f"Doctor {did} is already booked at that time on {', '.join(sorted(clashes))}")
+            AppointmentRollup.apply_many(cursor, [(row[3], row[2], row[5]) for row in before], -1)
+            cursor.execute(
+                "UPDATE APPOINTMENT A JOIN APPOINTMENT_SERIES_MEMBER M ON M.AID = A.AID "
+                "SET A.DID = %s, A.A_TIME = %s, A.DepID = %s, A.VERSION = A.VERSION + 1 "
+                "WHERE M.SERIES_ID = %s AND A.A_DATE >= %s",
+                (did, a_time, depid, series_id, from_day)
+            )
+            AppointmentRollup.apply_many(cursor, [(row[3], did, depid) for row in before], 1)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        return before, [(row[0], row[1], did, row[3], a_time, depid) for row in before]
+
+    @staticmethod
+    def cancel(connection, series_id, from_day):
+        """Delete every appointment of the series on or after from_day with one DELETE; returns the rows removed"""
+        cursor = connection.cursor()
+        try:
+            removed = AppointmentSeries.members(cursor, series_id, from_day, lock=True)
+            if not removed:
+                connection.rollback()
+                return []
+            AppointmentRollup.apply_many(cursor, [(row[3], row[2], row[5]) for row in removed], -1)
+            cursor.execute(
+                "DELETE A FROM APPOINTMENT A JOIN APPOINTMENT_SERIES_MEMBER M ON M.AID = A.AID "
+                "WHERE M.SERIES_ID = %s AND A.A_DATE >= %s",
+                (series_id, from_day)
+            )
+            keys = [row[0] for row in removed]
+            cursor.execute(f"DELETE FROM APPOINTMENT_SERIES_MEMBER WHERE AID IN ({', '.join(['%s'] * len(keys))})", tuple(keys))
+            # Let other clients drop the rows from their hot views
+            cursor.executemany("INSERT INTO SYNC_TOMBSTONE (TBL, PK) VALUES (%s, %s)", [("APPOINTMENT", key) for key in keys])
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        return removed
+
+# Hot/cold archival of old appointments and medical records
+class Archiver:
+    # InnoDB cannot partition tables that have foreign keys, so old rows are
+    # moved into *_ARCHIVE tables instead of date partitions.
+    # table -> date column that decides the age of a row
+    TABLES = {
+        "APPOINTMENT": "A_DATE",
+        "MED_RECORD": "LAST_VISIT",
+    }
+    DEFAULT_AGE_DAYS = int(os.environ.get("HOSPITAL_ARCHIVE_AFTER_DAYS", "730"))
+    BATCH_SIZE = 500
+
+    @staticmethod
+    def archive_table(table):
+        return f"{table}_ARCHIVE"
+
+    @staticmethod
+    def create_tables(cursor):
+        for table, date_column in Archiver.TABLES.items():
+            ensure_index(cursor, table, f"IDX_{table}_{date_column}", date_column)
+            # LIKE copies columns and indexes but not foreign keys, so archived
+            # rows never block deletes on the hot tables
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {Archiver.archive_table(table)} LIKE {table}")
+
+    @staticmethod
+    def archive_batch(cursor, table, cutoff, batch_size=BATCH_SIZE):
+        """Move one batch of rows older than cutoff; returns the number of rows moved.
+
+        Each batch is its own short transaction so the hot table is never locked for long.
+        """
+        pk = DeltaSync.TABLES[table][0]
+        date_column = Archiver.TABLES[table]
+        cursor.execute(
+            f"SELECT {pk} FROM {table} WHERE {date_column} < %s ORDER BY {date_column} LIMIT %s",
+            (cutoff, batch_size)
+        )
+        keys = [row[0] for row in cursor.fetchall()]
+        if not keys:
+            return 0
+
+        placeholders = ", ".join(["%s"] * len(keys))
+        cursor.execute(
+            f"INSERT INTO {Archiver.archive_table(table)} SELECT * FROM {table} WHERE {pk} IN ({placeholders})",
+            tuple(keys)
+        )
+        cursor.execute(f"DELETE FROM {table} WHERE {pk} IN ({placeholders})", tuple(keys))
+        # Let other clients drop the rows from their hot views
+        cursor.executemany("INSERT INTO SYNC_TOMBSTONE (TBL, PK) VALUES (%s, %s)", [(table, key) for key in keys])
+        return len(keys)
+
+    @staticmethod
+    def run(connection, age_days=DEFAULT_AGE_DAYS, batch_size=BATCH_SIZE, pause=0.1, progress=print):
+        """Archive everything older than age_days in small batches"""
+        cutoff = datetime.now().date() - timedelta(days=age_days)
+        cursor = connection.cursor()
+        totals = {}
+        for table in Archiver.TABLES:
+            totals[table] = 0
+            while True:
+                try:
+                    moved = Archiver.archive_batch(cursor, table, cutoff, batch_size)
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+                totals[table] += moved
+                if moved:
+                    progress(f"{table}: archived {totals[table]} rows older than {cutoff}")
+                if moved < batch_size:
+                    break
+                # Give interactive clients room between batches
+                time.sleep(pause)
+        return totals
+
+# Managed removal of patients and doctors that still have appointments or records
+class RecordRemover:
+    # parent table -> column its dependents reference it by
+    PARENTS = {"PATIENT": "PID", "DOCTOR": "DID"}
+    DEPENDENTS = ("APPOINTMENT", "MED_RECORD")
+    # archive: move the history to the *_ARCHIVE tables, then delete the parent
+    # purge: delete the history everywhere, including earlier archives
+    # anonymize: keep the history and scrub the patient's personal details
+    # A doctor's records belong to their patients, so doctors can only be archived.
+    MODES = {"PATIENT": ("archive", "purge", "anonymize"), "DOCTOR": ("archive",)}
+    ANONYMIZED = {
+        "PATIENT": "F_NAME = 'Anonymized', L_NAME = 'Patient', DOB = NULL, PH = NULL, PH_KEY = NULL, EMAIL = NULL",
+    }
+    BATCH_SIZE = 200
+
+    @staticmethod
+    def dependent_counts(cursor, table, key):
+        """Rows in the hot tables that still reference the parent"""
+        fk = RecordRemover.PARENTS[table]
+        counts = {}
+        for dependent in RecordRemover.DEPENDENTS:
+            cursor.execute(f"SELECT COUNT(*) FROM {dependent} WHERE {fk} = %s", (key,))
+            counts[dependent] = cursor.fetchone()[0]
+        return counts
+
+    @staticmethod
+    def future_appointments(cursor, table, key):
+        """Appointments from today on that reference the parent, as (AID, A_DATE, A_TIME, PID) by date"""
+        cursor.execute(
+            f"SELECT AID, A_DATE, A_TIME, PID FROM APPOINTMENT WHERE {RecordRemover.PARENTS[table]} = %s AND A_DATE >= %s "
+            "ORDER BY A_DATE, A_TIME",
+            (key, date.today())
+        )
+        return cursor.fetchall()
+
+    @staticmethod
+    def snapshot(cursor, source, column, keys):
+        """Whole rows as column -> value dicts, for the audit trail"""
+        placeholders = ", ".join(["%s"] * len(keys))
+        cursor.execute(f"SELECT * FROM {source} WHERE {column} IN ({placeholders})", tuple(keys))
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    @staticmethod
+    def remove_batch(cursor, source, dependent, fk, key, archive, batch_size=BATCH_SIZE, removed=None):
+        """Archive or delete one chunk of source rows referencing key; returns the number of rows removed.
+
+        With a `removed` list, (key, row before removal) pairs are appended to it;
+        archived rows live on in the archive, so only purged rows carry the row.
+        """
+        pk = DeltaSync.TABLES[dependent][0]
+        cursor.execute(f"SELECT {pk} FROM {source} WHERE {fk} = %s ORDER BY {pk} LIMIT %s", (key, batch_size))
+        keys = [row[0] for row in cursor.fetchall()]
+        if not keys:
+            return 0
+
+        if removed is not None:
+            if archive:
+                removed.extend((row_key, None) for row_key in keys)
+            else:
+                removed.extend((row[pk], row) for row in RecordRemover.snapshot(cursor, source, pk, keys))
+        placeholders = ", ".join(["%s"] * len(keys))
+        if archive:
+            cursor.execute(
+                f"INSERT INTO {Archiver.archive_table(dependent)} SELECT * FROM {source} WHERE {pk} IN ({placeholders})",
+                tuple(keys)
+            )
+        elif dependent == "APPOINTMENT":
+            # Archived appointments still count in the trends; purged ones do not
+            cursor.execute(f"SELECT A_DATE, DID, DepID FROM {source} WHERE {pk} IN ({placeholders})", tuple(keys))
+            AppointmentRollup.apply_many(cursor, cursor.fetchall(), -1)
+        cursor.execute(f"DELETE FROM {source} WHERE {pk} IN ({placeholders})", tuple(keys))
+        if source == dependent:
+            cursor.executemany("INSERT INTO SYNC_TOMBSTONE (TBL, PK) VALUES (%s, %s)", [(dependent, row_key) for row_key in keys])
+        return len(keys)
+
+    @staticmethod
+    def steps(connection, table, key, mode="archive", batch_size=BATCH_SIZE, include_future=False):
+        """Remove the parent and its history chunk by chunk, yielding a progress message after each commit.
+
+        Every chunk is its own short transaction. If the job is stopped or fails
+        half way, the chunks already done stay done and running it again resumes.
+        A doctor's upcoming appointments would silently drop off the schedule, so
+        a doctor who still has any is refused unless include_future is set.
+        """
+        if mode not in RecordRemover.MODES[table]:
+            raise ValueError(f"{table} cannot be removed with mode '{mode}'")
+        fk = RecordRemover.PARENTS[table]
+        cursor = connection.cursor()
+        if table == "DOCTOR" and not include_future:
+            upcoming = RecordRemover.future_appointments(cursor, table, key)
+            if upcoming:
+                raise ValueError(f"Doctor {key} still has {len(upcoming)} upcoming appointment(s), the first on {upcoming[0][1]}; "
+                                 "reassign or cancel them first")
+        audited = audit_log is not None
+
+        if mode == "anonymize":
+            try:
+                before = RecordRemover.snapshot(cursor, table, fk, [key]) if audited else []
+                cursor.execute(f"UPDATE {table} SET {RecordRemover.ANONYMIZED[table]}, VERSION = VERSION + 1 WHERE {fk} = %s", (key,))
+                cursor.execute("DELETE FROM PATIENT_MERGE_CANDIDATE WHERE PID_A = %s OR PID_B = %s", (key, key))
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            for row in before:
+                audit_event("ANONYMIZE", table, key, before=row)
+            yield f"{table} {key} anonymized"
+            return
+
+        sources = [(dependent, dependent) for dependent in RecordRemover.DEPENDENTS]
+        if mode == "purge":
+            sources += [(Archiver.archive_table(dependent), dependent) for dependent in RecordRemover.DEPENDENTS]
+        for source, dependent in sources:
+            removed = 0
+            while True:
+                rows = [] if audited else None
+                try:
+                    moved = RecordRemover.remove_batch(cursor, source, dependent, fk, key, mode == "archive", batch_size, rows)
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+                for row_key, before in rows or ():
+                    audit_event(mode.upper(), dependent, row_key, before=before)
+                removed += moved
+                if moved:
+                    yield f"{source}: {'archived' if mode == 'archive' else 'deleted'} {removed} rows"
+                if moved < batch_size:
+                    break
+
+        try:
+            before = RecordRemover.snapshot(cursor, table, fk, [key]) if audited else []
+            cursor.execute(f"DELETE FROM {table} WHERE {fk} = %s", (key,))
+            if table == "PATIENT":
+                cursor.execute("DELETE FROM PATIENT_MERGE_CANDIDATE WHERE PID_A = %s OR PID_B = %s", (key, key))
+                cursor.execute("DELETE FROM PATIENT_LAST_VISIT WHERE PID = %s", (key,))
+                cursor.execute("DELETE M FROM APPOINTMENT_SERIES_MEMBER M JOIN APPOINTMENT_SERIES S ON S.SERIES_ID = M.SERIES_ID "
+                               "WHERE S.PID = %s", (key,))
+                cursor.execute("DELETE FROM APPOINTMENT_SERIES WHERE PID = %s", (key,))
+            DeltaSync.record_delete(cursor, table, key)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        for row in before:
+            audit_event("DELETE", table, key, before=row)
+        yield f"{table} {key} deleted"
+
+    @staticmethod
+    def run(connection, table, key, mode="archive", batch_size=BATCH_SIZE, pause=0.1, progress=print, include_future=False):
+        for message in RecordRemover.steps(connection, table, key, mode, batch_size, include_future):
+            progress(message)
+            # Give interactive clients room between chunks
+            time.sleep(pause)
+
+# Today's check-in queues, one per doctor, kept current from a change feed
+class PatientQueues:
+    """Check-in state lives in APPOINTMENT_CHECKIN; every change also appends a
+    QUEUE_EVENT row. Open queue views load today's appointments once and then
+    only read events newer than the last SEQ they saw, plus APPOINTMENT deltas
+    for bookings made or moved during the day."""
+    STATUSES = ("BOOKED", "ARRIVED", "IN_ROOM", "DONE", "NO_SHOW")
+    # Who is seen first: people in the room, then arrivals, then those not here yet
+    STATUS_ORDER = {"IN_ROOM": 0, "ARRIVED": 1, "BOOKED": 2, "DONE": 3, "NO_SHOW": 3}
+    EVENT_RETENTION_DAYS = 2
+
+    @staticmethod
+    def create_schema(cursor):
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS APPOINTMENT_CHECKIN (
+            AID INT PRIMARY KEY,
+            STATUS VARCHAR(12) NOT NULL DEFAULT 'BOOKED',
+            PRIORITY TINYINT NOT NULL DEFAULT 0,
+            CHECKED_IN_AT DATETIME NULL
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS QUEUE_EVENT (
+            SEQ BIGINT AUTO_INCREMENT PRIMARY KEY,
+            AID INT NOT NULL,
+            STATUS VARCHAR(12) NOT NULL,
+            PRIORITY TINYINT NOT NULL,
+            CHECKED_IN_AT DATETIME NULL,
+            CREATED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX IDX_QUEUE_EVENT_CREATED (CREATED_AT)
+        )
+        """)
+
+    @staticmethod
+    def prune_events(cursor):
+        cursor.execute(
+            "DELETE FROM QUEUE_EVENT WHERE CREATED_AT < NOW() - INTERVAL %s DAY",
+            (PatientQueues.EVENT_RETENTION_DAYS,)
+        )
+
+    @staticmethod
+    def set_status(connection, aid, status=None, priority=None, current=None):
+        """Record a check-in change and its event in one transaction; current is the
+        (status, priority) the caller last saw, used for whatever is not being changed"""
+        status = status or (current[0] if current else "BOOKED")
+        priority = priority if priority is not None else (current[1] if current else 0)
+        if status not in PatientQueues.STATUSES:
+            raise ValueError(f"Unknown check-in status: {status}")
+        checked_in_at = datetime.now().replace(microsecond=0) if status == "ARRIVED" else None
+        try:
+            Statements.execute(connection, "queue_set_status", (aid, status, priority, checked_in_at))
+            Statements.execute(connection, "queue_add_event", (aid,))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+    def __init__(self, day=None, doctor=None):
+        self.day = day or date.today()
+        self.doctor = doctor
+        # aid -> [did, pid, name, minutes]
+        self.appointments = {}
+        # aid -> (status, priority, checked_in_at); kept apart so events may arrive before bookings
+        self.states = {}
+        # did -> sorted list of (sort key, aid)
+        self.queues = {}
+        self.dirty = set()
+        self.last_seq = 0
+        self.sync_cursor = None
+
+    def sort_key(self, aid):
+        _, _, _, minutes = self.appointments[aid]
+        status, priority, checked_in_at = self.states.get(aid, ("BOOKED", 0, None))
+        return (self.STATUS_ORDER.get(status, 2), -int(priority), minutes, str(checked_in_at or ""), aid)
+
+    def unlink(self, aid):
+        """Take an appointment out of its doctor's queue, leaving its data in place"""
+        if aid not in self.appointments:
+            return
+        did = self.appointments[aid][0]
+        queue = self.queues.get(did, [])
+        position = bisect.bisect_left(queue, (self.sort_key(aid), aid))
+        if position < len(queue) and queue[position][1] == aid:
+            del queue[position]
+        self.dirty.add(did)
+
+    def link(self, aid):
+        did = self.appointments[aid][0]
+        bisect.insort(self.queues.setdefault(did, []), (self.sort_key(aid), aid))
+        self.dirty.add(did)
+
+    def put_appointment(self, aid, did, pid, name, a_time):
+        self.unlink(aid)
+        self.appointments[aid] = [did, pid, name, AppointmentCalendar.minutes(a_time)]
+        self.link(aid)
+
+    def drop_appointment(self, aid):
+        self.unlink(aid)
+        self.appointments.pop(aid, None)
+
+    def put_state(self, aid, status, priority, checked_in_at):
+        self.unlink(aid)
+        self.states[aid] = (status, priority, checked_in_at)
+        if aid in self.appointments:
+            self.link(aid)
+
+    def wanted(self, did, a_date):
+        return (AppointmentCalendar.as_date(a_date) == self.day if a_date else False) and (self.doctor is None or did == self.doctor)
+
+    def load(self, connection, cursor):
+        """Initial snapshot; the feed position is taken first so nothing written meanwhile is missed"""
+        self.last_seq = Statements.query(connection, "queue_last_event")[0][0]
+        self.sync_cursor = DeltaSync.server_time(cursor)
+        for aid, did, pid, f_name, l_name, a_time, status, priority, checked_in_at in Statements.query(connection, "queue_today", (self.day,)):
+            if self.doctor is None or did == self.doctor:
+                self.states[aid] = (status, priority, checked_in_at)
+                self.put_appointment(aid, did, pid, f"{f_name or ''} {l_name or ''}".strip(), a_time)
+
+    def poll(self, connection, cursor):
+        """Apply check-in events and appointment changes since the last poll"""
+        for seq, aid, status, priority, checked_in_at in Statements.query(connection, "queue_events", (self.last_seq,)):
+            self.last_seq = seq
+            self.put_state(aid, status, priority, checked_in_at)
+        rows, deleted, self.sync_cursor = DeltaSync.changes_since(cursor, "APPOINTMENT", self.sync_cursor)
+        for aid, pid, did, a_date, a_time, depid, version in rows:
+            if not self.wanted(did, a_date):
+                self.drop_appointment(aid)
+            elif aid not in self.appointments or self.appointments[aid][1] != pid:
+                names = Statements.query(connection, "queue_patient_name", (pid,))
+                name = f"{names[0][0] or ''} {names[0][1] or ''}".strip() if names else ""
+                self.put_appointment(aid, did, pid, name, a_time)
+            else:
+                self.put_appointment(aid, did, pid, self.appointments[aid][2], a_time)
+        for key in deleted:
+            self.drop_appointment(int(key))
+
+    def entries(self, did):
+        """(aid, pid, name, minutes, status, priority) in the order patients should be seen"""
+        result = []
+        for _, aid in self.queues.get(did, []):
+            _, pid, name, minutes = self.appointments[aid]
+            status, priority, _ = self.states.get(aid, ("BOOKED", 0, None))
+            result.append((aid, pid, name, minutes, status, priority))
+        return result
+
+    def take_dirty(self):
+        dirty, self.dirty = self.dirty, set()
+        return dirty
+
+# Canonical, indexed phone keys for exact caller-ID lookups
+class PhoneKeys:
+    TABLES = {"PATIENT": "PID", "DOCTOR": "DID"}
+
+    @staticmethod
+    def create_schema(cursor):
+        for table in PhoneKeys.TABLES:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'PH_KEY'",
+                (table,)
+            )
+            if cursor.fetchone()[0] == 0:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN PH_KEY CHAR(10)")
+            ensure_index(cursor, table, f"IDX_{table}_PH_KEY", "PH_KEY")
+
+    @staticmethod
+    def backfill(connection, batch_size=1000, progress=print):
+        """Fill PH_KEY for rows written before it existed or by direct SQL, one short transaction per batch"""
+        cursor = connection.cursor()
+        for table, pk in PhoneKeys.TABLES.items():
+            last_key, updated = 0, 0
+            while True:
+                cursor.execute(
+                    f"SELECT {pk}, PH FROM {table} WHERE {pk} > %s AND PH_KEY IS NULL ORDER BY {pk} LIMIT %s",
+                    (last_key, batch_size)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                cursor.executemany(
+                    f"UPDATE {table} SET PH_KEY = %s WHERE {pk} = %s",
+                    [(ValidationUtils.phone_key(phone), key) for key, phone in rows]
+                )
+                connection.commit()
+                last_key = rows[-1][0]
+                updated += len(rows)
+            if updated:
+                progress(f"{table}: backfilled PH_KEY for {updated} rows")
+
+    @staticmethod
+    def caller_lookup(cursor, phone):
+        """Exact indexed match on the canonical key; returns (patients, doctors)"""
+        key = ValidationUtils.phone_key(phone)
+        if len(key) < 10:
+            return [], []
+        cursor.execute("SELECT PID, F_NAME, L_NAME, DOB, PH FROM PATIENT WHERE PH_KEY = %s", (key,))
+        patients = cursor.fetchall()
+        cursor.execute("SELECT DID, F_NAME, L_NAME, SPEC, PH FROM DOCTOR WHERE PH_KEY = %s", (key,))
+        doctors = cursor.fetchall()
+        return patients, doctors
+
+# Duplicate patient detection with blocking keys and fuzzy scoring
+class PatientMatcher:
+    MATCH_THRESHOLD = 0.85
+    # Blocks larger than this are skipped by the batch job (e.g. a placeholder
+    # DOB shared by thousands of rows) and reported instead
+    MAX_BLOCK_SIZE = 2000
+    COLUMNS = "PID, F_NAME, L_NAME, DOB, PH, EMAIL"
+
+    @staticmethod
+    def create_schema(cursor):
+        cursor.execute(
+            "SELECT COUNT(*) FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'PATIENT' AND COLUMN_NAME = 'NAME_BLOCK'"
+        )
+        if cursor.fetchone()[0] == 0:
+            # Phonetic surname + birth year, computed by the server for every row
+            cursor.execute("""
+            ALTER TABLE PATIENT
+                ADD COLUMN NAME_BLOCK VARCHAR(40) AS (CONCAT(SOUNDEX(L_NAME), YEAR(DOB))) STORED
+            """)
+        ensure_index(cursor, "PATIENT", "IDX_PATIENT_NAME_BLOCK", "NAME_BLOCK")
+        ensure_index(cursor, "PATIENT", "IDX_PATIENT_DOB", "DOB")
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS PATIENT_MERGE_CANDIDATE (
+            PID_A INT NOT NULL,
+            PID_B INT NOT NULL,
+            SCORE DECIMAL(4, 3) NOT NULL,
+            REASON VARCHAR(200),
+            DETECTED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            STATUS VARCHAR(20) NOT NULL DEFAULT 'OPEN',
+            PRIMARY KEY (PID_A, PID_B),
+            INDEX IDX_MERGE_STATUS (STATUS, SCORE)
+        )
+        """)
+
+    @staticmethod
+    def normalize_name(name):
+        return re.sub(r'[^a-z]', '', (name or "").lower())
+
+    @staticmethod
+    def similarity(a, b):
+        if not a or not b:
+            return 0.0
+        if a == b:
+            return 1.0
+        return difflib.SequenceMatcher(None, a, b).ratio()
+
+    @staticmethod
+    def score(a, b):
+        """Score two (PID, F_NAME, L_NAME, DOB, PH, EMAIL) rows; returns (score, reason)"""
+        first = PatientMatcher.similarity(PatientMatcher.normalize_name(a[1]), PatientMatcher.normalize_name(b[1]))
+        last = PatientMatcher.similarity(PatientMatcher.normalize_name(a[2]), PatientMatcher.normalize_name(b[2]))
+        dob_a, dob_b = str(a[3] or ""), str(b[3] or "")
+        if dob_a and dob_a == dob_b:
+            dob = 1.0
+        elif dob_a[:4] and dob_a[:4] == dob_b[:4] and dob_a[5:7] == dob_b[8:10] and dob_a[8:10] == dob_b[5:7]:
+            # Day and month swapped on entry
+            dob = 0.7
+        else:
+            dob = 0.0
+        phone_a, phone_b = ValidationUtils.phone_key(a[4]), ValidationUtils.phone_key(b[4])
+        phone = 1.0 if phone_a and phone_a == phone_b else 0.0
+        email = 1.0 if a[5] and str(a[5]).lower() == str(b[5] or "").lower() else 0.0
+
+        total = 0.3 * last + 0.25 * first + 0.25 * dob + 0.15 * phone + 0.05 * email
+        # The same phone and email with similar names is very likely one person
+        if phone and email and first > 0.8 and last > 0.8:
+            total = max(total, 0.95)
+        reasons = [label for label, value in (("surname", last), ("first name", first), ("dob", dob), ("phone", phone), ("email", email)) if value >= 0.8]
+        return round(min(total, 1.0), 3), ", ".join(reasons)
+
+    @staticmethod
+    def find_matches(cursor, patient, use_name_block=True, limit=200):
+        """On-insert check: candidates that share a blocking key with the new patient"""
+        pid, first_name, last_name, dob, phone, email = patient
+        query = f"SELECT {PatientMatcher.COLUMNS} FROM PATIENT WHERE (PH_KEY = %s OR DOB = %s"
+        params = [ValidationUtils.phone_key(phone), dob]
+        if use_name_block:
+            query += " OR NAME_BLOCK = CONCAT(SOUNDEX(%s), YEAR(%s))"
+            params += [last_name, dob]
+        query += ") AND PID <> %s LIMIT %s"
+        params += [pid, limit]
+        cursor.execute(query, tuple(params))
+
+        matches = []
+        for row in cursor.fetchall():
+            score, reason = PatientMatcher.score(patient, row)
+            if score >= PatientMatcher.MATCH_THRESHOLD:
+                matches.append((score, reason, row))
+        return sorted(matches, key=lambda match: match[0], reverse=True)
+
+    @staticmethod
+    def scan_blocks(cursor, block_column, chunk_size=5000):
+        """Stream PATIENT ordered by a blocking column and yield one block of rows at a time"""
+        cursor.execute(
+            f"SELECT {block_column}, {PatientMatcher.COLUMNS} FROM PATIENT "
+            f"WHERE {block_column} IS NOT NULL AND {block_column} <> '' ORDER BY {block_column}"
+        )
+        current_key, block = None, []
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                if row[0] != current_key and block:
+                    yield current_key, block
+                    block = []
+                current_key = row[0]
+                if len(block) <= PatientMatcher.MAX_BLOCK_SIZE:
+                    block.append(row[1:])
+        if block:
+            yield current_key, block
+
+    @staticmethod
+    def run(connection, progress=print):
+        """Batch job: compare patients only within blocks and store merge candidates"""
+        read_cursor = connection.cursor()
+        write_cursor = connection.cursor()
+        candidates = {}
+        skipped_blocks = 0
+        compared = 0
+        for block_column in ("NAME_BLOCK", "PH_KEY", "DOB"):
+            for key, block in PatientMatcher.scan_blocks(read_cursor, block_column):
+                if len(block) > PatientMatcher.MAX_BLOCK_SIZE:
+                    skipped_blocks += 1
+                    continue
+                for i in range(len(block)):
+                    for j in range(i + 1, len(block)):
+                        compared += 1
+                        score, reason = PatientMatcher.score(block[i], block[j])
+                        if score >= PatientMatcher.MATCH_THRESHOLD:
+                            pair = tuple(sorted((int(block[i][0]), int(block[j][0]))))
+                            if score > candidates.get(pair, (0, ""))[0]:
+                                candidates[pair] = (score, reason)
+            progress(f"{block_column}: {compared} comparisons, {len(candidates)} candidates so far")
+
+        # Re-running the job refreshes scores but keeps reviewed pairs' status
+        write_cursor.executemany("""
+        INSERT INTO PATIENT_MERGE_CANDIDATE (PID_A, PID_B, SCORE, REASON) VALUES (%s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE SCORE = VALUES(SCORE), REASON = VALUES(REASON)
+        """, [(a, b, score, reason) for (a, b), (score, reason) in candidates.items()])
+        connection.commit()
+        if skipped_blocks:
+            progress(f"Skipped {skipped_blocks} blocks larger than {PatientMatcher.MAX_BLOCK_SIZE} rows")
+        return len(candidates)
+
+# Appointment reminders: batched reads, a bounded delivery pool and pluggable sinks
+class PermanentDeliveryError(Exception):
+    """Raised by a sink when retrying cannot help, e.g. the recipient was rejected"""
+
+class FileSink:
+    """Writes reminders as JSON lines instead of sending them; for testing and dry runs"""
+    def __init__(self, path):
+        self.handle = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        with self.lock:
+            self.handle.write(json.dumps(message, default=str) + "\n")
+
+    def close(self):
+        self.handle.close()
+
+class SmtpSink:
+    """Sends e-mail reminders, with one SMTP session per delivery thread"""
+    def __init__(self, host, port=587, sender="noreply@hospital.local", user=None, password=None, starttls=True, timeout=30):
+        self.host, self.port, self.sender = host, port, sender
+        self.user, self.password, self.starttls, self.timeout = user, password, starttls, timeout
+        self.local = threading.local()
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            import smtplib
+            session = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                session.starttls()
+            if self.user:
+                session.login(self.user, self.password)
+            self.local.session = session
+            with self.lock:
+                self.sessions.append(session)
+        return session
+
+    def send(self, message):
+        # Only the send-reminders job needs the mail modules, so they are not loaded at startup
+        import smtplib
+        from email.message import EmailMessage
+        email = EmailMessage()
+        email["From"] = self.sender
+        email["To"] = message["to"]
+        email["Subject"] = message["subject"]
+        email.set_content(message["body"])
+        try:
+            self.session().send_message(email)
+        except smtplib.SMTPRecipientsRefused as e:
+            raise PermanentDeliveryError(f"Recipient refused: {message['to']}") from e
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # Reconnect on the next attempt
+            self.local.session = None
+            raise
+
+    def close(self):
+        for session in self.sessions:
+            try:
+                session.quit()
+            except Exception:
+                pass
+
+class SmsGatewaySink:
+    """Posts {"to", "text"} as JSON to an HTTP SMS gateway (or a local mock of one)"""
+    def __init__(self, url, token=None, timeout=10):
+        self.url, self.token, self.timeout = url, token, timeout
+
+    def send(self, message):
+        # Imported here rather than at startup; only the send-reminders job uses it
+        import urllib.request
+        import urllib.error
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        request = urllib.request.Request(
+            self.url, data=json.dumps({"to": message["to"], "text": message["body"]}).encode("utf-8"),
+            headers=headers, method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            # 4xx other than throttling means the request itself is wrong
+            if 400 <= e.code < 500 and e.code != 429:
+                raise PermanentDeliveryError(f"Gateway rejected {message['to']}: HTTP {e.code}") from e
+            raise
+
+    def close(self):
+        pass
+
+class RateLimiter:
+    """Token bucket shared by all delivery threads"""
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(1, int(rate))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class ReminderJob:
+    CHANNELS = ("email", "sms")
+    BATCH_SIZE = 1000
+    WORKERS = 16
+    RATE_PER_SECOND = 200
+    MAX_ATTEMPTS = 4
+    BACKOFF_SECONDS = 1.0
+    PROGRESS_SECONDS = 10
+    EMAIL_SUBJECT = "Appointment reminder for {day}"
+    EMAIL_BODY = (
+        "Dear {patient},\n\n"
+        "This is a reminder of your appointment on {day} at {time} with {doctor}{department}.\n"
+        "If you cannot attend, please contact us to reschedule.\n"
+    )
+    SMS_BODY = "Reminder: appointment {day} {time} with {doctor}{department}. Reply or call to reschedule."
+
+    @staticmethod
+    def create_schema(cursor):
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS REMINDER_LOG (
+            AID INT NOT NULL,
+            CHANNEL VARCHAR(10) NOT NULL,
+            STATUS VARCHAR(10) NOT NULL,
+            ATTEMPTS INT NOT NULL DEFAULT 0,
+            ERROR VARCHAR(255),
+            UPDATED_AT TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (AID, CHANNEL)
+        )
+        """)
+
+    def __init__(self, connection, sink, channel="email", workers=WORKERS, rate=RATE_PER_SECOND,
+                 batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS, progress=print):
+        if channel not in self.CHANNELS:
+            raise ValueError(f"Unknown reminder channel: {channel}")
+        self.connection = connection
+        self.sink = sink
+        self.channel = channel
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.progress = progress
+        self.counts = {"SENT": 0, "FAILED": 0, "REJECTED": 0, "SKIPPED": 0, "retries": 0}
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def render(self, row):
+        """Message for one appointment row, or None when the patient has no contact for this channel"""
+        aid, a_date, a_time, f_name, l_name, email, phone, d_first, d_last, department = row
+        to = email if self.channel == "email" else ValidationUtils.phone_key(phone or "")
+        if not to or (self.channel == "sms" and len(to) < 10):
+            return None
+        minutes = AppointmentCalendar.minutes(a_time)
+        fields = {
+            "patient": f"{f_name or ''} {l_name or ''}".strip() or "patient",
+            "day": str(a_date)[:10],
+            "time": f"{minutes // 60:02d}:{minutes % 60:02d}",
+            "doctor": f"Dr. {d_first or ''} {d_last or ''}".strip() if (d_first or d_last) else "your doctor",
+            "department": f" ({department})" if department else "",
+        }
+        if self.channel == "email":
+            return {"aid": aid, "to": to, "subject": self.EMAIL_SUBJECT.format(**fields), "body": self.EMAIL_BODY.format(**fields)}
+        return {"aid": aid, "to": to, "body": self.SMS_BODY.format(**fields)}
+
+    def deliver(self, message):
+        """Send with retries and exponential backoff; returns a REMINDER_LOG row"""
+        for attempt in range(1, self.max_attempts + 1):
+            self.limiter.acquire()
+            started = time.perf_counter()
+            try:
+                self.sink.send(message)
+                with self.lock:
+                    self.latencies.append(time.perf_counter() - started)
+                return (message["aid"], self.channel, "SENT", attempt, None)
+            except PermanentDeliveryError as e:
+                # Not picked up again by later runs
+                return (message["aid"], self.channel, "REJECTED", attempt, str(e)[:255])
+            except Exception as e:
+                if attempt == self.max_attempts:
+                    return (message["aid"], self.channel, "FAILED", attempt, str(e)[:255])
+                with self.lock:
+                    self.counts["retries"] += 1
+                time.sleep(self.BACKOFF_SECONDS * 2 ** (attempt - 1) * (0.5 + random.random()))
+
+    def record(self, results):
+        """Write one batch of outcomes in a single short transaction"""
+        for result in results:
+            self.counts[result[2]] += 1
+        try:
+            Statements.execute_many(self.connection, "reminder_log", results)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+    def summary(self, elapsed):
+        done = self.counts["SENT"] + self.counts["FAILED"] + self.counts["REJECTED"]
+        latencies = sorted(self.latencies)
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000 if latencies else 0.0
+        return (f"sent {self.counts['SENT']}, failed {self.counts['FAILED']}, rejected {self.counts['REJECTED']}, skipped {self.counts['SKIPPED']}, "
+                f"retries {self.counts['retries']} in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.1f}/s, "
+                f"p50 {percentile(0.5):.0f} ms, p95 {percentile(0.95):.0f} ms)")
+
+    def run(self, day):
+        """Send reminders for every appointment on day that has not been reminded yet.
+
+        Appointments are read in keyset batches. While one batch is being delivered
+        the next one is already queued, so the pool never drains between batches,
+        and at most two batches are held in memory.
+        """
+        started = last_report = time.perf_counter()
+        last_aid = 0
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                rows = Statements.query(self.connection, "reminder_batch", (self.channel, day, last_aid, self.batch_size))
+                if rows:
+                    last_aid = rows[-1][0]
+                    futures, skipped = [], []
+                    for row in rows:
+                        message = self.render(row)
+                        if message is None:
+                            skipped.append((row[0], self.channel, "SKIPPED", 0, "no contact details"))
+                        else:
+                            futures.append(pool.submit(self.deliver, message))
+                    if skipped:
+                        self.record(skipped)
+                    in_flight.append(futures)
+                while in_flight and (len(in_flight) > 1 or not rows):
+                    self.record([future.result() for future in in_flight.popleft()])
+                    if time.perf_counter() - last_report >= self.PROGRESS_SECONDS:
+                        last_report = time.perf_counter()
+                        self.progress(self.summary(last_report - started))
+                if not rows:
+                    break
+        self.progress(self.summary(time.perf_counter() - started))
+        return dict(self.counts)
+
+    @staticmethod
+    def make_sink(kind, path=None):
+        """Sink configured from HOSPITAL_SMTP_* / HOSPITAL_SMS_* environment variables"""
+        if kind == "file":
+            return FileSink(path or "reminders.jsonl")
+        if kind == "smtp":
+            return SmtpSink(
+                os.environ.get("HOSPITAL_SMTP_HOST", "localhost"),
+                int(os.environ.get("HOSPITAL_SMTP_PORT", "587")),
+                os.environ.get("HOSPITAL_SMTP_SENDER", "noreply@hospital.local"),
+                os.environ.get("HOSPITAL_SMTP_USER"),
+                os.environ.get("HOSPITAL_SMTP_PASSWORD"),
+                os.environ.get("HOSPITAL_SMTP_STARTTLS", "1") != "0",
+            )
+        if kind == "sms":
+            return SmsGatewaySink(os.environ.get("HOSPITAL_SMS_URL", "http://localhost:8025/sms"), os.environ.get("HOSPITAL_SMS_TOKEN"))
+        raise ValueError(f"Unknown reminder sink: {kind}")
+
+# Offline mode: SQLite replica with write-behind sync to MySQL
+class SqliteDialect:
+    NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+    @staticmethod
+    def translate(sql):
+        """Rewrite the MySQL constructs used by this app into SQLite syntax"""
+        sql = sql.replace("%s", "?")
+        sql = sql.replace("ON DUPLICATE KEY UPDATE", "ON CONFLICT DO UPDATE SET")
+        sql = re.sub(r"VALUES\((\w+)\)", r"excluded.\1", sql)
+        sql = re.sub(r"NOW\(\d*\)", SqliteDialect.NOW, sql)
+        sql = re.sub(r"LEFT\((\w+), (\d+)\)", r"substr(\1, 1, \2)", sql)
+        return sql
+
+    @staticmethod
+    def adapt(params):
+        """Convert values MySQL returns (dates, TIME as timedelta, Decimal) into SQLite-bindable ones"""
+        adapted = []
+        for value in params or ():
+            if isinstance(value, datetime):
+                value = value.isoformat(sep=" ")
+            elif isinstance(value, date):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = float(value)
+            elif isinstance(value, timedelta):
+                seconds = int(value.total_seconds())
+                value = f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+            adapted.append(value)
+        return tuple(adapted)
+
+class DialectCursor:
+    """Cursor wrapper that runs the app's MySQL-flavoured statements on SQLite"""
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(SqliteDialect.translate(sql), SqliteDialect.adapt(params))
+
+    def executemany(self, sql, seq_of_params):
+        self.cursor.executemany(SqliteDialect.translate(sql), [SqliteDialect.adapt(p) for p in seq_of_params])
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size=1000):
+        return self.cursor.fetchmany(size)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def close(self):
+        self.cursor.close()
+
+class ReplicaCursor(DialectCursor):
+    """Reads hit the local replica; writes are applied locally and queued in OUTBOX"""
+    WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+    def __init__(self, connection):
+        super().__init__(connection.db.cursor())
+        self.connection = connection
+
+    def execute(self, sql, params=()):
+        super().execute(sql, params)
+        if sql.lstrip().upper().startswith(self.WRITE_PREFIXES):
+            self.connection.enqueue(sql, [params])
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        super().executemany(sql, seq_of_params)
+        self.connection.enqueue(sql, seq_of_params)
+
+class ReplicaConnection:
+    """Drop-in stand-in for the MySQL connection while running against the replica"""
+    def __init__(self, replica):
+        self.replica = replica
+        self.db = replica.connect()
+        self.txn_id = None
+
+    def cursor(self):
+        return ReplicaCursor(self)
+
+    def enqueue(self, sql, params_list):
+        # Outbox rows share the local transaction, so a rollback discards them too
+        if self.txn_id is None:
+            self.txn_id = uuid.uuid4().hex
+        self.db.executemany(
+            "INSERT INTO OUTBOX (TXN, SQL_TEXT, PARAMS) VALUES (?, ?, ?)",
+            [(self.txn_id, sql, json.dumps(list(SqliteDialect.adapt(p)))) for p in params_list]
+        )
+
+    def commit(self):
+        self.db.commit()
+        self.txn_id = None
+
+    def rollback(self):
+        self.db.rollback()
+        self.txn_id = None
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self.db.close()
+
+class LocalReplica:
+    def __init__(self, path):
+        self.path = path
+        db = self.connect()
+        self.create_schema(db)
+        db.close()
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def create_schema(self, db):
+        for table, (pk, columns) in DeltaSync.TABLES.items():
+            columns = columns + DeltaSync.REPLICATED_EXTRAS.get(table, [])
+            column_defs = ", ".join(f"{col} INTEGER PRIMARY KEY" if col == pk else f"{col}" for col in columns)
+            db.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {column_defs},
+                VERSION INTEGER NOT NULL DEFAULT 1,
+                UPDATED_AT TEXT NOT NULL DEFAULT ({SqliteDialect.NOW})
+            )
+            """)
+            db.execute(f"CREATE INDEX IF NOT EXISTS IDX_{table}_UPDATED_AT ON {table} (UPDATED_AT)")
+            existing = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+            for col in DeltaSync.REPLICATED_EXTRAS.get(table, []):
+                if col not in existing:
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN {col}")
+                db.execute(f"CREATE INDEX IF NOT EXISTS IDX_{table}_{col} ON {table} ({col})")
+            # SQLite has no ON UPDATE CURRENT_TIMESTAMP
+            db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS TRG_{table}_UPDATED_AT AFTER UPDATE ON {table}
+            FOR EACH ROW WHEN NEW.UPDATED_AT = OLD.UPDATED_AT
+            BEGIN
+                UPDATE {table} SET UPDATED_AT = {SqliteDialect.NOW} WHERE rowid = NEW.rowid;
+            END
+            """)
+
+        db.executescript(f"""
+        CREATE TABLE IF NOT EXISTS APPT_DAILY_ROLLUP (
+            A_DATE TEXT NOT NULL,
+            DepID INTEGER NOT NULL DEFAULT 0,
+            DID INTEGER NOT NULL DEFAULT 0,
+            APPT_COUNT INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (A_DATE, DepID, DID)
+        );
+        CREATE TABLE IF NOT EXISTS SYNC_TOMBSTONE (
+            TBL TEXT NOT NULL,
+            PK INTEGER NOT NULL,
+            DELETED_AT TEXT NOT NULL DEFAULT ({SqliteDialect.NOW})
+        );
+        CREATE INDEX IF NOT EXISTS IDX_TOMBSTONE_TBL_TIME ON SYNC_TOMBSTONE (TBL, DELETED_AT);
+        CREATE INDEX IF NOT EXISTS IDX_APPOINTMENT_A_DATE ON APPOINTMENT (A_DATE);
+        CREATE INDEX IF NOT EXISTS IDX_APPOINTMENT_DID_DATE ON APPOINTMENT (DID, A_DATE);
+        CREATE INDEX IF NOT EXISTS IDX_APPOINTMENT_DEPT_DATE ON APPOINTMENT (DepID, A_DATE);
+        CREATE TABLE IF NOT EXISTS OUTBOX (
+            SEQ INTEGER PRIMARY KEY AUTOINCREMENT,
+            TXN TEXT NOT NULL,
+            SQL_TEXT TEXT NOT NULL,
+            PARAMS TEXT NOT NULL,
+            CREATED_AT TEXT NOT NULL DEFAULT ({SqliteDialect.NOW})
+        );
+        CREATE TABLE IF NOT EXISTS SYNC_CONFLICT (
+            SEQ INTEGER PRIMARY KEY AUTOINCREMENT,
+            TXN TEXT NOT NULL,
+            SQL_TEXT TEXT NOT NULL,
+            PARAMS TEXT NOT NULL,
+            ERROR TEXT NOT NULL,
+            CREATED_AT TEXT NOT NULL DEFAULT ({SqliteDialect.NOW})
+        );
+        CREATE TABLE IF NOT EXISTS SYNC_STATE (
+            TBL TEXT PRIMARY KEY,
+            SYNC_CURSOR TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS ID_LEASE (
+            TBL TEXT NOT NULL,
+            START_ID INTEGER NOT NULL,
+            END_ID INTEGER NOT NULL,
+            PRIMARY KEY (TBL, START_ID)
+        );
+        """)
+        db.commit()
+
+    def next_id(self, db, table):
+        """Take the lowest key of the blocks leased while online; the caller's transaction owns the change"""
+        row = db.execute("SELECT START_ID, END_ID FROM ID_LEASE WHERE TBL = ? ORDER BY START_ID LIMIT 1", (table,)).fetchone()
+        if row is None:
+            raise LookupError(f"No {table} IDs are leased to this replica yet. Type an ID, or try again once the server is reachable.")
+        start, end = row
+        if start + 1 < end:
+            db.execute("UPDATE ID_LEASE SET START_ID = ? WHERE TBL = ? AND START_ID = ?", (start + 1, table, start))
+        else:
+            db.execute("DELETE FROM ID_LEASE WHERE TBL = ? AND START_ID = ?", (table, start))
+        return start
+
+    def reserve_id(self, db, table, key):
+        """Cut a key typed in by hand out of the leased blocks so it is never handed out again"""
+        row = db.execute("SELECT START_ID, END_ID FROM ID_LEASE WHERE TBL = ? AND START_ID <= ? AND END_ID > ?", (table, key, key)).fetchone()
+        if row is None:
+            return
+        start, end = row
+        db.execute("DELETE FROM ID_LEASE WHERE TBL = ? AND START_ID = ?", (table, start))
+        db.executemany("INSERT INTO ID_LEASE (TBL, START_ID, END_ID) VALUES (?, ?, ?)",
+                       [(table, low, high) for low, high in ((start, key), (key + 1, end)) if low < high])
+
+class ReplayConflict(Exception):
+    pass
+
+class WriteBehindSync(threading.Thread):
+    """Background worker that replays OUTBOX to the central database and pulls remote changes.
+
+    `remote_connect` returns a DB-API connection; pass remote_dialect="sqlite"
+    to run against a second SQLite file instead of MySQL.
+    """
+    def __init__(self, replica, remote_connect, remote_dialect="mysql", interval=5, batch_size=200):
+        super().__init__(daemon=True)
+        self.replica = replica
+        self.remote_connect = remote_connect
+        self.remote_dialect = remote_dialect
+        self.interval = interval
+        self.batch_size = batch_size
+        self.remote = None
+        self.local = None
+        self.online = False
+        self.last_error = ""
+        self.stop_event = threading.Event()
+
+    def run(self):
+        self.local = self.replica.connect()
+        delay = self.interval
+        while not self.stop_event.is_set():
+            try:
+                self.sync_once()
+                delay = self.interval
+            except Exception as e:
+                self.last_error = str(e)
+                self.online = False
+                self.remote = None
+                # Back off while the link is down
+                delay = min(delay * 2, 300)
+            self.stop_event.wait(delay)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def remote_cursor(self):
+        if self.remote is None:
+            self.remote = self.remote_connect()
+        cursor = self.remote.cursor()
+        return DialectCursor(cursor) if self.remote_dialect == "sqlite" else cursor
+
+    def sync_once(self):
+        """Push queued writes, then pull remote changes once the queue is drained"""
+        if self.local is None:
+            self.local = self.replica.connect()
+        remote = self.remote_cursor()
+        while self.push(remote):
+            pass
+        if self.pending_count() == 0:
+            self.pull(remote)
+        self.lease_ids()
+        self.online = True
+        self.last_error = ""
+
+    def lease_ids(self):
+        """Top up the replica's ID blocks while the server is reachable, so new
+        records still get keys after the link goes down"""
+        if self.remote_dialect != "mysql":
+            return
+        for table in DeltaSync.TABLES:
+            left = self.local.execute("SELECT COALESCE(SUM(END_ID - START_ID), 0) FROM ID_LEASE WHERE TBL = ?", (table,)).fetchone()[0]
+            if left >= IdAllocator.REPLICA_BLOCK_SIZE // 2:
+                continue
+            start = IdAllocator.lease_over(self.remote_connect, table, IdAllocator.REPLICA_BLOCK_SIZE)
+            self.local.execute("INSERT INTO ID_LEASE (TBL, START_ID, END_ID) VALUES (?, ?, ?)",
+                               (table, start, start + IdAllocator.REPLICA_BLOCK_SIZE))
+            self.local.commit()
+
+    def next_batch(self):
+        """Whole transactions from the head of OUTBOX, about batch_size statements"""
+        rows = self.local.execute(
+            "SELECT SEQ, TXN, SQL_TEXT, PARAMS FROM OUTBOX ORDER BY SEQ LIMIT ?", (self.batch_size,)
+        ).fetchall()
+        if not rows:
+            return []
+        last_txn = rows[-1][1]
+        if all(row[1] == last_txn for row in rows):
+            return self.local.execute(
+                "SELECT SEQ, TXN, SQL_TEXT, PARAMS FROM OUTBOX WHERE TXN = ? ORDER BY SEQ", (last_txn,)
+            ).fetchall()
+        # Leave a transaction cut by the LIMIT for the next batch
+        return [row for row in rows if row[1] != last_txn]
+
+    def push(self, remote):
+        """Replay one batch to the remote in a single transaction; returns False when OUTBOX is empty"""
+        batch = self.next_batch()
+        if not batch:
+            return False
+
+        transactions = []
+        for seq, txn, sql, params in batch:
+            if not transactions or transactions[-1][0] != txn:
+                transactions.append((txn, []))
+            transactions[-1][1].append((sql, json.loads(params)))
+
+        if self.remote_dialect == "sqlite":
+            # Otherwise releasing the outermost savepoint would commit each transaction on its own
+            remote.execute("BEGIN")
+        conflicts = []
+        for txn, statements in transactions:
+            remote.execute("SAVEPOINT replay_txn")
+            try:
+                for sql, params in statements:
+                    remote.execute(sql, tuple(params))
+                    if remote.rowcount == 0 and "VERSION=%s" in sql.replace(" ", ""):
+                        raise ReplayConflict("Row was changed on the server since it was edited offline")
+                remote.execute("RELEASE SAVEPOINT replay_txn")
+            except Exception as e:
+                if self.remote_dialect == "mysql" and isinstance(e, (mysql_connector().errors.OperationalError, mysql_connector().errors.InterfaceError)):
+                    raise
+                remote.execute("ROLLBACK TO SAVEPOINT replay_txn")
+                remote.execute("RELEASE SAVEPOINT replay_txn")
+                conflicts.extend((txn, sql, json.dumps(params), str(e)) for sql, params in statements)
+
+        # If the link drops between these two commits the batch is replayed
+        # again; versioned updates then surface as conflicts rather than
+        # silently applying twice.
+        self.remote.commit()
+        self.local.executemany(
+            "INSERT INTO SYNC_CONFLICT (TXN, SQL_TEXT, PARAMS, ERROR) VALUES (?, ?, ?, ?)", conflicts
+        )
+        self.local.execute("DELETE FROM OUTBOX WHERE SEQ <= ?", (batch[-1][0],))
+        self.local.commit()
+        return True
+
+    def sync_cursor(self, table):
+        row = self.local.execute("SELECT SYNC_CURSOR FROM SYNC_STATE WHERE TBL = ?", (table,)).fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def pull(self, remote):
+        local = DialectCursor(self.local.cursor())
+        appointments_changed = False
+        for table, (pk, columns) in DeltaSync.TABLES.items():
+            since = self.sync_cursor(table)
+            placeholders = ", ".join(["%s"] * (len(columns) + len(DeltaSync.REPLICATED_EXTRAS.get(table, [])) + 1))
+            upsert = f"INSERT OR REPLACE INTO {table} ({DeltaSync.select_list(table, preview=False)}) VALUES ({placeholders})"
+
+            if since is None:
+                # First sync: copy the whole table in chunks
+                new_cursor = DeltaSync.server_time(remote)
+                remote.execute(f"SELECT {DeltaSync.select_list(table, preview=False)} FROM {table}")
+                local.execute(f"DELETE FROM {table}")
+                while True:
+                    chunk = remote.fetchmany(1000)
+                    if not chunk:
+                        break
+                    local.executemany(upsert, chunk)
+                changed = True
+            else:
+                rows, deleted, new_cursor = DeltaSync.changes_since(remote, table, since, preview=False)
+                # Rows are re-stamped with local time so the UI's own poll sees them
+                local.executemany(upsert, rows)
+                for key in deleted:
+                    local.execute(f"DELETE FROM {table} WHERE {pk} = %s", (key,))
+                    local.execute("INSERT INTO SYNC_TOMBSTONE (TBL, PK) VALUES (%s, %s)", (table, key))
+                changed = bool(rows or deleted)
+
+            local.execute(
+                "INSERT OR REPLACE INTO SYNC_STATE (TBL, SYNC_CURSOR) VALUES (%s, %s)",
+                (table, new_cursor.isoformat(sep=" "))
+            )
+            appointments_changed |= table == "APPOINTMENT" and changed
+
+        if appointments_changed:
+            remote.execute("SELECT A_DATE, DepID, DID, APPT_COUNT FROM APPT_DAILY_ROLLUP")
+            local.execute("DELETE FROM APPT_DAILY_ROLLUP")
+            local.executemany(
+                "INSERT INTO APPT_DAILY_ROLLUP (A_DATE, DepID, DID, APPT_COUNT) VALUES (%s, %s, %s, %s)",
+                remote.fetchall()
+            )
+        self.local.commit()
+        self.remote.commit()
+
+    def pending_count(self):
+        return self.local.execute("SELECT COUNT(*) FROM OUTBOX").fetchone()[0]
+
+    def conflicts(self, limit=20):
+        db = self.replica.connect()
+        try:
+            return db.execute(
+                "SELECT CREATED_AT, SQL_TEXT, PARAMS, ERROR FROM SYNC_CONFLICT ORDER BY SEQ DESC LIMIT ?", (limit,)
+            ).fetchall()
+        finally:
+            db.close()
+
+    def status(self):
+        db = self.replica.connect()
+        try:
+            pending = db.execute("SELECT COUNT(*) FROM OUTBOX").fetchone()[0]
+            conflicts = db.execute("SELECT COUNT(*) FROM SYNC_CONFLICT").fetchone()[0]
+        finally:
+            db.close()
+        return pending, conflicts
+
+# Append-only audit trail of record changes, written off the UI thread
+class AuditLog(threading.Thread):
+    """Handlers call record() right after they commit; it only queues the event.
+
+    A background writer drains the queue in batches: one multi-row INSERT into
+    AUDIT_LOG per batch, or, with no table writer (HOSPITAL_AUDIT_DIR set, or
+    replica mode), JSON lines appended to size-capped segment files with one
+    fsync per batch. A batch the table rejects goes to the files as well, so no
+    event is dropped while the server is unreachable.
+    """
+    BATCH_SIZE = 500
+    FLUSH_SECONDS = 1.0
+    SEGMENT_BYTES = 16 * 1024 * 1024
+    DEFAULT_DIR = "audit"
+    HISTORY_LIMIT = 200
+
+    def __init__(self, connect=None, directory=DEFAULT_DIR, actor=None):
+        super().__init__(daemon=True)
+        self.connect = connect
+        self.directory = directory
+        self.actor = actor or AuditLog.current_user()
+        self.events = queue.Queue()
+        self.connection = None
+        self.segment = None
+        self.written = 0
+        self.last_error = ""
+        self.stop_event = threading.Event()
+
+    @staticmethod
+    def current_user():
+        try:
+            return os.environ.get("HOSPITAL_USER") or getpass.getuser()
+        except Exception:
+            return "unknown"
+
+    @staticmethod
+    def create_schema(cursor):
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS AUDIT_LOG (
+            SEQ BIGINT AUTO_INCREMENT PRIMARY KEY,
+            AT DATETIME(6) NOT NULL,
+            ACTOR VARCHAR(64) NOT NULL,
+            ACTION VARCHAR(16) NOT NULL,
+            TBL VARCHAR(32) NOT NULL,
+            PK VARCHAR(64) NOT NULL,
+            BEFORE_VALUES JSON,
+            AFTER_VALUES JSON,
+            INDEX IDX_AUDIT_ENTITY (TBL, PK, AT),
+            INDEX IDX_AUDIT_AT (AT)
+        )
+        """)
+        # Rows can be added but never changed or removed, whatever the client
+        for event in ("UPDATE", "DELETE"):
+            name = f"AUDIT_LOG_NO_{event}"
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME = %s",
+                (name,)
+            )
+            if cursor.fetchone()[0] == 0:
+                cursor.execute(
+                    f"CREATE TRIGGER {name} BEFORE {event} ON AUDIT_LOG FOR EACH ROW "
+                    "SIGNAL SQLSTATE '45000' SET MESSAGE_TEXT = 'AUDIT_LOG is append-only'"
+                )
+
+    def record(self, action, table, key, before=None, after=None):
+        """Queue one event; before/after are column -> value dicts. Never touches the database."""
+        self.events.put((datetime.now(), self.actor, action, table, str(key), before, after))
+
+    def run(self):
+        while not (self.stop_event.is_set() and self.events.empty()):
+            batch = self.take_batch()
+            if batch:
+                self.flush(batch)
+        self.close()
+
+    def stop(self, timeout=10):
+        """Flush what is queued, then end the writer"""
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def take_batch(self):
+        """Wait up to FLUSH_SECONDS for an event, then take whatever else is already queued"""
+        try:
+            batch = [self.events.get(timeout=self.FLUSH_SECONDS)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.BATCH_SIZE:
+            try:
+                batch.append(self.events.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def encode(values):
+        return None if values is None else json.dumps(values, default=str, sort_keys=True)
+
+    def flush(self, batch):
+        rows = [(at, actor, action, table, key, self.encode(before), self.encode(after))
+                for at, actor, action, table, key, before, after in batch]
+        if self.connect is not None:
+            try:
+                if self.connection is None:
+                    self.connection = self.connect()
+                Statements.execute_many(self.connection, "audit_insert", rows)
+                self.connection.commit()
+                self.written += len(rows)
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                self.close_connection()
+        try:
+            self.append_to_segment(rows)
+            self.written += len(rows)
+        except OSError as e:
+            self.last_error = str(e)
+
+    def append_to_segment(self, rows):
+        if self.segment is None or self.segment.tell() >= self.SEGMENT_BYTES:
+            if self.segment is not None:
+                self.segment.close()
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"audit-{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:6]}.jsonl"
+            self.segment = open(os.path.join(self.directory, name), "a", encoding="utf-8")
+        for at, actor, action, table, key, before, after in rows:
+            self.segment.write(json.dumps({
+                "at": at.isoformat(sep=" "), "actor": actor, "action": action, "table": table, "pk": key,
+                "before": before and json.loads(before), "after": after and json.loads(after),
+            }) + "\n")
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+
+    def close_connection(self):
+        try:
+            if self.connection is not None:
+                self.connection.close()
+        except Exception:
+            pass
+        self.connection = None
+
+    def close(self):
+        self.close_connection()
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    @staticmethod
+    def history(connection, table, key=None, since=None, until=None, limit=HISTORY_LIMIT):
+        """Newest first: one record's events or one table's (IDX_AUDIT_ENTITY), or everything in a time range (IDX_AUDIT_AT)"""
+        since = since or datetime(1970, 1, 1)
+        until = until or datetime.now() + timedelta(days=1)
+        if key is not None:
+            return Statements.query(connection, "audit_entity", (table, str(key), since, until, limit))
+        if table is not None:
+            return Statements.query(connection, "audit_table", (table, since, until, limit))
+        return Statements.query(connection, "audit_range", (since, until, limit))
+
+    @staticmethod
+    def read_segments(directory, table=None, key=None, since=None, until=None):
+        """Scan the segment files for matching events; same row shape and order as history()"""
+        since = (since or datetime(1970, 1, 1)).isoformat(sep=" ")
+        until = (until or datetime.now() + timedelta(days=1)).isoformat(sep=" ")
+        if not os.path.isdir(directory):
+            return []
+        rows = []
+        for name in sorted(os.listdir(directory)):
+            if not (name.startswith("audit-") and name.endswith(".jsonl")):
+                continue
+            with open(os.path.join(directory, name), encoding="utf-8") as segment:
+                for line in segment:
+                    event = json.loads(line)
+                    if table and event["table"] != table or key is not None and event["pk"] != str(key):
+                        continue
+                    if since <= event["at"] <= until:
+                        rows.append((event["at"], event["actor"], event["action"], event["table"], event["pk"],
+                                     AuditLog.encode(event["before"]), AuditLog.encode(event["after"])))
+        rows.sort(key=lambda row: row[0], reverse=True)
+        return rows
+
+# Online backups of the core tables, and bulk restore from them
+class Backup:
+    """A backup is a directory of gzip-compressed JSON-lines chunks plus manifest.json.
+
+    All tables are read inside one consistent-snapshot transaction, so the
+    backup is a single point in time while the app keeps writing (InnoDB
+    serves the reads from its undo log; nothing is locked). Rows stream
+    through an unbuffered cursor one chunk at a time, so memory stays bounded.
+    The manifest lists every chunk's row count and SHA-256 and is written last;
+    the directory only gets its final name once the backup is complete.
+    """
+    # Foreign-key order: parents before the tables that reference them; the
+    # archives have no foreign keys and go last
+    TABLES = ("DEPT", "DOCTOR", "PATIENT", "APPOINTMENT", "MED_RECORD", "APPOINTMENT_ARCHIVE", "MED_RECORD_ARCHIVE")
+    CHUNK_ROWS = 50000
+    INSERT_ROWS = 1000
+    DEFAULT_DIR = "backups"
+
+    @staticmethod
+    def stored_columns(cursor, table):
+        """Columns that hold data; generated columns are recomputed on insert"""
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND EXTRA NOT LIKE '%%GENERATED%%' "
+            "ORDER BY ORDINAL_POSITION",
+            (table,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def primary_key(table):
+        """Archive tables are keyed like the hot table they were copied from"""
+        hot = next((name for name in Archiver.TABLES if Archiver.archive_table(name) == table), table)
+        return DeltaSync.TABLES[hot][0]
+
+    @staticmethod
+    def tables(manifest):
+        """Tables held by a backup; backups taken before the archives were included lack them"""
+        return [table for table in Backup.TABLES if table in manifest["tables"]]
+
+    @staticmethod
+    def write_chunk(directory, table, number, lines):
+        name = f"{table}-{number:05d}.jsonl.gz"
+        blob = gzip.compress("".join(lines).encode("utf-8"), compresslevel=6)
+        with open(os.path.join(directory, name), "wb") as chunk:
+            chunk.write(blob)
+            chunk.flush()
+            os.fsync(chunk.fileno())
+        return {"file": name, "rows": len(lines), "sha256": hashlib.sha256(blob).hexdigest()}
+
+    @staticmethod
+    def run(connection, directory=None, chunk_rows=CHUNK_ROWS, progress=print):
+        """Write a backup and return its directory"""
+        directory = directory or os.path.join(Backup.DEFAULT_DIR, f"backup-{datetime.now():%Y%m%d-%H%M%S}")
+        partial = directory + ".partial"
+        os.makedirs(partial)
+        cursor = connection.cursor()
+        cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT, READ ONLY")
+        try:
+            cursor.execute("SELECT NOW(6)")
+            manifest = {"taken_at": str(cursor.fetchone()[0]), "schema_version": SCHEMA_VERSION, "tables": {}}
+            for table in Backup.TABLES:
+                columns = Backup.stored_columns(cursor, table)
+                pk = Backup.primary_key(table)
+                chunks, total = [], 0
+                cursor.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {pk}")
+                while True:
+                    rows = cursor.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    lines = [json.dumps(row, default=str) + "\n" for row in rows]
+                    chunks.append(Backup.write_chunk(partial, table, len(chunks) + 1, lines))
+                    total += len(rows)
+                manifest["tables"][table] = {"columns": columns, "rows": total, "chunks": chunks}
+                progress(f"{table}: {total} rows in {len(chunks)} chunks")
+        finally:
+            connection.rollback()
+
+        with open(os.path.join(partial, "manifest.json"), "w", encoding="utf-8") as handle:
+            json.dump(manifest, handle, indent=2)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.rename(partial, directory)
+        progress(f"Backup written to {directory}")
+        return directory
+
+    @staticmethod
+    def read_manifest(directory):
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as handle:
+            return json.load(handle)
+
+    @staticmethod
+    def read_chunk(directory, chunk):
+        """Rows of one chunk; a damaged or altered file raises ValueError"""
+        with open(os.path.join(directory, chunk["file"]), "rb") as handle:
+            blob = handle.read()
+        if hashlib.sha256(blob).hexdigest() != chunk["sha256"]:
+            raise ValueError(f"Checksum mismatch in {chunk['file']}")
+        rows = [json.loads(line) for line in gzip.decompress(blob).decode("utf-8").splitlines()]
+        if len(rows) != chunk["rows"]:
+            raise ValueError(f"{chunk['file']} holds {len(rows)} rows, expected {chunk['rows']}")
+        return rows
+
+    @staticmethod
+    def verify(directory):
+        """Check every chunk before anything is deleted; returns the manifest"""
+        manifest = Backup.read_manifest(directory)
+        for table in Backup.tables(manifest):
+            for chunk in manifest["tables"][table]["chunks"]:
+                Backup.read_chunk(directory, chunk)
+        return manifest
+
+    @staticmethod
+    def secondary_indexes(cursor, table):
+        """name -> (unique, column list) for every index except the primary key"""
+        cursor.execute(
+            "SELECT INDEX_NAME, NON_UNIQUE, COLUMN_NAME, SUB_PART FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME <> 'PRIMARY' "
+            "ORDER BY INDEX_NAME, SEQ_IN_INDEX",
+            (table,)
+        )
+        indexes = {}
+        for name, non_unique, column, sub_part in cursor.fetchall():
+            unique, columns = indexes.setdefault(name, (not non_unique, []))
+            columns.append(f"{column}({sub_part})" if sub_part else column)
+        return indexes
+
+    @staticmethod
+    def foreign_key_columns(cursor, table):
+        """Columns of the table's foreign keys; InnoDB will not drop the indexes behind them"""
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.KEY_COLUMN_USAGE "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND REFERENCED_TABLE_NAME IS NOT NULL",
+            (table,)
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    @staticmethod
+    def restore(connection, directory, progress=print):
+        """Replace the core tables with a backup.
+
+        Rows are bulk-inserted in foreign-key order with foreign-key and unique
+        checks off and secondary indexes dropped, then the indexes are rebuilt
+        once per table and the appointment rollup is recomputed. Indexes that
+        back a foreign key stay in place.
+
+        Running clients see the restore through the usual delta sync: every row
+        that was there before gets a tombstone, and restored rows are stamped
+        with the load time, so they come back as changes.
+        """
+        manifest = Backup.verify(directory)
+        tables = Backup.tables(manifest)
+        cursor = connection.cursor()
+        for table in tables:
+            missing = set(manifest["tables"][table]["columns"]) - set(Backup.stored_columns(cursor, table))
+            if missing:
+                raise ValueError(f"{table} has no column(s) {', '.join(sorted(missing))}; upgrade the schema first")
+
+        cursor.execute("SET SESSION FOREIGN_KEY_CHECKS = 0")
+        cursor.execute("SET SESSION UNIQUE_CHECKS = 0")
+        indexes = {}
+        try:
+            for table in reversed(tables):
+                if table in DeltaSync.TABLES:
+                    cursor.execute(f"INSERT INTO SYNC_TOMBSTONE (TBL, PK) SELECT %s, {Backup.primary_key(table)} FROM {table}", (table,))
+                cursor.execute(f"DELETE FROM {table}")
+                connection.commit()
+            for table in tables:
+                foreign_keys = Backup.foreign_key_columns(cursor, table)
+                table_indexes = {name: index for name, index in Backup.secondary_indexes(cursor, table).items()
+                                 if index[1][0].split("(")[0] not in foreign_keys}
+                if table_indexes:
+                    cursor.execute(f"ALTER TABLE {table} " + ", ".join(f"DROP INDEX {name}" for name in table_indexes))
+                    indexes[table] = table_indexes
+
+            for table in tables:
+                entry = manifest["tables"][table]
+                # UPDATED_AT is left to its default, the time of the restore
+                keep = [index for index, column in enumerate(entry["columns"]) if column != "UPDATED_AT"]
+                columns = [entry["columns"][index] for index in keep]
+                insert = (f"INSERT INTO {table} ({', '.join(columns)}) "
+                          f"VALUES ({', '.join(['%s'] * len(columns))})")
+                for chunk in entry["chunks"]:
+                    rows = [[row[index] for index in keep] for row in Backup.read_chunk(directory, chunk)]
+                    for start in range(0, len(rows), Backup.INSERT_ROWS):
+                        cursor.executemany(insert, rows[start:start + Backup.INSERT_ROWS])
+                    connection.commit()
+                progress(f"{table}: {entry['rows']} rows loaded")
+        finally:
+            # Put back whatever was dropped, even when loading failed half way
+            for table, table_indexes in indexes.items():
+                cursor.execute(f"ALTER TABLE {table} " + ", ".join(
+                    f"ADD {'UNIQUE ' if unique else ''}INDEX {name} ({', '.join(columns)})"
+                    for name, (unique, columns) in table_indexes.items()
+                ))
+            cursor.execute("SET SESSION UNIQUE_CHECKS = 1")
+            cursor.execute("SET SESSION FOREIGN_KEY_CHECKS = 1")
+
+        cursor.execute("DELETE FROM APPT_DAILY_ROLLUP")
+        AppointmentRollup.backfill(cursor)
+        cursor.execute("DELETE FROM PATIENT_LAST_VISIT")
+        VisitSummary.backfill(cursor)
+        connection.commit()
+        for table in tables:
+            audit_event("RESTORE", table, os.path.basename(os.path.normpath(directory)),
+                        after={"taken_at": manifest["taken_at"], "rows": manifest["tables"][table]["rows"]})
+        progress(f"Restored the snapshot taken at {manifest['taken_at']}")
+
+# Concurrent-client load generator for the app's own data paths
+class LoadTest:
+    """Each simulated front desk is a thread with its own connection running a
+    weighted mix of the statements the forms and dashboard issue. Stages ramp
+    the number of clients; each stage reports throughput, latency percentiles
+    and error rates per operation.
+
+    The harness seeds its own departments, doctors and patients with keys from
+    ID_BASE up, only writes rows it created, and removes them all at the end,
+    tombstoned like any other delete. It runs against the default SQLite
+    stand-in or a scratch MySQL database; the live one is refused unless forced.
+    """
+    OPERATIONS = ("view", "search", "add", "update", "delete", "dashboard")
+    DEFAULT_MIX = {"view": 5, "search": 40, "add": 20, "update": 15, "delete": 10, "dashboard": 10}
+    ID_BASE = 900000000
+    # A stage counts as saturated when adding clients raises throughput by less than this
+    SATURATION_GAIN = 1.10
+    LAST_NAMES = ("Smith", "Patel", "Garcia", "Nguyen", "Kim", "Okafor", "Rossi", "Novak", "Silva", "Cohen")
+
+    def __init__(self, connect, mix=None, patients=5000, doctors=50, departments=10):
+        self.connect = connect
+        self.mix = mix or LoadTest.DEFAULT_MIX
+        self.patients = patients
+        self.doctors = doctors
+        self.departments = departments
+        self.next_id = LoadTest.ID_BASE
+        self.id_lock = threading.Lock()
+
+    @staticmethod
+    def parse_mix(text):
+        """'search=40,add=20' -> {'search': 40, 'add': 20}"""
+        mix = {}
+        for part in text.split(","):
+            name, _, weight = part.partition("=")
+            name = name.strip()
+            if name not in LoadTest.OPERATIONS:
+                raise ValueError(f"Unknown operation: {name}")
+            mix[name] = float(weight or 1)
+        return mix
+
+    @staticmethod
+    def sqlite_stand_in(path):
+        """A connect factory for a fresh local replica file, the schema offline clients run on"""
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        replica = LocalReplica(path)
+        return lambda: ReplicaConnection(replica)
+
+    def allocate_id(self):
+        with self.id_lock:
+            self.next_id += 1
+            return self.next_id
+
+    def seed(self):
+        base = LoadTest.ID_BASE
+        connection = self.connect()
+        try:
+            Statements.execute_many(connection, "dept_insert", [
+                (base + i, f"Load Dept {i}", i % 5, "5550000000") for i in range(self.departments)
+            ])
+            Statements.execute_many(connection, "doctor_insert", [
+                (base + i, "Load", f"Doctor{i}", "General", "5550000000", None, "5550000000") for i in range(self.doctors)
+            ])
+            Statements.execute_many(connection, "patient_insert", [
+                (base + i, "Load", f"{LoadTest.LAST_NAMES[i % len(LoadTest.LAST_NAMES)]}{i}", "1980-01-01",
+                 f"555{i:07d}", None, f"555{i:07d}") for i in range(self.patients)
+            ])
+            connection.commit()
+        finally:
+            connection.close()
+        self.next_id = base + max(self.patients, self.doctors, self.departments)
+
+    def remove_seeded(self):
+        """Delete everything at or above ID_BASE, keeping the appointment rollup and tombstones in step"""
+        connection = self.connect()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT A_DATE, DID, DepID FROM APPOINTMENT WHERE AID >= %s", (LoadTest.ID_BASE,))
+            AppointmentRollup.apply_many(cursor, cursor.fetchall(), -1)
+            for table in ("APPOINTMENT", "PATIENT", "DOCTOR", "DEPT"):
+                pk = DeltaSync.TABLES[table][0]
+                # Polling clients drop the rows, as they do for op_delete
+                cursor.execute(f"INSERT INTO SYNC_TOMBSTONE (TBL, PK) SELECT %s, {pk} FROM {table} WHERE {pk} >= %s", (table, LoadTest.ID_BASE))
+                cursor.execute(f"DELETE FROM {table} WHERE {pk} >= %s", (LoadTest.ID_BASE,))
+            connection.commit()
+        finally:
+            connection.close()
+
+    # One method per operation; each does what the matching handler does and commits like it
+    def op_view(self, session):
+        Statements.query(session["connection"], "select_all", table="PATIENT")
+
+    def op_search(self, session):
+        name = random.choice(LoadTest.LAST_NAMES)
+        Statements.query(session["connection"], "search_like", (f"%{name}{random.randint(0, 99)}%",), table="PATIENT", field="L_NAME")
+
+    def op_add(self, session):
+        connection = session["connection"]
+        base = LoadTest.ID_BASE
+        pid, did, depid = base + random.randrange(self.patients), base + random.randrange(self.doctors), base + random.randrange(self.departments)
+        for table, key in (("PATIENT", pid), ("DOCTOR", did), ("DEPT", depid)):
+            if Statements.query(connection, "exists", (key,), table=table)[0][0] == 0:
+                raise LookupError(f"{table} {key} not found")
+        aid = self.allocate_id()
+        a_date = (date.today() + timedelta(days=random.randint(0, 30))).isoformat()
+        Statements.execute(connection, "appointment_insert", (aid, pid, did, a_date, "09:30:00", depid))
+        AppointmentRollup.apply(connection.cursor(), a_date, did, depid, 1)
+        connection.commit()
+        session["appointments"][aid] = [pid, did, a_date, "09:30:00", depid, 1]
+
+    def op_update(self, session):
+        if not session["appointments"]:
+            return self.op_add(session)
+        connection = session["connection"]
+        aid = random.choice(list(session["appointments"]))
+        pid, did, a_date, a_time, depid, version = session["appointments"][aid]
+        a_time = f"{random.randint(8, 16):02d}:{random.choice(('00', '30'))}:00"
+        if Statements.execute(connection, "appointment_update", (aid, pid, did, a_date, a_time, depid, aid, version)) == 0:
+            connection.rollback()
+            raise RuntimeError(f"Appointment {aid} was changed by another client")
+        connection.commit()
+        session["appointments"][aid] = [pid, did, a_date, a_time, depid, version + 1]
+
+    def op_delete(self, session):
+        if not session["appointments"]:
+            return self.op_add(session)
+        connection = session["connection"]
+        aid = random.choice(list(session["appointments"]))
+        cursor = connection.cursor()
+        old_key = AppointmentRollup.fetch_appointment_key(cursor, aid)
+        if Statements.execute(connection, "delete", (aid,), table="APPOINTMENT") and old_key:
+            AppointmentRollup.apply(cursor, old_key[0], old_key[1], old_key[2], -1)
+        DeltaSync.record_delete(cursor, "APPOINTMENT", aid)
+        connection.commit()
+        del session["appointments"][aid]
+
+    def op_dashboard(self, session):
+        connection = session["connection"]
+        for table in ("PATIENT", "DOCTOR", "DEPT"):
+            Statements.query(connection, "count", table=table)
+        cursor = connection.cursor()
+        AppointmentRollup.count_for_date(cursor, date.today())
+        AppointmentRollup.daily_series(cursor, 30)
+
+    def client(self, deadline, results):
+        """One simulated desk: run weighted operations back to back until the deadline"""
+        session = {"connection": self.connect(), "appointments": {}}
+        names = list(self.mix)
+        weights = [self.mix[name] for name in names]
+        try:
+            while time.perf_counter() < deadline:
+                name = random.choices(names, weights)[0]
+                started = time.perf_counter()
+                try:
+                    getattr(self, f"op_{name}")(session)
+                    results.append((name, time.perf_counter() - started, None))
+                except Exception as e:
+                    try:
+                        session["connection"].rollback()
+                    except Exception:
+                        pass
+                    results.append((name, time.perf_counter() - started, type(e).__name__))
+        finally:
+            session["connection"].close()
+
+    @staticmethod
+    def percentile(ordered, fraction):
+        """Nearest-rank percentile of a sorted list"""
+        return ordered[max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))]
+
+    @staticmethod
+    def summarize(results, seconds):
+        """operation -> (count, per second, p50 ms, p95 ms, p99 ms, error fraction); '*' is all operations"""
+        by_operation = {}
+        for name, elapsed, error in results:
+            by_operation.setdefault(name, []).append((elapsed, error))
+            by_operation.setdefault("*", []).append((elapsed, error))
+        summary = {}
+        for name, samples in by_operation.items():
+            ordered = sorted(elapsed for elapsed, _ in samples)
+            errors = sum(1 for _, error in samples if error)
+            summary[name] = (len(samples), len(samples) / seconds,
+                             *(LoadTest.percentile(ordered, p) * 1000 for p in (0.50, 0.95, 0.99)),
+                             errors / len(samples))
+        return summary
+
+    def stage(self, clients, seconds):
+        results = []
+        deadline = time.perf_counter() + seconds
+        threads = [threading.Thread(target=self.client, args=(deadline, results), daemon=True) for _ in range(clients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return LoadTest.summarize(results, time.perf_counter() - started)
+
+    def run(self, levels, seconds, progress=print):
+        """Ramp through the client counts in `levels`; returns [(clients, summary)] and reports the saturation point"""
+        stages = []
+        self.seed()
+        try:
+            for clients in levels:
+                summary = self.stage(clients, seconds)
+                stages.append((clients, summary))
+                progress(LoadTest.format_stage(clients, summary))
+        finally:
+            self.remove_seeded()
+
+        for (previous, before), (clients, after) in zip(stages, stages[1:]):
+            if "*" in before and "*" in after and after["*"][1] < before["*"][1] * LoadTest.SATURATION_GAIN:
+                progress(f"Saturation: throughput stops growing beyond about {previous} clients "
+                         f"({before['*'][1]:.0f}/s at {previous}, {after['*'][1]:.0f}/s at {clients}; "
+                         f"p95 {before['*'][3]:.1f} -> {after['*'][3]:.1f} ms)")
+                break
+        else:
+            progress("No saturation point within the tested client counts")
+        return stages
+
+    @staticmethod
+    def format_stage(clients, summary):
+        lines = [f"{clients} clients", f"  {'operation':<10} {'count':>7} {'per s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}"]
+        for name in LoadTest.OPERATIONS + ("*",):
+            if name in summary:
+                count, rate, p50, p95, p99, errors = summary[name]
+                label = "all" if name == "*" else name
+                lines.append(f"  {label:<10} {count:>7} {rate:>8.1f} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f} {errors:>7.1%}")
+        return "\n".join(lines)
+
+# Per-patient summary reports (demographics, visits, diagnoses) as printable HTML
+class PatientReports:
+    """One read path serves a single report and a batch of thousands: fetch()
+    loads a chunk of patients with three set-based queries, render() turns one
+    patient's rows into a page. Batches fan chunks out over a process pool,
+    each worker with its own connection, so rendering runs on every core."""
+    CHUNK_SIZE = 200
+    DEFAULT_DIR = "reports"
+    STYLE = (
+        "body{font-family:Segoe UI,Arial,sans-serif;margin:2em;color:#1f2937}"
+        "h1{color:#2563eb;margin-bottom:0}table{border-collapse:collapse;width:100%;margin-bottom:1.5em}"
+        "th,td{border:1px solid #e5e7eb;padding:4px 8px;text-align:left;vertical-align:top}"
+        "th{background:#f8fafc}.muted{color:#6b7280}"
+        "@media print{body{margin:0}}"
+    )
+    # Set in each pool worker by init_worker
+    worker_connection = None
+
+    @staticmethod
+    def history_sources(table, include_archive):
+        return [table, Archiver.archive_table(table)] if include_archive else [table]
+
+    @staticmethod
+    def fetch(connection, pids, include_archive=True):
+        """pid -> (patient row, appointment rows, medical record rows) for the patients that exist"""
+        cursor = connection.cursor()
+        placeholders = ", ".join(["%s"] * len(pids))
+        cursor.execute(f"SELECT PID, F_NAME, L_NAME, DOB, PH, EMAIL FROM PATIENT WHERE PID IN ({placeholders})", tuple(pids))
+        reports = {row[0]: (row, [], []) for row in cursor.fetchall()}
+        if not reports:
+            return reports
+
+        for source in PatientReports.history_sources("APPOINTMENT", include_archive):
+            cursor.execute(f"""
+            SELECT A.PID, A.A_DATE, A.A_TIME, D.F_NAME, D.L_NAME, DP.D_NAME
+            FROM {source} A
+            LEFT JOIN DOCTOR D ON D.DID = A.DID
+            LEFT JOIN DEPT DP ON DP.DepID = A.DepID
+            WHERE A.PID IN ({placeholders})""", tuple(pids))
+            for pid, *row in cursor.fetchall():
+                reports[pid][1].append(row)
+        for source in PatientReports.history_sources("MED_RECORD", include_archive):
+            cursor.execute(f"""
+            SELECT M.PID, M.LAST_VISIT, D.F_NAME, D.L_NAME, M.DIAGNOSIS
+            FROM {source} M
+            LEFT JOIN DOCTOR D ON D.DID = M.DID
+            WHERE M.PID IN ({placeholders})""", tuple(pids))
+            for pid, *row in cursor.fetchall():
+                reports[pid][2].append(row)
+
+        for _, appointments, records in reports.values():
+            # Newest first; str() orders dates and TIME values from either database
+            appointments.sort(key=lambda row: (str(row[0]), str(row[1]).zfill(8)), reverse=True)
+            records.sort(key=lambda row: str(row[0]), reverse=True)
+        return reports
+
+    @staticmethod
+    def doctor_name(first, last):
+        return f"Dr. {first or ''} {last or ''}".strip() if first or last else "-"
+
+    @staticmethod
+    def render(patient, appointments, records, generated=None):
+        pid, first, last, dob, phone, email = patient
+        cell = lambda value: html.escape("" if value is None else str(value))
+        generated = generated or datetime.now()
+        visits = "".join(
+            f"<tr><td>{cell(day)}</td><td>{cell(slot)}</td><td>{cell(PatientReports.doctor_name(first_name, last_name))}</td><td>{cell(dept)}</td></tr>"
+            for day, slot, first_name, last_name, dept in appointments
+        ) or "<tr><td colspan='4' class='muted'>No appointments</td></tr>"
+        diagnoses = "".join(
+            f"<tr><td>{cell(day)}</td><td>{cell(PatientReports.doctor_name(first_name, last_name))}</td>"
+            f"<td>{cell(diagnosis).replace(chr(10), '<br>')}</td></tr>"
+            for day, first_name, last_name, diagnosis in records
+        ) or "<tr><td colspan='3' class='muted'>No medical records</td></tr>"
+        return (
+            f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>Patient {cell(pid)} summary</title>"
+            f"<style>{PatientReports.STYLE}</style></head><body>"
+            f"<h1>{cell(first)} {cell(last)}</h1><p class='muted'>Patient summary generated {generated:%Y-%m-%d %H:%M}</p>"
+            "<h2>Demographics</h2><table>"
+            f"<tr><th>Patient ID</th><td>{cell(pid)}</td></tr><tr><th>Date of birth</th><td>{cell(dob)}</td></tr>"
+            f"<tr><th>Phone</th><td>{cell(phone)}</td></tr><tr><th>Email</th><td>{cell(email)}</td></tr></table>"
+            f"<h2>Visit history ({len(appointments)})</h2>"
+            f"<table><tr><th>Date</th><th>Time</th><th>Doctor</th><th>Department</th></tr>{visits}</table>"
+            f"<h2>Diagnoses ({len(records)})</h2>"
+            f"<table><tr><th>Visit</th><th>Doctor</th><th>Diagnosis</th></tr>{diagnoses}</table>"
+            "</body></html>"
+        )
+
+    @staticmethod
+    def file_name(pid):
+        return f"patient-{pid}.html"
+
+    @staticmethod
+    def write(directory, reports):
+        generated = datetime.now()
+        for pid, (patient, appointments, records) in reports.items():
+            with open(os.path.join(directory, PatientReports.file_name(pid)), "w", encoding="utf-8") as page:
+                page.write(PatientReports.render(patient, appointments, records, generated))
+        return len(reports)
+
+    @staticmethod
+    def init_worker():
+        PatientReports.worker_connection = mysql_connector().connect(database="HospitalManagement", **DB_CONFIG)
+
+    @staticmethod
+    def render_chunk(pids, directory):
+        """Pool task: fetch and write one chunk of reports; returns how many were written"""
+        return PatientReports.write(directory, PatientReports.fetch(PatientReports.worker_connection, pids))
+
+    @staticmethod
+    def patient_ids(connection, chunk_size=CHUNK_SIZE):
+        """Stream all PIDs in chunks"""
+        cursor = connection.cursor()
+        cursor.execute("SELECT PID FROM PATIENT ORDER BY PID")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [row[0] for row in rows]
+
+    @staticmethod
+    def run(connection, directory=DEFAULT_DIR, pids=None, workers=None, chunk_size=CHUNK_SIZE, progress=print):
+        """Write reports for the given PIDs, or every patient, and return the number written"""
+        os.makedirs(directory, exist_ok=True)
+        if pids:
+            chunks = (pids[start:start + chunk_size] for start in range(0, len(pids), chunk_size))
+        else:
+            chunks = PatientReports.patient_ids(connection, chunk_size)
+        workers = workers or os.cpu_count() or 1
+        written = 0
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers, initializer=PatientReports.init_worker) as pool:
+            # Keep a couple of chunks per worker queued, not the whole patient list
+            pending = set()
+            for chunk in chunks:
+                pending.add(pool.submit(PatientReports.render_chunk, chunk, directory))
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    written += sum(future.result() for future in done)
+                    progress(f"{written} reports written")
+            for future in pending:
+                written += future.result()
+        progress(f"{written} reports written to {directory} in {time.perf_counter() - started:.1f}s")
+        return written
+
+# Data-quality scan of stored rows against the form validation rules
+class DataQualityScan:
+    """Rows written by older versions, direct SQL or imports never went through
+    ValidationUtils. The scan pages through each table by primary key, checks
+    the pages in a process pool and writes one CSV line per problem as results
+    arrive, so memory stays bounded by the pages in flight. Orphaned foreign
+    keys are found by the database with anti-joins. With fix=True the problems
+    that have an unambiguous correction (stray whitespace, phone formatting,
+    stale PH_KEY) are updated in place; everything else is only reported.
+    """
+    CHUNK_SIZE = 5000
+    # table -> (column, check, required)
+    RULES = {
+        "DEPT": [("D_NAME", "text", True), ("FLOOR", "count", False), ("TELEPHONE", "phone", False)],
+        "DOCTOR": [("F_NAME", "name", True), ("L_NAME", "name", True), ("SPEC", "text", True),
+                   ("PH", "phone", True), ("EMAIL", "email", False), ("PH_KEY", "phone_key", False)],
+        "PATIENT": [("F_NAME", "name", True), ("L_NAME", "name", True), ("DOB", "birth_date", True),
+                    ("PH", "phone", True), ("EMAIL", "email", False), ("PH_KEY", "phone_key", False)],
+        "APPOINTMENT": [("PID", "count", True), ("DID", "count", True), ("A_DATE", "visit_date", True),
+                        ("A_TIME", "text", True), ("DepID", "count", True)],
+        "MED_RECORD": [("PID", "count", True), ("DID", "count", True), ("LAST_VISIT", "visit_date", True),
+                       ("DIAGNOSIS", "text", False)],
+    }
+    # (child table, foreign key, parent table); the parent's key has the same name
+    REFERENCES = [
+        ("APPOINTMENT", "PID", "PATIENT"), ("APPOINTMENT", "DID", "DOCTOR"), ("APPOINTMENT", "DepID", "DEPT"),
+        ("MED_RECORD", "PID", "PATIENT"), ("MED_RECORD", "DID", "DOCTOR"),
+    ]
+    REPORT_HEADER = ["TABLE", "KEY", "COLUMN", "VALUE", "PROBLEM", "FIX", "FIXED"]
+
+    @staticmethod
+    def as_date(value):
+        if isinstance(value, date):
+            return value
+        is_valid, _ = ValidationUtils.validate_date(str(value))
+        return datetime.strptime(str(value), "%Y-%m-%d").date() if is_valid else None
+
+    @staticmethod
+    def check_value(check, value, row):
+        """Returns (problem, fix); problem is None for a good value, fix is None when there is no safe correction"""
+        text = str(value)
+        if check == "name":
+            fixed = " ".join(text.split())
+            if not ValidationUtils.validate_name(fixed)[0]:
+                return ValidationUtils.validate_name(text)[1], None
+            return (None, None) if fixed == text else ("Extra whitespace", fixed)
+        if check == "text":
+            if not text.strip():
+                return "Blank value", None
+            return (None, None) if text == text.strip() else ("Extra whitespace", text.strip())
+        if check == "count":
+            return (None, None) if ValidationUtils.validate_id(text, "Value")[0] or text == "0" else ("Not a positive number", None)
+        if check == "phone":
+            is_valid, clean = ValidationUtils.validate_phone(text)
+            if not is_valid:
+                return clean, None
+            return (None, None) if clean == text else ("Phone not normalized", clean)
+        if check == "phone_key":
+            expected = ValidationUtils.phone_key(str(row.get("PH") or ""))
+            return (None, None) if (value or None) == (expected or None) else ("PH_KEY does not match PH", expected)
+        if check == "email":
+            if ValidationUtils.validate_email(text)[0]:
+                return None, None
+            fixed = text.strip()
+            if ValidationUtils.validate_email(fixed)[0]:
+                return "Extra whitespace", fixed
+            return ValidationUtils.validate_email(text)[1], None
+        if check in ("birth_date", "visit_date"):
+            day = DataQualityScan.as_date(value)
+            if day is None:
+                return ValidationUtils.validate_date(text)[1], None
+            latest = date.today() if check == "birth_date" else date.today() + timedelta(days=5 * 365)
+            return (None, None) if date(1900, 1, 1) <= day <= latest else ("Date out of range", None)
+        raise ValueError(f"Unknown check: {check}")
+
+    @staticmethod
+    def check_chunk(table, rows):
+        """Pool task: [(key, column, value, problem, fix)] for one page of rows"""
+        rules = DataQualityScan.RULES[table]
+        names = [column for column, _, _ in rules]
+        problems = []
+        for key, *values in rows:
+            row = dict(zip(names, values))
+            for (column, check, required), value in zip(rules, values):
+                if value is None or value == "":
+                    if required:
+                        problems.append((key, column, value, "Missing value", None))
+                    continue
+                problem, fix = DataQualityScan.check_value(check, value, row)
+                if problem:
+                    problems.append((key, column, value, problem, fix))
+        return problems
+
+    @staticmethod
+    def pages(connection, table, chunk_size):
+        """Keyset pagination by primary key; each page is its own short query"""
+        pk = DeltaSync.TABLES[table][0]
+        columns = ", ".join(column for column, _, _ in DataQualityScan.RULES[table])
+        cursor = connection.cursor()
+        last = -2 ** 31
+        while True:
+            cursor.execute(f"SELECT {pk}, {columns} FROM {table} WHERE {pk} > %s ORDER BY {pk} LIMIT %s", (last, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            yield rows
+            last = rows[-1][0]
+
+    @staticmethod
+    def orphans(connection, table, fk, parent, chunk_size):
+        pk = DeltaSync.TABLES[table][0]
+        cursor = connection.cursor()
+        cursor.execute(f"""
+        SELECT C.{pk}, C.{fk} FROM {table} C
+        LEFT JOIN {parent} P ON P.{fk} = C.{fk}
+        WHERE C.{fk} IS NOT NULL AND P.{fk} IS NULL""")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+
+    @staticmethod
+    def apply_fixes(connection, table, problems):
+        """Write the fixable problems of one page; a row changed since it was read is left alone"""
+        pk = DeltaSync.TABLES[table][0]
+        cursor = connection.cursor()
+        fixed = []
+        for key, column, value, _, fix in problems:
+            if fix is None:
+                continue
+            guard, params = (f"{column} IS NULL", (fix, key)) if value is None else (f"{column} = %s", (fix, key, value))
+            cursor.execute(f"UPDATE {table} SET {column} = %s, VERSION = VERSION + 1 WHERE {pk} = %s AND {guard}", params)
+            if cursor.rowcount:
+                fixed.append((key, column, value, fix))
+        connection.commit()
+        for key, column, value, fix in fixed:
+            audit_event("FIX", table, key, before={column: value}, after={column: fix})
+        return {(key, column) for key, column, _, _ in fixed}
+
+    @staticmethod
+    def run(connection, out, tables=None, fix=False, workers=None, chunk_size=CHUNK_SIZE, progress=print):
+        """Scan the tables, write the CSV report and return {(table, problem): count}"""
+        tables = tables or list(DataQualityScan.RULES)
+        workers = workers or os.cpu_count() or 1
+        counts = {}
+        with open(out, "w", newline="", encoding="utf-8") as handle, ProcessPoolExecutor(max_workers=workers) as pool:
+            report = csv.writer(handle)
+            report.writerow(DataQualityScan.REPORT_HEADER)
+
+            def record(table, problems):
+                fixable = fix and any(correction is not None for *_, correction in problems)
+                fixed = DataQualityScan.apply_fixes(connection, table, problems) if fixable else set()
+                for key, column, value, problem, correction in problems:
+                    report.writerow([table, key, column, value, problem, correction, "yes" if (key, column) in fixed else ""])
+                    counts[(table, problem)] = counts.get((table, problem), 0) + 1
+
+            for table in tables:
+                scanned = 0
+                # First in, first out keeps the report in key order
+                pending = deque()
+                for rows in DataQualityScan.pages(connection, table, chunk_size):
+                    scanned += len(rows)
+                    pending.append(pool.submit(DataQualityScan.check_chunk, table, rows))
+                    if len(pending) >= workers * 2:
+                        record(table, pending.popleft().result())
+                while pending:
+                    record(table, pending.popleft().result())
+                progress(f"{table}: {scanned} rows scanned")
+
+            for table, fk, parent in DataQualityScan.REFERENCES:
+                if table not in tables:
+                    continue
+                for rows in DataQualityScan.orphans(connection, table, fk, parent, chunk_size):
+                    record(table, [(key, fk, value, f"No {parent} with {fk} {value}", None) for key, value in rows])
+
+        for (table, problem), count in sorted(counts.items()):
+            progress(f"{table}: {count} x {problem}")
+        progress(f"Report written to {out}")
+        return counts
+
+# Primary keys handed out by the server in blocks
+class IdAllocator:
+    """ID_BLOCK holds the next free key per table. A client leases a block of
+    keys with one atomic UPDATE and hands them out locally, so new records need
+    no duplicate check round trip and two desks can never pick the same key.
+    Keys of a block that is not used up are skipped, never reused."""
+    BLOCK_SIZE = 20
+    # Replicas lease bigger blocks ahead of time so they can keep adding records
+    # offline for a while; a new block is leased when fewer than half are left
+    REPLICA_BLOCK_SIZE = 200
+    RESERVE_SQL = "UPDATE ID_BLOCK SET NEXT_ID = GREATEST(NEXT_ID, %s) WHERE TBL = %s"
+
+    def __init__(self, connect, block_size=BLOCK_SIZE):
+        """connect opens a server connection used for one lease and then closed"""
+        self.connect = connect
+        self.block_size = block_size
+        self.blocks = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def create_schema(cursor):
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ID_BLOCK (
+            TBL VARCHAR(20) PRIMARY KEY,
+            NEXT_ID BIGINT NOT NULL
+        )
+        """)
+        # Start past every key in use, archived ones included; existing counters are kept
+        for table, (pk, _) in DeltaSync.TABLES.items():
+            sources = [table] + ([Archiver.archive_table(table)] if table in Archiver.TABLES else [])
+            highest = ", ".join(f"(SELECT COALESCE(MAX({pk}), 0) FROM {source})" for source in sources)
+            cursor.execute(
+                f"INSERT IGNORE INTO ID_BLOCK (TBL, NEXT_ID) SELECT %s, GREATEST({highest}, 0) + 1",
+                (table,)
+            )
+
+    @staticmethod
+    def lease(connection, table, size):
+        """Reserve `size` keys on the server and return the first; commits at once,
+        so the connection must not be holding anyone's open transaction"""
+        if getattr(connection, "in_transaction", False):
+            raise RuntimeError(f"Leasing {table} IDs would commit the connection's open transaction")
+        cursor = connection.cursor()
+        cursor.execute("UPDATE ID_BLOCK SET NEXT_ID = LAST_INSERT_ID(NEXT_ID + %s) WHERE TBL = %s", (size, table))
+        if cursor.rowcount != 1:
+            connection.rollback()
+            raise LookupError(f"No ID counter for {table}")
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        end = cursor.fetchone()[0]
+        connection.commit()
+        return end - size
+
+    @staticmethod
+    def lease_over(connect, table, size):
+        """Lease on a short-lived connection of its own, so no caller's transaction is committed with it"""
+        connection = connect()
+        try:
+            return IdAllocator.lease(connection, table, size)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def reserve(cursor, table, key):
+        """Move the counter past a key that was typed in by hand; call inside the insert's transaction"""
+        cursor.execute(IdAllocator.RESERVE_SQL, (int(key) + 1, table))
+
+    def next_id(self, table):
+        with self.lock:
+            start, end = self.blocks.get(table, (0, 0))
+            if start >= end:
+                start = IdAllocator.lease_over(self.connect, table, self.block_size)
+                end = start + self.block_size
+            self.blocks[table] = (start + 1, end)
+            return start
+
+# Database connection
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "passwd": "ENTER_PASSWORD"
+}
+
+# Bump whenever create_schema changes; startup skips all DDL while the
+# recorded version matches
+SCHEMA_VERSION = 11
+
+# Set HOSPITAL_REPLICA_PATH to run from a local SQLite replica that syncs
+# with the central MySQL server in the background (for slow or flaky links)
+REPLICA_PATH = os.environ.get("HOSPITAL_REPLICA_PATH")
+
+# Set HOSPITAL_AUDIT_DIR to keep the audit trail in segment files instead of
+# the AUDIT_LOG table; replica mode always uses files next to the replica
+AUDIT_DIR = os.environ.get("HOSPITAL_AUDIT_DIR")
+
+# Opened in the background once the window is up; see connect_database
+conn = None
+csr = None
+replica_sync = None
+audit_log = None
+
+def mysql_connector():
+    """Import the MySQL driver on first use; it is the slowest import at startup"""
+    import mysql.connector
+    return mysql.connector
+
+def is_connection_error(error):
+    """True for a lost or busy database connection, False for errors retrying will not fix"""
+    if isinstance(error, sqlite3.OperationalError):
+        # The replica is briefly locked while the sync thread writes
+        return "locked" in str(error)
+    try:
+        errors = mysql_connector().errors
+    except ImportError:
+        return False
+    return isinstance(error, (errors.OperationalError, errors.InterfaceError))
+
+def create_schema(cursor, database="HospitalManagement"):
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS {database}")
+    cursor.execute(f"USE {database}")
+
+    # Create tables
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS DEPT (
+        DepID INT PRIMARY KEY,
+        D_NAME VARCHAR(50),
+        FLOOR INT,
+        TELEPHONE VARCHAR(15)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS DOCTOR (
+        DID INT PRIMARY KEY,
+        F_NAME VARCHAR(50),
+        L_NAME VARCHAR(50),
+        SPEC VARCHAR(50),
+        PH VARCHAR(15),
+        EMAIL VARCHAR(100)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS PATIENT (
+        PID INT PRIMARY KEY,
+        F_NAME VARCHAR(50),
+        L_NAME VARCHAR(50),
+        DOB DATE,
+        PH VARCHAR(15),
+        EMAIL VARCHAR(100)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS APPOINTMENT (
+        AID INT PRIMARY KEY,
+        PID INT,
+        DID INT,
+        A_DATE DATE,
+        A_TIME TIME,
+        DepID INT,
+        FOREIGN KEY (PID) REFERENCES PATIENT(PID),
+        FOREIGN KEY (DID) REFERENCES DOCTOR(DID),
+        FOREIGN KEY (DepID) REFERENCES DEPT(DepID)
+    )
+    """)
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS MED_RECORD (
+        RID INT PRIMARY KEY,
+        PID INT,
+        DID INT,
+        LAST_VISIT DATE,
+        DIAGNOSIS TEXT,
+        FOREIGN KEY (PID) REFERENCES PATIENT(PID),
+        FOREIGN KEY (DID) REFERENCES DOCTOR(DID)
+    )
+    """)
+
+    AppointmentRollup.create_table(cursor)
+    DeltaSync.ensure_schema(cursor)
+    Archiver.create_tables(cursor)
+    # Reads the archive too, so it has to exist first
+    AppointmentRollup.backfill(cursor)
+    VisitSummary.create_table(cursor)
+    VisitSummary.backfill(cursor)
+    # Calendar range loads for one doctor or department
+    ensure_index(cursor, "APPOINTMENT", "IDX_APPOINTMENT_DID_DATE", "DID, A_DATE")
+    ensure_index(cursor, "APPOINTMENT", "IDX_APPOINTMENT_DEPT_DATE", "DepID, A_DATE")
+    PhoneKeys.create_schema(cursor)
+    PatientMatcher.create_schema(cursor)
+    PatientQueues.create_schema(cursor)
+    ReminderJob.create_schema(cursor)
+    AuditLog.create_schema(cursor)
+    IdAllocator.create_schema(cursor)
+    AppointmentSeries.create_schema(cursor)
+
+    cursor.execute("CREATE TABLE IF NOT EXISTS SCHEMA_INFO (VERSION INT NOT NULL)")
+    cursor.execute("DELETE FROM SCHEMA_INFO")
+    cursor.execute("INSERT INTO SCHEMA_INFO (VERSION) VALUES (%s)", (SCHEMA_VERSION,))
+
+def installed_schema_version(cursor, database="HospitalManagement"):
+    try:
+        cursor.execute(f"USE {database}")
+        cursor.execute("SELECT MAX(VERSION) FROM SCHEMA_INFO")
+        return cursor.fetchone()[0]
+    except Exception:
+        # Missing database or SCHEMA_INFO table: a fresh install
+        return None
+
+def audit_directory():
+    if AUDIT_DIR or not REPLICA_PATH:
+        return AUDIT_DIR or AuditLog.DEFAULT_DIR
+    return os.path.join(os.path.dirname(os.path.abspath(REPLICA_PATH)), "audit")
+
+def start_audit_log():
+    global audit_log
+    writer = None
+    if not (AUDIT_DIR or REPLICA_PATH):
+        writer = lambda: mysql_connector().connect(database="HospitalManagement", **DB_CONFIG)
+    audit_log = AuditLog(writer, audit_directory())
+    audit_log.start()
+
+def audit_event(action, table, key, before=None, after=None):
+    """Queue an audit event when the audit writer is running"""
+    if audit_log is not None:
+        audit_log.record(action, table, key, before, after)
+
+def lease_connection():
+    """Server connection for one IdAllocator lease, kept apart from the UI's transactions"""
+    return mysql_connector().connect(database="HospitalManagement", **DB_CONFIG)
+
+def reserve_ids(table, keys):
+    """Keep keys typed in by hand out of future leases; call inside the insert's transaction"""
+    keys = [int(key) for key in keys]
+    if REPLICA_PATH:
+        for key in keys:
+            conn.replica.reserve_id(conn.db, table, key)
+        # Queued with the insert, so the server moves its counter when the sync replays them
+        conn.enqueue(IdAllocator.RESERVE_SQL, [(max(keys) + 1, table)])
+    else:
+        IdAllocator.reserve(csr, table, max(keys))
+
+def connect_database(timer):
+    """Open the connection and bring the schema up to date; runs off the UI thread"""
+    global conn, csr, replica_sync
+    if REPLICA_PATH:
+        replica = LocalReplica(REPLICA_PATH)
+        conn = ReplicaConnection(replica)
+        csr = conn.cursor()
+        replica_sync = WriteBehindSync(replica, lambda: mysql_connector().connect(database="HospitalManagement", **DB_CONFIG))
+        replica_sync.start()
+        start_audit_log()
+        timer.mark("replica opened")
+        return
+
+    conn = mysql_connector().connect(**DB_CONFIG)
+    if not conn.is_connected():
+        raise Exception("Failed to connect to MySQL")
+    csr = conn.cursor()
+    timer.mark("db connected")
+
+    if installed_schema_version(csr) != SCHEMA_VERSION:
+        create_schema(csr)
+        conn.commit()
+        PhoneKeys.backfill(conn)
+        timer.mark("schema created")
+    DeltaSync.prune_tombstones(csr)
+    PatientQueues.prune_events(csr)
+    conn.commit()
+    start_audit_log()
+    timer.mark("schema checked")
+
+# Main Application Class
+class ModernHospitalManagement:
+    # Large results are inserted into a Treeview in slices of about this long,
+    # so the window keeps painting and responding in between
+    RENDER_SLICE_SECONDS = 0.012
+
+    def __init__(self):
+        self.timer = StartupTimer()
+        self.timer.mark("imports")
+        self.root = tk.Tk()
+        self.setup_window()
+        self.create_styles()
+        self.create_header()
+        self.create_navigation()
+        self.setup_data()
+        self.create_main_content()
+        self.timer.mark("window built")
+        self.start_database()
+        
+        # Start the Tkinter event loop
+        self.root.after(0, lambda: self.timer.mark("first frame"))
+        self.root.mainloop()
+
+    def start_database(self):
+        """Connect in the background so the window appears immediately"""
+        self.db_error = None
+        self.set_navigation_state("disabled")
+
+        def worker():
+            try:
+                connect_database(self.timer)
+            except Exception as e:
+                self.db_error = e
+            self.db_done = True
+
+        self.db_done = False
+        threading.Thread(target=worker, daemon=True).start()
+        self.root.after(50, self.check_database)
+
+    def check_database(self):
+        # Tk is not thread-safe, so the UI thread polls for the worker's result
+        if not self.db_done:
+            self.root.after(50, self.check_database)
+            return
+        if self.db_error is not None:
+            # Nothing works without the database: try again or close the app
+            if messagebox.askretrycancel("Database Error", f"Error connecting to database: {str(self.db_error)}"):
+                self.start_database()
+            else:
+                self.root.destroy()
+            return
+        self.db_ready = True
+        self.set_navigation_state("normal")
+        self.root.after(DeltaSync.POLL_INTERVAL_MS, self.poll_changes)
+        if self.active_table is None:
+            self.show_dashboard()
+        self.timer.mark("ready")
+        self.timer.report()
+
+    def set_navigation_state(self, state):
+        for btn in self.nav_buttons:
+            btn.configure(state=state)
+
+    def setup_window(self):
+        self.root.title("Hospital Management System")
+        self.root.geometry("1400x900")
+        self.root.configure(bg=ModernColors.BACKGROUND)
+        self.root.state('zoomed')  # Maximize window on Windows
+        
+        # Center window
+        x = (self.root.winfo_screenwidth() // 2) - (1400 // 2)
+        y = (self.root.winfo_screenheight() // 2) - (900 // 2)
+        self.root.geometry(f"1400x900+{x}+{y}")
+        
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+    
+    def create_styles(self):
+        # Create custom fonts
+        self.title_font = font.Font(family="Segoe UI", size=24, weight="bold")
+        self.heading_font = font.Font(family="Segoe UI", size=16, weight="bold")
+        self.subheading_font = font.Font(family="Segoe UI", size=12, weight="bold")
+        self.body_font = font.Font(family="Segoe UI", size=10)
+    
+    def create_header(self):
+        # Header frame
+        header_frame = tk.Frame(self.root, bg=ModernColors.PRIMARY, height=80)
+        header_frame.pack(fill="x", pady=(0, 2))
+        header_frame.pack_propagate(False)
+        
+        # Title
+        title_label = tk.Label(
+            header_frame, 
+            text="🏥 Hospital Management System",
+            font=self.title_font,
+            bg=ModernColors.PRIMARY,
+            fg="white"
+        )
+        title_label.pack(pady=20)
+        
+        # Subtitle
+        subtitle_label = tk.Label(
+            header_frame,
+            text="Advanced Healthcare Management Solution",
+            font=("Segoe UI", 10),
+            bg=ModernColors.PRIMARY,
+            fg="#93c5fd"
+        )
+        subtitle_label.pack()
+    
+    def create_navigation(self):
+        # Navigation frame
+        nav_frame = tk.Frame(self.root, bg=ModernColors.SURFACE, height=60)
+        nav_frame.pack(fill="x", pady=(0, 10))
+        nav_frame.pack_propagate(False)
+        
+        # Navigation buttons
         nav_buttons = [
             ("👥 Patients", self.show_patients),
             ("👨‍⚕️ Doctors", self.show_doctors),
@@ -377,6 +4110,20 @@ class ModernHospitalManagement:
             btn.bind("<Enter>", lambda e, b=btn: b.configure(bg=ModernColors.PRIMARY, fg="white"))
             btn.bind("<Leave>", lambda e, b=btn: b.configure(bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY))
             self.nav_buttons.append(btn)
+
+        # Offline replica status; click to review sync conflicts
+        self.sync_status = None
+        if REPLICA_PATH:
+            self.sync_status = tk.Label(
+                nav_frame,
+                text="Offline replica",
+                font=("Segoe UI", 9),
+                bg=ModernColors.SURFACE,
+                fg=ModernColors.TEXT_SECONDARY,
+                cursor="hand2"
+            )
+            self.sync_status.place(relx=1.0, rely=0.5, anchor="e", x=-15)
+            self.sync_status.bind("<Button-1>", lambda e: self.show_sync_conflicts())
     
     def create_main_content(self):
         # Main content frame
@@ -387,22 +4134,331 @@ class ModernHospitalManagement:
         self.show_dashboard()
     
     def clear_main_frame(self):
+        for table in list(self.render_jobs):
+            self.cancel_render(table)
         for widget in self.main_frame.winfo_children():
             widget.destroy()
 
-    def highlight_nav_button(self, index):
-        for i, btn in enumerate(self.nav_buttons):
-            if i == index:
-                btn.configure(bg=ModernColors.PRIMARY, fg="white")
+    def highlight_nav_button(self, index):
+        for i, btn in enumerate(self.nav_buttons):
+            if i == index:
+                btn.configure(bg=ModernColors.PRIMARY, fg="white")
+            else:
+                btn.configure(bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY)
+    
+    def setup_data(self):
+        self.db_ready = False
+        self.diagnosis_cache = LRUCache(maxsize=32)
+        # Leases primary keys for records added with a blank ID field
+        self.ids = None
+        self.search_cache = QueryCache()
+        self.diagnosis_incomplete = False
+
+        # Delta sync state: which table is on screen, its sync cursor, and
+        # whether the Treeview shows search results rather than the full table
+        self.active_table = None
+        self.sync_cursor = {}
+        self.tree_filtered = {}
+        # Last poll error shown to the user, so a persistent one is reported once
+        self.poll_error = None
+        # table -> ColumnStore of the rows currently loaded, and the local filter/sort applied to it
+        self.result_stores = {}
+        self.calendar = None
+        self.local_views = {}
+        # table -> pending root.after job of a progressive render, and the row counter under its tree
+        self.render_jobs = {}
+        self.row_counters = {}
+        self.table_trees = {
+            "PATIENT": "tree_patient",
+            "DOCTOR": "tree_doctor",
+            "DEPT": "tree_department",
+            "APPOINTMENT": "tree_appointment",
+            "MED_RECORD": "tree_medrecord",
+        }
+
+    def load_table_rows(self, table, tree, statement="select_all", params=(), field=None, filtered=False, include_archive=False, cache_key=None):
+        """Reload a Treeview from scratch and reset the table's sync cursor.
+
+        Only the hot table is read unless include_archive is set; archived rows are shown greyed out.
+        With a cache_key, a cached result is reused together with the sync cursor it was read at,
+        so the next delta poll brings it up to date.
+        """
+        cached = self.search_cache.get(cache_key) if cache_key else None
+        if cached:
+            sync_cursor, rows, archived_rows = cached
+        else:
+            sync_cursor = DeltaSync.server_time(csr)
+            rows = Statements.query(conn, statement, params, table=table, field=field)
+            archived_rows = []
+            if include_archive:
+                archived_rows = Statements.query(conn, statement, params, table=table, field=field, archive=True)
+            if cache_key:
+                self.search_cache.put(cache_key, (sync_cursor, rows, archived_rows), len(rows) + len(archived_rows))
+
+        self.sync_cursor[table] = sync_cursor
+        self.tree_filtered[table] = filtered
+        self.result_stores[table] = ColumnStore(len(DeltaSync.TABLES[table][1]) + 1, rows, archived_rows)
+        self.render_store(table, tree)
+
+    def render_store(self, table, tree=None):
+        """Fill the Treeview from the table's ColumnStore with the local filter and sort applied"""
+        tree = tree or getattr(self, self.table_trees[table], None)
+        store = self.result_stores.get(table)
+        if tree is None or store is None or not tree.winfo_exists():
+            return
+        self.cancel_render(table)
+        view = self.local_views.setdefault(table, {"text": "", "sort": None, "descending": False})
+        # The trailing VERSION column is not shown, so it is not searched either
+        positions = store.select(view["text"], range(store.width - 1), view["sort"], view["descending"])
+        tree.delete(*tree.get_children())
+        tree.tag_configure("archived", foreground=ModernColors.TEXT_SECONDARY)
+        counter = self.row_counter(table, tree)
+        total = len(positions)
+        progress = {"next": 0, "shown": 0}
+
+        def render_slice():
+            """Insert rows until the slice's time is up, then yield to the event loop"""
+            self.render_jobs.pop(table, None)
+            if not tree.winfo_exists():
+                return
+            deadline = time.perf_counter() + self.RENDER_SLICE_SECONDS
+            index, shown = progress["next"], progress["shown"]
+            while index < total:
+                position = int(positions[index])
+                index += 1
+                # Rows deleted by another client since the selection are skipped
+                if store.live[position]:
+                    row = store.row(position)
+                    tree.insert("", tk.END, iid=str(row[0]), values=row, tags=("archived",) if store.is_archived(position) else ())
+                    shown += 1
+                if index % 64 == 0 and time.perf_counter() >= deadline:
+                    break
+            progress["next"], progress["shown"] = index, shown
+            if index < total:
+                counter.configure(text=f"Loading... {shown:,} of {total:,} rows")
+                self.render_jobs[table] = self.root.after(1, render_slice)
+            else:
+                counter.configure(text=f"{shown:,} rows")
+
+        # The first slice runs now, so the top of the result is painted in the same frame
+        render_slice()
+
+    def cancel_render(self, table):
+        """Stop a progressive render that has not finished; the rows inserted so far stay"""
+        job = self.render_jobs.pop(table, None)
+        if job is not None:
+            self.root.after_cancel(job)
+
+    def refresh_row_counter(self, table, tree):
+        counter = self.row_counters.get(table)
+        if table not in self.render_jobs and counter is not None and counter.winfo_exists():
+            counter.configure(text=f"{len(tree.get_children()):,} rows")
+
+    def row_counter(self, table, tree):
+        """Label under the table's Treeview showing how many rows are loaded"""
+        counter = self.row_counters.get(table)
+        if counter is None or not counter.winfo_exists():
+            container = tree.master
+            counter = tk.Label(container.master, font=("Segoe UI", 9), bg=container.master.cget("bg"), fg=ModernColors.TEXT_SECONDARY)
+            counter.pack(side="bottom", anchor="e", padx=20, before=container)
+            self.row_counters[table] = counter
+        return counter
+
+    def local_view_active(self, table):
+        view = self.local_views.get(table)
+        return bool(view and (view["text"] or view["sort"] is not None))
+
+    def add_local_filter(self, parent, table):
+        """Entry that narrows the rows already loaded without another query"""
+        entry = ModernEntry(parent, placeholder="Filter loaded...", width=15)
+        entry.pack(side="left", padx=5)
+        pending = {"job": None}
+
+        def apply():
+            pending["job"] = None
+            self.local_views.setdefault(table, {"text": "", "sort": None, "descending": False})["text"] = entry.get_value()
+            self.render_store(table)
+
+        def schedule(event):
+            # Wait for a pause in typing before re-rendering
+            if pending["job"]:
+                self.root.after_cancel(pending["job"])
+            pending["job"] = self.root.after(150, apply)
+
+        entry.bind("<KeyRelease>", schedule)
+
+    def enable_local_sort(self, table, tree):
+        """Clicking a heading sorts the loaded rows locally; clicking it again reverses the order"""
+        def sort_by(column):
+            view = self.local_views.setdefault(table, {"text": "", "sort": None, "descending": False})
+            view["descending"] = view["sort"] == column and not view["descending"]
+            view["sort"] = column
+            self.render_store(table, tree)
+
+        for column, name in enumerate(tree["columns"]):
+            tree.heading(name, command=lambda column=column: sort_by(column))
+
+    def allocate_id(self, table):
+        """Next key from this client's leased block; replica clients use the blocks kept in the replica"""
+        if REPLICA_PATH:
+            return str(conn.replica.next_id(conn.db, table))
+        if self.ids is None:
+            self.ids = IdAllocator(lease_connection)
+        return str(self.ids.next_id(table))
+
+    def reserve_id(self, table, key):
+        """Keep future leases clear of a key typed in by hand"""
+        reserve_ids(table, [key])
+
+    def refresh_visit_summary(self, *pids):
+        """Recompute the patients' latest-visit rows in the current transaction"""
+        if REPLICA_PATH:
+            # The replica holds neither the summary nor the archive, so only the server recomputes it
+            for sql, params in VisitSummary.statements(pids):
+                conn.enqueue(sql, [params])
+        else:
+            VisitSummary.refresh(csr, pids)
+
+    def audit(self, action, table, key, before=None, after=None):
+        """Queue an audit event; before is a Treeview row (VERSION last), after the written column values"""
+        columns = DeltaSync.TABLES[table][1]
+        if before is not None:
+            before = dict(zip(columns + ["VERSION"], before))
+            if table == "MED_RECORD":
+                # The Treeview only holds a preview; log the full text loaded on selection
+                diagnosis = self.diagnosis_cache.get((str(before["RID"]), str(before["VERSION"])))
+                if diagnosis is not None:
+                    before["DIAGNOSIS"] = diagnosis
+        audit_event(action, table, key, before, None if after is None else dict(zip(columns, after)))
+
+    def forget_rows(self, table, tree, keys):
+        """Drop deleted rows from the Treeview and the loaded ColumnStore"""
+        store = self.result_stores.get(table)
+        for key in keys:
+            if store is not None:
+                store.delete(key)
+            if tree.exists(str(key)):
+                tree.delete(str(key))
+        self.refresh_row_counter(table, tree)
+
+    def phone_aware_filter(self, search_field, search_value):
+        """A full phone number is an exact match on the indexed PH_KEY; anything else stays a LIKE.
+
+        Returns (statement, field, params) for load_table_rows.
+        """
+        phone_key = ValidationUtils.phone_key(search_value)
+        if search_field == "PH" and len(phone_key) == 10:
+            return "search_phone_key", None, (phone_key,)
+        return "search_like", search_field, (f"%{search_value}%",)
+
+    def is_archived_selection(self, tree):
+        return "archived" in tree.item(tree.selection()[0], "tags")
+
+    def poll_changes(self):
+        """Periodically patch the visible Treeview with rows other clients changed"""
+        try:
+            self.apply_remote_changes()
+            self.refresh_sync_status()
+            self.poll_error = None
+        except Exception as e:
+            # A dropped connection is transient: a missed poll is picked up by the next one
+            if not is_connection_error(e) and str(e) != self.poll_error:
+                self.poll_error = str(e)
+                messagebox.showerror("Sync Error", f"Changes made by other users are not being loaded:\n{str(e)}\n\nReopen the tab or restart the application.")
+        self.root.after(DeltaSync.POLL_INTERVAL_MS, self.poll_changes)
+
+    def refresh_sync_status(self):
+        if not self.sync_status or not replica_sync:
+            return
+        pending, conflicts = replica_sync.status()
+        state = "online" if replica_sync.online else "offline"
+        self.sync_status.configure(
+            text=f"Replica {state} | {pending} pending | {conflicts} conflicts",
+            fg=ModernColors.ERROR if conflicts else (ModernColors.SUCCESS if replica_sync.online else ModernColors.WARNING)
+        )
+
+    def show_sync_conflicts(self):
+        if not replica_sync:
+            return
+        conflicts = replica_sync.conflicts()
+        if not conflicts:
+            detail = f"No sync conflicts.\nLast error: {replica_sync.last_error or 'none'}"
+            messagebox.showinfo("Replica Sync", detail)
+            return
+        lines = [f"{created}: {error}\n  {sql.split()[0]} {params}" for created, sql, params, error in conflicts]
+        messagebox.showwarning("Replica Sync Conflicts", "These offline changes could not be applied on the server:\n\n" + "\n".join(lines))
+
+    def apply_remote_changes(self):
+        table = self.active_table
+        tree = getattr(self, self.table_trees.get(table, ""), None)
+        if table in self.sync_cursor and tree is not None and tree.winfo_exists():
+            rows, deleted, self.sync_cursor[table] = DeltaSync.changes_since(csr, table, self.sync_cursor[table])
+            if rows or deleted:
+                self.search_cache.invalidate(table)
+            insert_new = not self.tree_filtered.get(table)
+            if table == "APPOINTMENT" and (rows or deleted) and self.calendar is not None and self.calendar.winfo_exists():
+                self.calendar.apply_changes(rows, deleted)
+            store = self.result_stores.get(table)
+            if store is not None:
+                for row in rows:
+                    store.upsert(row, insert_new)
+                for key in deleted:
+                    store.delete(key)
+            # A render still in progress would trip over rows patched in ahead of it
+            if (rows or deleted) and (self.local_view_active(table) or table in self.render_jobs):
+                self.render_store(table, tree)
             else:
-                btn.configure(bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY)
-    
-    def setup_data(self):
-        # This can be used for initial data loading or setup
-        pass
+                DeltaSync.patch_tree(tree, rows, deleted, insert_new)
+                if rows or deleted:
+                    self.refresh_row_counter(table, tree)
+
+    def show_history(self, table):
+        """Audit events for the selected row, newest first"""
+        tree = getattr(self, self.table_trees[table])
+        if not tree.selection():
+            messagebox.showerror("Error", "Please select a record to show its history")
+            return
+        key = tree.item(tree.selection()[0], 'values')[0]
+        try:
+            if REPLICA_PATH or AUDIT_DIR:
+                rows = AuditLog.read_segments(audit_directory(), table, key)[:AuditLog.HISTORY_LIMIT]
+            else:
+                rows = AuditLog.history(conn, table, key)
+        except Exception as e:
+            messagebox.showerror("Database Error", f"Error loading history: {str(e)}")
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title(f"History of {table} {key}")
+        window.geometry("900x400")
+        history = ttk.Treeview(window, columns=("AT", "ACTOR", "ACTION", "CHANGES"), show="headings")
+        for column, heading, width in (("AT", "When", 170), ("ACTOR", "User", 100), ("ACTION", "Action", 90), ("CHANGES", "Changes", 520)):
+            history.heading(column, text=heading)
+            history.column(column, width=width, minwidth=60)
+        history.pack(fill="both", expand=True, padx=10, pady=10)
+        for at, actor, action, _, _, before, after in rows:
+            before = json.loads(before) if before else {}
+            after = json.loads(after) if after else {}
+            if before and after:
+                changes = "; ".join(f"{column}: {before.get(column)} -> {value}" for column, value in after.items()
+                                    if str(before.get(column)) != str(value))
+            else:
+                changes = "; ".join(f"{column}: {value}" for column, value in (after or before).items())
+            history.insert("", "end", values=(at, actor, action, changes or "no changes"))
+        if not rows:
+            history.insert("", "end", values=("", "", "", "No recorded changes"))
+
+    def show_conflict(self, entity):
+        conn.rollback()
+        messagebox.showerror(
+            "Update Conflict",
+            f"This {entity} was changed or deleted by another user.\nThe table has been refreshed; please review and try again."
+        )
+        self.apply_remote_changes()
 
     def show_dashboard(self):
         self.clear_main_frame()
+        self.active_table = None
         
         dashboard_frame = tk.Frame(self.main_frame, bg=ModernColors.BACKGROUND)
         dashboard_frame.pack(fill="both", expand=True)
@@ -417,24 +4473,30 @@ class ModernHospitalManagement:
         )
         welcome_label.pack(pady=20)
         
+        if not self.db_ready:
+            tk.Label(
+                dashboard_frame,
+                text="Connecting to database...",
+                font=self.body_font,
+                bg=ModernColors.BACKGROUND,
+                fg=ModernColors.TEXT_SECONDARY
+            ).pack(pady=20)
+            return
+        
         # Stats cards
         stats_frame = tk.Frame(dashboard_frame, bg=ModernColors.BACKGROUND)
         stats_frame.pack(pady=20)
         
         # Fetch actual data from the database
         try:
-            csr.execute("SELECT COUNT(*) FROM PATIENT")
-            patient_count = csr.fetchone()[0]
+            patient_count = Statements.query(conn, "count", table="PATIENT")[0][0]
             
-            csr.execute("SELECT COUNT(*) FROM DOCTOR")
-            doctor_count = csr.fetchone()[0]
+            doctor_count = Statements.query(conn, "count", table="DOCTOR")[0][0]
             
             today = datetime.now().strftime('%Y-%m-%d')
-            csr.execute("SELECT COUNT(*) FROM APPOINTMENT WHERE A_DATE = %s", (today,))
-            appointment_count = csr.fetchone()[0]
+            appointment_count = AppointmentRollup.count_for_date(csr, today)
             
-            csr.execute("SELECT COUNT(*) FROM DEPT")
-            department_count = csr.fetchone()[0]
+            department_count = Statements.query(conn, "count", table="DEPT")[0][0]
             
         except Exception as e:
             messagebox.showerror("Database Error", f"Failed to fetch dashboard stats: {str(e)}")
@@ -472,9 +4534,89 @@ class ModernHospitalManagement:
             )
             title_label.pack()
 
+        self.create_caller_lookup(dashboard_frame)
+        self.create_trend_section(dashboard_frame)
+
+    def create_caller_lookup(self, parent):
+        lookup_frame = tk.Frame(parent, bg=ModernColors.SURFACE, relief="solid", bd=1)
+        lookup_frame.pack(pady=10, padx=20, ipadx=10, ipady=5)
+
+        controls = tk.Frame(lookup_frame, bg=ModernColors.SURFACE)
+        controls.pack(pady=5)
+        tk.Label(controls, text="Caller ID:", font=self.subheading_font, bg=ModernColors.SURFACE, fg=ModernColors.TEXT_PRIMARY).pack(side="left", padx=5)
+        self.caller_entry = ModernEntry(controls, placeholder="Phone number...", width=25)
+        self.caller_entry.pack(side="left", padx=5)
+        self.caller_entry.bind("<Return>", lambda e: self.lookup_caller())
+        ModernButton(controls, "Lookup", self.lookup_caller, "primary").pack(side="left", padx=5)
+
+        self.caller_result = tk.Label(lookup_frame, text="", font=self.body_font, bg=ModernColors.SURFACE, fg=ModernColors.TEXT_SECONDARY, justify="left")
+        self.caller_result.pack(padx=10)
+
+    def lookup_caller(self):
+        phone = self.caller_entry.get_value()
+        if len(ValidationUtils.phone_key(phone)) < 10:
+            self.caller_result.configure(text="Enter at least 10 digits", fg=ModernColors.ERROR)
+            return
+        try:
+            patients, doctors = PhoneKeys.caller_lookup(csr, phone)
+        except Exception as e:
+            messagebox.showerror("Database Error", f"Error looking up caller: {str(e)}")
+            return
+        lines = [f"Patient {row[0]}: {row[1]} {row[2]} (born {row[3]})" for row in patients]
+        lines += [f"Doctor {row[0]}: Dr. {row[1]} {row[2]} ({row[3]})" for row in doctors]
+        self.caller_result.configure(text="\n".join(lines) if lines else "No patient or doctor with this number",
+                                     fg=ModernColors.TEXT_PRIMARY if lines else ModernColors.TEXT_SECONDARY)
+
+    def create_trend_section(self, parent):
+        trend_frame = tk.Frame(parent, bg=ModernColors.SURFACE, relief="solid", bd=1)
+        trend_frame.pack(pady=10, padx=20, ipadx=10, ipady=10)
+
+        tk.Label(trend_frame, text="Appointment Trend", font=self.subheading_font, bg=ModernColors.SURFACE, fg=ModernColors.TEXT_PRIMARY).pack(pady=(5, 5))
+
+        controls = tk.Frame(trend_frame, bg=ModernColors.SURFACE)
+        controls.pack(pady=5)
+
+        tk.Label(controls, text="Department:", font=self.body_font, bg=ModernColors.SURFACE, fg=ModernColors.TEXT_PRIMARY).pack(side="left", padx=5)
+        self.trend_dept = ttk.Combobox(controls, values=["All"], font=self.body_font, width=12, state="readonly")
+        self.trend_dept.pack(side="left", padx=5)
+        self.trend_dept.set("All")
+        try:
+            self.trend_dept.configure(values=["All"] + [str(row[0]) for row in Statements.query(conn, "dept_ids")])
+        except Exception:
+            pass
+        self.trend_dept.bind("<<ComboboxSelected>>", lambda e: self.refresh_trend())
+
+        self.trend_days = 30
+        for days in (30, 90, 365):
+            ModernButton(controls, f"{days} days", lambda d=days: self.refresh_trend(d), "secondary").pack(side="left", padx=5)
+
+        self.trend_label = tk.Label(trend_frame, text="", font=self.body_font, bg=ModernColors.SURFACE, fg=ModernColors.TEXT_SECONDARY)
+        self.trend_label.pack()
+
+        self.trend_sparkline = Sparkline(trend_frame, color=ModernColors.WARNING)
+        self.trend_sparkline.pack(fill="x", padx=10, pady=5)
+
+        tk.Label(trend_frame, text=f"Search cache: {self.search_cache.stats()}", font=("Segoe UI", 9), bg=ModernColors.SURFACE, fg=ModernColors.TEXT_SECONDARY).pack(pady=(5, 0))
+
+        self.refresh_trend()
+
+    def refresh_trend(self, days=None):
+        """Redraw the dashboard sparkline from APPT_DAILY_ROLLUP only"""
+        if days:
+            self.trend_days = days
+        depid = self.trend_dept.get()
+        try:
+            series = AppointmentRollup.daily_series(csr, self.trend_days, depid=None if depid == "All" else depid)
+        except Exception as e:
+            messagebox.showerror("Database Error", f"Failed to load appointment trend: {str(e)}")
+            return
+        self.trend_label.configure(text=f"Last {self.trend_days} days: {sum(series)} appointments")
+        self.trend_sparkline.set_values(series)
+
     def show_patients(self):
         self.clear_main_frame()
         self.highlight_nav_button(0)
+        self.active_table = "PATIENT"
         
         # Patient management frame
         patient_frame = tk.Frame(self.main_frame, bg=ModernColors.BACKGROUND)
@@ -511,6 +4653,9 @@ class ModernHospitalManagement:
         # Create form fields
         self.create_patient_form(fields_frame)
         
+        self.patient_last_visit = tk.Label(form_frame, text="", font=self.body_font, bg=ModernColors.SURFACE, fg=ModernColors.TEXT_SECONDARY)
+        self.patient_last_visit.pack(pady=(5, 0))
+        
         # Buttons
         button_frame = tk.Frame(form_frame, bg=ModernColors.SURFACE)
         button_frame.pack(pady=10)
@@ -519,6 +4664,9 @@ class ModernHospitalManagement:
         ModernButton(button_frame, "Update Patient", self.update_patient, "secondary").pack(side="left", padx=5)
         ModernButton(button_frame, "Delete Patient", self.delete_patient, "danger").pack(side="left", padx=5)
         ModernButton(button_frame, "Clear Form", self.clear_patient_form, "warning").pack(side="left", padx=5)
+        ModernButton(button_frame, "Batch Entry", lambda: self.open_batch_entry("PATIENT"), "primary").pack(side="left", padx=5)
+        ModernButton(button_frame, "History", lambda: self.show_history("PATIENT"), "secondary").pack(side="left", padx=5)
+        ModernButton(button_frame, "Summary Report", self.open_patient_report, "secondary").pack(side="left", padx=5)
         
         # Search section
         search_frame = tk.Frame(patient_frame, bg=ModernColors.SURFACE, relief="solid", bd=1)
@@ -555,6 +4703,7 @@ class ModernHospitalManagement:
         
         ModernButton(search_controls, "Search", self.search_patient, "primary").pack(side="left", padx=5)
         ModernButton(search_controls, "View All", self.view_patients, "secondary").pack(side="left", padx=5)
+        self.add_local_filter(search_controls, "PATIENT")
         
         # Table section
         table_frame = tk.Frame(patient_frame, bg=ModernColors.SURFACE, relief="solid", bd=1)
@@ -570,7 +4719,7 @@ class ModernHospitalManagement:
     def create_patient_form(self, parent):
         # Create form fields with modern styling
         fields = [
-            ("Patient ID:", "entry_pid", lambda x: ValidationUtils.validate_id(x, "Patient ID")),
+            ("Patient ID (blank = new):", "entry_pid", lambda x: ValidationUtils.validate_id(x, "Patient ID")),
             ("First Name:", "entry_fname", ValidationUtils.validate_name),
             ("Last Name:", "entry_lname", ValidationUtils.validate_name),
             ("Date of Birth (YYYY-MM-DD):", "entry_dob", ValidationUtils.validate_date),
@@ -646,6 +4795,7 @@ class ModernHospitalManagement:
         for col, heading, width in headings:
             self.tree_patient.heading(col, text=heading)
             self.tree_patient.column(col, width=width, minwidth=80)
+        self.enable_local_sort("PATIENT", self.tree_patient)
         
         # Pack everything
         self.tree_patient.pack(side="left", fill="both", expand=True)
@@ -669,13 +4819,33 @@ class ModernHospitalManagement:
                 entry.delete(0, tk.END)
                 if i < len(values):
                     entry.insert(0, values[i])
+            self.show_last_visit(values[0])
     
-    def validate_patient_data(self):
-        """Validate all patient form data"""
+    def show_last_visit(self, pid):
+        """Summarize the selected patient's most recent visit under the form"""
+        if REPLICA_PATH:
+            # The summary table is only kept on the server
+            self.patient_last_visit.configure(text="")
+            return
+        try:
+            row = Statements.query(conn, "visit_summary", (pid,))
+        except Exception as e:
+            self.patient_last_visit.configure(text=f"Last visit unavailable: {str(e)}")
+            return
+        if not row:
+            self.patient_last_visit.configure(text="No visits recorded")
+            return
+        last_visit, count, preview, f_name, l_name = row[0]
+        doctor = f" by Dr. {f_name} {l_name}" if f_name else ""
+        visits = "1 visit" if count == 1 else f"{count} visits"
+        self.patient_last_visit.configure(text=f"Last seen {last_visit}{doctor} ({visits}): {preview or 'no diagnosis'}")
+
+    def validate_patient_data(self, require_id=True):
+        """Validate all patient form data; a new patient may leave the ID blank"""
         errors = []
         
         validators = [
-            (self.entry_pid.get_value(), lambda x: ValidationUtils.validate_id(x, "Patient ID")),
+            (self.entry_pid.get_value() or ("" if require_id else "1"), lambda x: ValidationUtils.validate_id(x, "Patient ID")),
             (self.entry_fname.get_value(), ValidationUtils.validate_name),
             (self.entry_lname.get_value(), ValidationUtils.validate_name),
             (self.entry_dob.get_value(), ValidationUtils.validate_date),
@@ -702,31 +4872,44 @@ class ModernHospitalManagement:
         return errors
     
     def add_patient(self):
-        errors = self.validate_patient_data()
+        errors = self.validate_patient_data(require_id=False)
         if errors:
             messagebox.showerror("Validation Errors", "\n".join(errors))
             return
         
         try:
-            # Check for duplicate Patient ID
-            csr.execute("SELECT COUNT(*) FROM PATIENT WHERE PID = %s", (self.entry_pid.get_value(),))
-            if csr.fetchone()[0] > 0:
+            # Only a typed ID needs the duplicate check; leased IDs cannot collide
+            typed_pid = self.entry_pid.get_value()
+            if typed_pid and Statements.query(conn, "exists", (typed_pid,), table="PATIENT")[0][0] > 0:
                 messagebox.showerror("Error", "Patient ID already exists!")
                 return
             
             # Clean phone number
             _, clean_phone = ValidationUtils.validate_phone(self.entry_ph.get_value())
             
-            csr.execute(
-                "INSERT INTO PATIENT (PID, F_NAME, L_NAME, DOB, PH, EMAIL) VALUES (%s, %s, %s, %s, %s, %s)",
-                (self.entry_pid.get_value(), self.entry_fname.get_value(), self.entry_lname.get_value(),
-                 self.entry_dob.get_value(), clean_phone, self.entry_email.get_value())
-            )
+            # Same person already registered under another ID?
+            new_patient = (typed_pid or 0, self.entry_fname.get_value(), self.entry_lname.get_value(),
+                           self.entry_dob.get_value(), clean_phone, self.entry_email.get_value())
+            matches = PatientMatcher.find_matches(csr, new_patient, use_name_block=not REPLICA_PATH)
+            if matches:
+                lines = [f"PID {row[0]}: {row[1]} {row[2]}, born {row[3]}, phone {row[4]} ({int(score * 100)}% - {reason})"
+                         for score, reason, row in matches[:5]]
+                if not messagebox.askyesno("Possible Duplicate", "This patient may already be registered:\n\n" + "\n".join(lines) + "\n\nAdd anyway?"):
+                    return
+            
+            values = (typed_pid or self.allocate_id("PATIENT"), self.entry_fname.get_value(), self.entry_lname.get_value(),
+                      self.entry_dob.get_value(), clean_phone, self.entry_email.get_value(), ValidationUtils.phone_key(clean_phone))
+            Statements.execute(conn, "patient_insert", values)
+            if typed_pid:
+                self.reserve_id("PATIENT", typed_pid)
             conn.commit()
-            messagebox.showinfo("Success", "Patient added successfully!")
+            self.audit("INSERT", "PATIENT", values[0], after=values)
+            self.search_cache.invalidate("PATIENT")
+            messagebox.showinfo("Success", f"Patient {values[0]} added successfully!")
             self.clear_patient_form()
             self.view_patients()
         except Exception as e:
+            conn.rollback()
             messagebox.showerror("Database Error", f"Error adding patient: {str(e)}")
     
     def update_patient(self):
@@ -741,21 +4924,28 @@ class ModernHospitalManagement:
         
         try:
             selected_item = self.tree_patient.selection()[0]
-            old_pid = self.tree_patient.item(selected_item, 'values')[0]
+            old_values = self.tree_patient.item(selected_item, 'values')
+            old_pid, version = old_values[0], old_values[-1]
             
             # Clean phone number
             _, clean_phone = ValidationUtils.validate_phone(self.entry_ph.get_value())
             
-            csr.execute("""
-            UPDATE PATIENT 
-            SET PID=%s, F_NAME=%s, L_NAME=%s, DOB=%s, PH=%s, EMAIL=%s 
-            WHERE PID=%s
-            """, (self.entry_pid.get_value(), self.entry_fname.get_value(), self.entry_lname.get_value(),
-                  self.entry_dob.get_value(), clean_phone, self.entry_email.get_value(), old_pid))
+            # Optimistic concurrency: only update the version this client loaded
+            values = (self.entry_pid.get_value(), self.entry_fname.get_value(), self.entry_lname.get_value(),
+                      self.entry_dob.get_value(), clean_phone, self.entry_email.get_value(), ValidationUtils.phone_key(clean_phone))
+            updated = Statements.execute(conn, "patient_update", values + (old_pid, version))
+            if updated == 0:
+                self.show_conflict("patient")
+                return
+            if str(old_pid) != self.entry_pid.get_value():
+                DeltaSync.record_delete(csr, "PATIENT", old_pid)
             conn.commit()
+            self.audit("UPDATE", "PATIENT", old_pid, before=old_values, after=values)
+            self.search_cache.invalidate("PATIENT")
             messagebox.showinfo("Success", "Patient updated successfully!")
             self.view_patients()
         except Exception as e:
+            conn.rollback()
             messagebox.showerror("Database Error", f"Error updating patient: {str(e)}")
     
     def delete_patient(self):
@@ -763,43 +4953,133 @@ class ModernHospitalManagement:
             messagebox.showerror("Error", "Please select a patient to delete")
             return
         
+        selected_item = self.tree_patient.selection()[0]
+        pid = self.tree_patient.item(selected_item, 'values')[0]
+        try:
+            counts = RecordRemover.dependent_counts(csr, "PATIENT", pid)
+        except Exception as e:
+            messagebox.showerror("Database Error", f"Error deleting patient: {str(e)}")
+            return
+        if any(counts.values()):
+            if REPLICA_PATH:
+                messagebox.showerror("Error", "Patients with appointments or medical records can only be removed while connected to the server")
+                return
+            choice = messagebox.askyesnocancel(
+                "Patient Has History",
+                f"This patient has {counts['APPOINTMENT']} appointment(s) and {counts['MED_RECORD']} medical record(s).\n\n"
+                "Yes: move the history to the archive and delete the patient\n"
+                "No: keep the history and anonymize the patient\n"
+                "Cancel: do nothing"
+            )
+            if choice is None:
+                return
+            self.run_removal("PATIENT", pid, "archive" if choice else "anonymize", self.clear_patient_form)
+            return
+
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this patient?"):
             try:
-                selected_item = self.tree_patient.selection()[0]
-                pid = self.tree_patient.item(selected_item, 'values')[0]
-                csr.execute("DELETE FROM PATIENT WHERE PID=%s", (pid,))
+                Statements.execute(conn, "delete", (pid,), table="PATIENT")
+                DeltaSync.record_delete(csr, "PATIENT", pid)
                 conn.commit()
-                self.tree_patient.delete(selected_item)
+                self.audit("DELETE", "PATIENT", pid, before=self.tree_patient.item(selected_item, 'values'))
+                self.search_cache.invalidate("PATIENT")
+                self.forget_rows("PATIENT", self.tree_patient, [selected_item])
                 messagebox.showinfo("Success", "Patient deleted successfully!")
                 self.clear_patient_form()
             except Exception as e:
+                conn.rollback()
                 messagebox.showerror("Database Error", f"Error deleting patient: {str(e)}")
     
+    def open_patient_report(self):
+        """Render the selected patient's summary and open it in the browser, where it can be printed or saved as PDF"""
+        if not self.tree_patient.selection():
+            messagebox.showerror("Error", "Please select a patient")
+            return
+        pid = self.tree_patient.item(self.tree_patient.selection()[0], 'values')[0]
+        try:
+            reports = PatientReports.fetch(conn, [int(pid)], include_archive=not REPLICA_PATH)
+            os.makedirs(PatientReports.DEFAULT_DIR, exist_ok=True)
+            PatientReports.write(PatientReports.DEFAULT_DIR, reports)
+        except Exception as e:
+            messagebox.showerror("Database Error", f"Error creating report: {str(e)}")
+            return
+        if not reports:
+            messagebox.showerror("Error", "Patient not found")
+            return
+        webbrowser.open("file://" + os.path.abspath(os.path.join(PatientReports.DEFAULT_DIR, PatientReports.file_name(int(pid)))))
+
+    def run_removal(self, table, key, mode, on_done, include_future=False):
+        """Drive RecordRemover one chunk per event-loop turn so the window stays responsive"""
+        steps = RecordRemover.steps(conn, table, key, mode, include_future=include_future)
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Removing Records")
+        dialog.configure(bg=ModernColors.BACKGROUND)
+        dialog.transient(self.root)
+        status = tk.Label(dialog, text=f"Removing {table.lower()} {key}...", font=self.body_font,
+                          bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY, width=50)
+        status.pack(padx=20, pady=15)
+        state = {"cancelled": False}
+
+        def cancel():
+            # Chunks already committed stay done; deleting again picks up the rest
+            state["cancelled"] = True
+            steps.close()
+            dialog.destroy()
+
+        ModernButton(dialog, "Stop", cancel, "secondary").pack(pady=(0, 15))
+        dialog.protocol("WM_DELETE_WINDOW", cancel)
+
+        def step():
+            if state["cancelled"]:
+                return
+            try:
+                message = next(steps)
+            except StopIteration:
+                dialog.destroy()
+                for dependent in RecordRemover.DEPENDENTS:
+                    self.search_cache.invalidate(dependent)
+                self.search_cache.invalidate(table)
+                tree = getattr(self, self.table_trees[table], None)
+                if mode == "anonymize":
+                    # The next poll would pick the row up too
+                    try:
+                        self.apply_remote_changes()
+                    except Exception:
+                        pass
+                elif tree is not None and tree.winfo_exists():
+                    self.forget_rows(table, tree, [key])
+                messagebox.showinfo("Success", f"{table.title()} {key} {'anonymized' if mode == 'anonymize' else 'removed'} successfully!")
+                on_done()
+                return
+            except Exception as e:
+                dialog.destroy()
+                messagebox.showerror("Database Error", f"Error removing {table.lower()}: {str(e)}")
+                return
+            status.configure(text=message)
+            self.root.after(50, step)
+
+        self.root.after(0, step)
+
     def clear_patient_form(self):
         """Clear all patient form fields"""
         entries = [self.entry_pid, self.entry_fname, self.entry_lname, 
                   self.entry_dob, self.entry_ph, self.entry_email]
         for entry in entries:
             entry.delete(0, tk.END)
+        self.patient_last_visit.configure(text="")
     
     def view_patients(self):
         """Load and display all patients"""
         try:
-            for row in self.tree_patient.get_children():
-                self.tree_patient.delete(row)
-            
-            csr.execute("SELECT * FROM PATIENT")
-            rows = csr.fetchall()
-            for row in rows:
-                self.tree_patient.insert("", tk.END, values=row)
+            self.load_table_rows("PATIENT", self.tree_patient)
         except Exception as e:
             messagebox.showerror("Database Error", f"Error loading patients: {str(e)}")
     
     def search_patient(self):
         """Search patients based on field and value"""
         try:
-            for row in self.tree_patient.get_children():
-                self.tree_patient.delete(row)
+            self.cancel_render("PATIENT")
+            self.tree_patient.delete(*self.tree_patient.get_children())
             
             search_field = self.search_field_patient.get()
             search_value = self.search_entry_patient.get_value()
@@ -808,20 +5088,77 @@ class ModernHospitalManagement:
                 messagebox.showerror("Error", "Please select search field and enter search value")
                 return
             
-            query = f"SELECT * FROM PATIENT WHERE {search_field} LIKE %s"
             # Use parameterized query to prevent SQL injection
-            csr.execute(query, (f"%{search_value}%",))
-            rows = csr.fetchall()
-            for row in rows:
-                self.tree_patient.insert("", tk.END, values=row)
+            statement, field, params = self.phone_aware_filter(search_field, search_value)
+            self.load_table_rows("PATIENT", self.tree_patient, statement, params, field=field, filtered=True,
+                                 cache_key=("PATIENT", search_field, search_value, False))
 
         except Exception as e:
             messagebox.showerror("Database Error", f"Error searching patients: {str(e)}")
 
+    def open_batch_entry(self, table):
+        """Open an editable grid that validates many rows at once and saves them in one transaction"""
+        id_validator = lambda label: (lambda x: ValidationUtils.validate_id(x, label))
+        not_empty = lambda label: (lambda x: ValidationUtils.validate_not_empty(x, label))
+        specs = {
+            "PATIENT": ("Batch Entry - Patients", [
+                ("PID", "Patient ID", id_validator("Patient ID"), True),
+                ("F_NAME", "First Name", ValidationUtils.validate_name, True),
+                ("L_NAME", "Last Name", ValidationUtils.validate_name, True),
+                ("DOB", "Date of Birth", ValidationUtils.validate_date, True),
+                ("PH", "Phone", ValidationUtils.validate_phone, True),
+                ("EMAIL", "Email", ValidationUtils.validate_email, False),
+            ], {}, None, self.view_patients),
+            "DOCTOR": ("Batch Entry - Doctors", [
+                ("DID", "Doctor ID", id_validator("Doctor ID"), True),
+                ("F_NAME", "First Name", ValidationUtils.validate_name, True),
+                ("L_NAME", "Last Name", ValidationUtils.validate_name, True),
+                ("SPEC", "Specialization", not_empty("Specialization"), True),
+                ("PH", "Phone", ValidationUtils.validate_phone, True),
+                ("EMAIL", "Email", ValidationUtils.validate_email, False),
+            ], {}, None, self.view_doctors),
+            "DEPT": ("Batch Entry - Departments", [
+                ("DepID", "Department ID", id_validator("Department ID"), True),
+                ("D_NAME", "Department Name", not_empty("Department Name"), True),
+                ("FLOOR", "Floor", id_validator("Floor"), True),
+                ("TELEPHONE", "Telephone", ValidationUtils.validate_phone, True),
+            ], {}, None, self.view_departments),
+            "APPOINTMENT": ("Batch Entry - Appointments", [
+                ("AID", "Appointment ID", id_validator("Appointment ID"), True),
+                ("PID", "Patient ID", id_validator("Patient ID"), True),
+                ("DID", "Doctor ID", id_validator("Doctor ID"), True),
+                ("A_DATE", "Date", ValidationUtils.validate_date, True),
+                ("A_TIME", "Time", ValidationUtils.validate_time, True),
+                ("DepID", "Department ID", id_validator("Department ID"), True),
+            ], {"PID": "PATIENT", "DID": "DOCTOR", "DepID": "DEPT"},
+                lambda cursor, rows: AppointmentRollup.apply_many(cursor, [(row[3], row[2], row[5]) for row in rows], 1),
+                self.view_appointments),
+            "MED_RECORD": ("Batch Entry - Medical Records", [
+                ("RID", "Record ID", id_validator("Record ID"), True),
+                ("PID", "Patient ID", id_validator("Patient ID"), True),
+                ("DID", "Doctor ID", id_validator("Doctor ID"), True),
+                ("LAST_VISIT", "Last Visit", ValidationUtils.validate_date, True),
+                ("DIAGNOSIS", "Diagnosis", not_empty("Diagnosis"), False),
+            ], {"PID": "PATIENT", "DID": "DOCTOR"},
+                lambda cursor, rows: self.refresh_visit_summary(*(row[1] for row in rows)),
+                self.view_medical_records),
+        }
+        title, columns, references, after_insert, reload = specs[table]
+        derived = [("PH_KEY", lambda row: ValidationUtils.phone_key(row[4]))] if table in PhoneKeys.TABLES else []
+
+        def on_saved():
+            self.search_cache.invalidate(table)
+            # The user may have switched tabs while the dialog was open
+            if self.active_table == table:
+                reload()
+
+        BatchEntryDialog(self.root, title, table, columns, references, after_insert, on_saved, derived)
+
     # ------------------ DOCTOR MANAGEMENT ------------------
     def show_doctors(self):
         self.clear_main_frame()
         self.highlight_nav_button(1)
+        self.active_table = "DOCTOR"
         
         doctor_frame = tk.Frame(self.main_frame, bg=ModernColors.BACKGROUND)
         doctor_frame.pack(fill="both", expand=True)
@@ -852,6 +5189,8 @@ class ModernHospitalManagement:
         ModernButton(button_frame, "Update Doctor", self.update_doctor, "secondary").pack(side="left", padx=5)
         ModernButton(button_frame, "Delete Doctor", self.delete_doctor, "danger").pack(side="left", padx=5)
         ModernButton(button_frame, "Clear Form", self.clear_doctor_form, "warning").pack(side="left", padx=5)
+        ModernButton(button_frame, "Batch Entry", lambda: self.open_batch_entry("DOCTOR"), "primary").pack(side="left", padx=5)
+        ModernButton(button_frame, "History", lambda: self.show_history("DOCTOR"), "secondary").pack(side="left", padx=5)
 
         # Search section
         search_frame = tk.Frame(doctor_frame, bg=ModernColors.SURFACE, relief="solid", bd=1)
@@ -872,6 +5211,7 @@ class ModernHospitalManagement:
         
         ModernButton(search_controls, "Search", self.search_doctor, "primary").pack(side="left", padx=5)
         ModernButton(search_controls, "View All", self.view_doctors, "secondary").pack(side="left", padx=5)
+        self.add_local_filter(search_controls, "DOCTOR")
         
         # Table section
         table_frame = tk.Frame(doctor_frame, bg=ModernColors.SURFACE, relief="solid", bd=1)
@@ -883,7 +5223,7 @@ class ModernHospitalManagement:
     
     def create_doctor_form(self, parent):
         fields = [
-            ("Doctor ID:", "entry_did", lambda x: ValidationUtils.validate_id(x, "Doctor ID")),
+            ("Doctor ID (blank = new):", "entry_did", lambda x: ValidationUtils.validate_id(x, "Doctor ID")),
             ("First Name:", "entry_dfname", ValidationUtils.validate_name),
             ("Last Name:", "entry_dlname", ValidationUtils.validate_name),
             ("Specialization:", "entry_spec", lambda x: ValidationUtils.validate_not_empty(x, "Specialization")),
@@ -912,6 +5252,7 @@ class ModernHospitalManagement:
         for col, heading, width in headings:
             self.tree_doctor.heading(col, text=heading)
             self.tree_doctor.column(col, width=width, minwidth=80)
+        self.enable_local_sort("DOCTOR", self.tree_doctor)
         self.tree_doctor.pack(side="left", fill="both", expand=True)
         v_scrollbar.pack(side="right", fill="y")
         h_scrollbar.pack(side="bottom", fill="x")
@@ -929,8 +5270,10 @@ class ModernHospitalManagement:
     
     def add_doctor(self):
         try:
-            is_valid_id, msg_id = ValidationUtils.validate_id(self.entry_did.get_value(), "Doctor ID")
-            if not is_valid_id: messagebox.showerror("Validation Error", msg_id); return
+            typed_did = self.entry_did.get_value()
+            if typed_did:
+                is_valid_id, msg_id = ValidationUtils.validate_id(typed_did, "Doctor ID")
+                if not is_valid_id: messagebox.showerror("Validation Error", msg_id); return
             is_valid_fname, msg_fname = ValidationUtils.validate_name(self.entry_dfname.get_value())
             if not is_valid_fname: messagebox.showerror("Validation Error", msg_fname); return
             is_valid_lname, msg_lname = ValidationUtils.validate_name(self.entry_dlname.get_value())
@@ -940,21 +5283,27 @@ class ModernHospitalManagement:
             is_valid_ph, clean_ph = ValidationUtils.validate_phone(self.entry_dph.get_value())
             if not is_valid_ph: messagebox.showerror("Validation Error", clean_ph); return
             
-            csr.execute("INSERT INTO DOCTOR (DID, F_NAME, L_NAME, SPEC, PH, EMAIL) VALUES (%s, %s, %s, %s, %s, %s)",
-                        (self.entry_did.get_value(), self.entry_dfname.get_value(), self.entry_dlname.get_value(),
-                         self.entry_spec.get_value(), clean_ph, self.entry_demail.get_value()))
+            values = (typed_did or self.allocate_id("DOCTOR"), self.entry_dfname.get_value(), self.entry_dlname.get_value(),
+                      self.entry_spec.get_value(), clean_ph, self.entry_demail.get_value(), ValidationUtils.phone_key(clean_ph))
+            Statements.execute(conn, "doctor_insert", values)
+            if typed_did:
+                self.reserve_id("DOCTOR", typed_did)
             conn.commit()
-            messagebox.showinfo("Success", "Doctor added successfully!")
+            self.audit("INSERT", "DOCTOR", values[0], after=values)
+            self.search_cache.invalidate("DOCTOR")
+            messagebox.showinfo("Success", f"Doctor {values[0]} added successfully!")
             self.clear_doctor_form()
             self.view_doctors()
         except Exception as e:
+            conn.rollback()
             messagebox.showerror("Database Error", f"Error adding doctor: {str(e)}")
 
     def update_doctor(self):
         if not self.tree_doctor.selection(): messagebox.showerror("Error", "Please select a doctor to update"); return
         try:
             selected_item = self.tree_doctor.selection()[0]
-            old_did = self.tree_doctor.item(selected_item, 'values')[0]
+            old_values = self.tree_doctor.item(selected_item, 'values')
+            old_did, version = old_values[0], old_values[-1]
             is_valid_id, msg_id = ValidationUtils.validate_id(self.entry_did.get_value(), "Doctor ID")
             if not is_valid_id: messagebox.showerror("Validation Error", msg_id); return
             is_valid_fname, msg_fname = ValidationUtils.validate_name(self.entry_dfname.get_value())
@@ -962,27 +5311,66 @@ class ModernHospitalManagement:
             is_valid_ph, clean_ph = ValidationUtils.validate_phone(self.entry_dph.get_value())
             if not is_valid_ph: messagebox.showerror("Validation Error", clean_ph); return
 
-            csr.execute("UPDATE DOCTOR SET DID=%s, F_NAME=%s, L_NAME=%s, SPEC=%s, PH=%s, EMAIL=%s WHERE DID=%s",
-                        (self.entry_did.get_value(), self.entry_dfname.get_value(), self.entry_dlname.get_value(),
-                         self.entry_spec.get_value(), clean_ph, self.entry_demail.get_value(), old_did))
+            values = (self.entry_did.get_value(), self.entry_dfname.get_value(), self.entry_dlname.get_value(),
+                      self.entry_spec.get_value(), clean_ph, self.entry_demail.get_value(), ValidationUtils.phone_key(clean_ph))
+            updated = Statements.execute(conn, "doctor_update", values + (old_did, version))
+            if updated == 0: self.show_conflict("doctor"); return
+            if str(old_did) != self.entry_did.get_value(): DeltaSync.record_delete(csr, "DOCTOR", old_did)
             conn.commit()
+            self.audit("UPDATE", "DOCTOR", old_did, before=old_values, after=values)
+            self.search_cache.invalidate("DOCTOR")
             messagebox.showinfo("Success", "Doctor updated successfully!")
             self.view_doctors()
         except Exception as e:
+            conn.rollback()
             messagebox.showerror("Database Error", f"Error updating doctor: {str(e)}")
     
     def delete_doctor(self):
         if not self.tree_doctor.selection(): messagebox.showerror("Error", "Please select a doctor to delete"); return
+        selected_item = self.tree_doctor.selection()[0]
+        did = self.tree_doctor.item(selected_item, 'values')[0]
+        try:
+            counts = RecordRemover.dependent_counts(csr, "DOCTOR", did)
+            upcoming = RecordRemover.future_appointments(csr, "DOCTOR", did) if counts["APPOINTMENT"] else []
+        except Exception as e:
+            messagebox.showerror("Database Error", f"Error deleting doctor: {str(e)}")
+            return
+        if any(counts.values()):
+            if REPLICA_PATH:
+                messagebox.showerror("Error", "Doctors with appointments or medical records can only be removed while connected to the server")
+                return
+            if not messagebox.askyesno(
+                "Doctor Has History",
+                f"This doctor has {counts['APPOINTMENT']} appointment(s) and {counts['MED_RECORD']} medical record(s).\n\n"
+                "Move them to the archive and delete the doctor?"
+            ):
+                return
+            if upcoming:
+                lines = [f"{a_date} {a_time}: appointment {aid}, patient {pid}" for aid, a_date, a_time, pid in upcoming[:10]]
+                if len(upcoming) > 10:
+                    lines.append(f"... and {len(upcoming) - 10} more")
+                if not messagebox.askyesno(
+                    "Upcoming Appointments",
+                    f"{len(upcoming)} of these appointments have not happened yet and will be taken off the schedule:\n\n"
+                    + "\n".join(lines) + "\n\nArchive them anyway? Choose No to reassign or cancel them first.",
+                    icon="warning", default="no"
+                ):
+                    return
+            self.run_removal("DOCTOR", did, "archive", self.clear_doctor_form, include_future=bool(upcoming))
+            return
+
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this doctor?"):
             try:
-                selected_item = self.tree_doctor.selection()[0]
-                did = self.tree_doctor.item(selected_item, 'values')[0]
-                csr.execute("DELETE FROM DOCTOR WHERE DID=%s", (did,))
+                Statements.execute(conn, "delete", (did,), table="DOCTOR")
+                DeltaSync.record_delete(csr, "DOCTOR", did)
                 conn.commit()
-                self.tree_doctor.delete(selected_item)
+                self.audit("DELETE", "DOCTOR", did, before=self.tree_doctor.item(selected_item, 'values'))
+                self.search_cache.invalidate("DOCTOR")
+                self.forget_rows("DOCTOR", self.tree_doctor, [selected_item])
                 messagebox.showinfo("Success", "Doctor deleted successfully!")
                 self.clear_doctor_form()
             except Exception as e:
+                conn.rollback()
                 messagebox.showerror("Database Error", f"Error deleting doctor: {str(e)}")
 
     def clear_doctor_form(self):
@@ -992,24 +5380,20 @@ class ModernHospitalManagement:
 
     def view_doctors(self):
         try:
-            for row in self.tree_doctor.get_children(): self.tree_doctor.delete(row)
-            csr.execute("SELECT * FROM DOCTOR")
-            rows = csr.fetchall()
-            for row in rows: self.tree_doctor.insert("", tk.END, values=row)
+            self.load_table_rows("DOCTOR", self.tree_doctor)
         except Exception as e:
             messagebox.showerror("Database Error", f"Error loading doctors: {str(e)}")
     
     def search_doctor(self):
         try:
-            for row in self.tree_doctor.get_children(): self.tree_doctor.delete(row)
+            self.cancel_render("DOCTOR"); self.tree_doctor.delete(*self.tree_doctor.get_children())
             search_field = self.search_field_doctor.get()
             search_value = self.search_entry_doctor.get_value()
             if not search_field or not search_value: messagebox.showerror("Error", "Please select search field and enter search value"); return
             # Correctly use parameterized query
-            query = f"SELECT * FROM DOCTOR WHERE {search_field} LIKE %s"
-            csr.execute(query, (f"%{search_value}%",))
-            rows = csr.fetchall()
-            for row in rows: self.tree_doctor.insert("", tk.END, values=row)
+            statement, field, params = self.phone_aware_filter(search_field, search_value)
+            self.load_table_rows("DOCTOR", self.tree_doctor, statement, params, field=field, filtered=True,
+                                 cache_key=("DOCTOR", search_field, search_value, False))
         except Exception as e:
             messagebox.showerror("Database Error", f"Error searching doctors: {str(e)}")
 
@@ -1017,6 +5401,7 @@ class ModernHospitalManagement:
     def show_departments(self):
         self.clear_main_frame()
         self.highlight_nav_button(2)
+        self.active_table = "DEPT"
         
         department_frame = tk.Frame(self.main_frame, bg=ModernColors.BACKGROUND)
         department_frame.pack(fill="both", expand=True)
@@ -1040,6 +5425,8 @@ class ModernHospitalManagement:
         ModernButton(button_frame, "Update Department", self.update_department, "secondary").pack(side="left", padx=5)
         ModernButton(button_frame, "Delete Department", self.delete_department, "danger").pack(side="left", padx=5)
         ModernButton(button_frame, "Clear Form", self.clear_department_form, "warning").pack(side="left", padx=5)
+        ModernButton(button_frame, "Batch Entry", lambda: self.open_batch_entry("DEPT"), "primary").pack(side="left", padx=5)
+        ModernButton(button_frame, "History", lambda: self.show_history("DEPT"), "secondary").pack(side="left", padx=5)
 
         search_frame = tk.Frame(department_frame, bg=ModernColors.SURFACE, relief="solid", bd=1)
         # MODIFIED: Reduced ipady and pady to make search section smaller.
@@ -1054,6 +5441,7 @@ class ModernHospitalManagement:
         self.search_entry_department.pack(side="left", padx=5)
         ModernButton(search_controls, "Search", self.search_department, "primary").pack(side="left", padx=5)
         ModernButton(search_controls, "View All", self.view_departments, "secondary").pack(side="left", padx=5)
+        self.add_local_filter(search_controls, "DEPT")
 
         table_frame = tk.Frame(department_frame, bg=ModernColors.SURFACE, relief="solid", bd=1)
         # The table now has more vertical space to expand into.
@@ -1063,7 +5451,7 @@ class ModernHospitalManagement:
 
     def create_department_form(self, parent):
         fields = [
-            ("Department ID:", "entry_depid", lambda x: ValidationUtils.validate_id(x, "Department ID")),
+            ("Department ID (blank = new):", "entry_depid", lambda x: ValidationUtils.validate_id(x, "Department ID")),
             ("Department Name:", "entry_dname", lambda x: ValidationUtils.validate_not_empty(x, "Department Name")),
             ("Floor:", "entry_floor", lambda x: ValidationUtils.validate_id(x, "Floor")),
             ("Telephone:", "entry_dtelephone", ValidationUtils.validate_phone)
@@ -1090,6 +5478,7 @@ class ModernHospitalManagement:
         for col, heading, width in headings:
             self.tree_department.heading(col, text=heading)
             self.tree_department.column(col, width=width, minwidth=80)
+        self.enable_local_sort("DEPT", self.tree_department)
         self.tree_department.pack(side="left", fill="both", expand=True)
         v_scrollbar.pack(side="right", fill="y")
         h_scrollbar.pack(side="bottom", fill="x")
@@ -1107,8 +5496,10 @@ class ModernHospitalManagement:
 
     def add_department(self):
         try:
-            is_valid_id, msg_id = ValidationUtils.validate_id(self.entry_depid.get_value(), "Department ID")
-            if not is_valid_id: messagebox.showerror("Validation Error", msg_id); return
+            typed_depid = self.entry_depid.get_value()
+            if typed_depid:
+                is_valid_id, msg_id = ValidationUtils.validate_id(typed_depid, "Department ID")
+                if not is_valid_id: messagebox.showerror("Validation Error", msg_id); return
             is_valid_name, msg_name = ValidationUtils.validate_not_empty(self.entry_dname.get_value(), "Department Name")
             if not is_valid_name: messagebox.showerror("Validation Error", msg_name); return
             is_valid_floor, msg_floor = ValidationUtils.validate_id(self.entry_floor.get_value(), "Floor")
@@ -1116,19 +5507,26 @@ class ModernHospitalManagement:
             is_valid_phone, clean_phone = ValidationUtils.validate_phone(self.entry_dtelephone.get_value())
             if not is_valid_phone: messagebox.showerror("Validation Error", clean_phone); return
             
-            csr.execute("INSERT INTO DEPT (DepID, D_NAME, FLOOR, TELEPHONE) VALUES (%s, %s, %s, %s)",
-                        (self.entry_depid.get_value(), self.entry_dname.get_value(), self.entry_floor.get_value(), clean_phone))
+            values = (typed_depid or self.allocate_id("DEPT"), self.entry_dname.get_value(), self.entry_floor.get_value(), clean_phone)
+            Statements.execute(conn, "dept_insert", values)
+            if typed_depid:
+                self.reserve_id("DEPT", typed_depid)
             conn.commit()
-            messagebox.showinfo("Success", "Department added successfully!")
+            self.audit("INSERT", "DEPT", values[0], after=values)
+            self.search_cache.invalidate("DEPT")
+            messagebox.showinfo("Success", f"Department {values[0]} added successfully!")
             self.clear_department_form()
             self.view_departments()
-        except Exception as e: messagebox.showerror("Database Error", f"Error adding department: {str(e)}")
+        except Exception as e:
+            conn.rollback()
+            messagebox.showerror("Database Error", f"Error adding department: {str(e)}")
 
     def update_department(self):
         if not self.tree_department.selection(): messagebox.showerror("Error", "Please select a department to update"); return
         try:
             selected_item = self.tree_department.selection()[0]
-            old_depid = self.tree_department.item(selected_item, 'values')[0]
+            old_values = self.tree_department.item(selected_item, 'values')
+            old_depid, version = old_values[0], old_values[-1]
             is_valid_id, msg_id = ValidationUtils.validate_id(self.entry_depid.get_value(), "Department ID")
             if not is_valid_id: messagebox.showerror("Validation Error", msg_id); return
             is_valid_name, msg_name = ValidationUtils.validate_not_empty(self.entry_dname.get_value(), "Department Name")
@@ -1138,12 +5536,18 @@ class ModernHospitalManagement:
             is_valid_phone, clean_phone = ValidationUtils.validate_phone(self.entry_dtelephone.get_value())
             if not is_valid_phone: messagebox.showerror("Validation Error", clean_phone); return
 
-            csr.execute("UPDATE DEPT SET DepID=%s, D_NAME=%s, FLOOR=%s, TELEPHONE=%s WHERE DepID=%s",
-                        (self.entry_depid.get_value(), self.entry_dname.get_value(), self.entry_floor.get_value(), clean_phone, old_depid))
+            values = (self.entry_depid.get_value(), self.entry_dname.get_value(), self.entry_floor.get_value(), clean_phone)
+            updated = Statements.execute(conn, "dept_update", values + (old_depid, version))
+            if updated == 0: self.show_conflict("department"); return
+            if str(old_depid) != self.entry_depid.get_value(): DeltaSync.record_delete(csr, "DEPT", old_depid)
             conn.commit()
+            self.audit("UPDATE", "DEPT", old_depid, before=old_values, after=values)
+            self.search_cache.invalidate("DEPT")
             messagebox.showinfo("Success", "Department updated successfully!")
             self.view_departments()
-        except Exception as e: messagebox.showerror("Database Error", f"Error updating department: {str(e)}")
+        except Exception as e:
+            conn.rollback()
+            messagebox.showerror("Database Error", f"Error updating department: {str(e)}")
     
     def delete_department(self):
         if not self.tree_department.selection(): messagebox.showerror("Error", "Please select a department to delete"); return
@@ -1151,12 +5555,17 @@ class ModernHospitalManagement:
             try:
                 selected_item = self.tree_department.selection()[0]
                 depid = self.tree_department.item(selected_item, 'values')[0]
-                csr.execute("DELETE FROM DEPT WHERE DepID=%s", (depid,))
+                Statements.execute(conn, "delete", (depid,), table="DEPT")
+                DeltaSync.record_delete(csr, "DEPT", depid)
                 conn.commit()
-                self.tree_department.delete(selected_item)
+                self.audit("DELETE", "DEPT", depid, before=self.tree_department.item(selected_item, 'values'))
+                self.search_cache.invalidate("DEPT")
+                self.forget_rows("DEPT", self.tree_department, [selected_item])
                 messagebox.showinfo("Success", "Department deleted successfully!")
                 self.clear_department_form()
-            except Exception as e: messagebox.showerror("Database Error", f"Error deleting department: {str(e)}")
+            except Exception as e:
+                conn.rollback()
+                messagebox.showerror("Database Error", f"Error deleting department: {str(e)}")
 
     def clear_department_form(self):
         entries = [self.entry_depid, self.entry_dname, self.entry_floor, self.entry_dtelephone]
@@ -1164,29 +5573,26 @@ class ModernHospitalManagement:
 
     def view_departments(self):
         try:
-            for row in self.tree_department.get_children(): self.tree_department.delete(row)
-            csr.execute("SELECT * FROM DEPT")
-            rows = csr.fetchall()
-            for row in rows: self.tree_department.insert("", tk.END, values=row)
+            self.load_table_rows("DEPT", self.tree_department)
         except Exception as e: messagebox.showerror("Database Error", f"Error loading departments: {str(e)}")
 
     def search_department(self):
         try:
-            for row in self.tree_department.get_children(): self.tree_department.delete(row)
+            self.cancel_render("DEPT"); self.tree_department.delete(*self.tree_department.get_children())
             search_field = self.search_field_department.get()
             search_value = self.search_entry_department.get_value()
             if not search_field or not search_value: messagebox.showerror("Error", "Please select search field and enter search value"); return
             # Correctly use parameterized query
-            query = f"SELECT * FROM DEPT WHERE {search_field} LIKE %s"
-            csr.execute(query, (f"%{search_value}%",))
-            rows = csr.fetchall()
-            for row in rows: self.tree_department.insert("", tk.END, values=row)
+            self.load_table_rows("DEPT", self.tree_department, "search_like",
+                                 (f"%{search_value}%",), field=search_field, filtered=True,
+                                 cache_key=("DEPT", search_field, search_value, False))
         except Exception as e: messagebox.showerror("Database Error", f"Error searching departments: {str(e)}")
 
     # ------------------ APPOINTMENT MANAGEMENT ------------------
     def show_appointments(self):
         self.clear_main_frame()
         self.highlight_nav_button(3)
+        self.active_table = "APPOINTMENT"
         
         appointment_frame = tk.Frame(self.main_frame, bg=ModernColors.BACKGROUND)
         appointment_frame.pack(fill="both", expand=True)
@@ -1207,6 +5613,19 @@ class ModernHospitalManagement:
         ModernButton(button_frame, "Update Appointment", self.update_appointment, "secondary").pack(side="left", padx=5)
         ModernButton(button_frame, "Delete Appointment", self.delete_appointment, "danger").pack(side="left", padx=5)
         ModernButton(button_frame, "Clear Form", self.clear_appointment_form, "warning").pack(side="left", padx=5)
+        ModernButton(button_frame, "Batch Entry", lambda: self.open_batch_entry("APPOINTMENT"), "primary").pack(side="left", padx=5)
+        ModernButton(button_frame, "History", lambda: self.show_history("APPOINTMENT"), "secondary").pack(side="left", padx=5)
+        ModernButton(button_frame, "Calendar", self.open_calendar, "primary").pack(side="left", padx=5)
+        queue_button = ModernButton(button_frame, "Today's Queue", self.open_queue, "primary")
+        queue_button.pack(side="left", padx=5)
+        # Series are written straight to the server in one locked transaction
+        repeat_button = ModernButton(button_frame, "Repeat", self.open_repeat, "primary")
+        repeat_button.pack(side="left", padx=5)
+        series_button = ModernButton(button_frame, "Series", self.open_series, "secondary")
+        series_button.pack(side="left", padx=5)
+        if REPLICA_PATH:
+            for button in (queue_button, repeat_button, series_button):
+                button.configure(state="disabled")
 
         search_frame = tk.Frame(appointment_frame, bg=ModernColors.SURFACE, relief="solid", bd=1)
         # MODIFIED: Reduced ipady and pady to make search section smaller.
@@ -1221,6 +5640,11 @@ class ModernHospitalManagement:
         self.search_entry_appointment.pack(side="left", padx=5)
         ModernButton(search_controls, "Search", self.search_appointment, "primary").pack(side="left", padx=5)
         ModernButton(search_controls, "View All", self.view_appointments, "secondary").pack(side="left", padx=5)
+        self.add_local_filter(search_controls, "APPOINTMENT")
+        self.include_archive_appointment = tk.BooleanVar(value=False)
+        tk.Checkbutton(search_controls, text="Include archive", variable=self.include_archive_appointment, command=self.view_appointments, font=self.body_font,
+                       bg=ModernColors.SURFACE, activebackground=ModernColors.SURFACE,
+                       state="disabled" if REPLICA_PATH else "normal").pack(side="left", padx=5)
 
         table_frame = tk.Frame(appointment_frame, bg=ModernColors.SURFACE, relief="solid", bd=1)
         # The table now has more vertical space to expand into.
@@ -1228,9 +5652,186 @@ class ModernHospitalManagement:
         self.create_appointment_table(table_frame)
         self.view_appointments()
     
+    def open_calendar(self):
+        if self.calendar is not None and self.calendar.winfo_exists():
+            self.calendar.winfo_toplevel().lift()
+            return
+        window = tk.Toplevel(self.root)
+        window.title("Appointment Calendar")
+        window.configure(bg=ModernColors.BACKGROUND)
+        window.geometry("1000x640")
+
+        controls = tk.Frame(window, bg=ModernColors.BACKGROUND)
+        controls.pack(fill="x", padx=15, pady=10)
+        mode = tk.StringVar(value="week")
+        scope = tk.StringVar(value="All")
+        scope_id = ModernEntry(controls, placeholder="ID", width=8)
+        # Scope the calendar was last loaded with; the controls only take effect on Apply
+        applied = {"scope": "All", "key": None}
+
+        def load_range(first_day, last_day):
+            if applied["scope"] == "Doctor":
+                return Statements.query(conn, "calendar_range_doctor", (applied["key"], first_day, last_day), table="APPOINTMENT")
+            if applied["scope"] == "Department":
+                return Statements.query(conn, "calendar_range_dept", (applied["key"], first_day, last_day), table="APPOINTMENT")
+            return Statements.query(conn, "calendar_range", (first_day, last_day), table="APPOINTMENT")
+
+        def accepts(row):
+            if applied["scope"] == "Doctor":
+                return row[2] is not None and str(row[2]) == str(applied["key"])
+            if applied["scope"] == "Department":
+                return row[5] is not None and str(row[5]) == str(applied["key"])
+            return True
+
+        def apply_scope():
+            key = scope_id.get_value()
+            if scope.get() != "All" and not key.isdigit():
+                messagebox.showerror("Error", f"Enter a {scope.get().lower()} ID", parent=window)
+                return
+            applied.update(scope=scope.get(), key=int(key) if scope.get() != "All" else None)
+            calendar.reset()
+
+        def selected(row):
+            status.configure(text=f"Appointment {row[0]}: patient {row[1]} with doctor {row[2]}, "
+                                  f"{row[3]} {row[4]}, department {row[5]}")
+
+        def safely(action):
+            try:
+                action()
+            except Exception as e:
+                messagebox.showerror("Database Error", f"Error loading calendar: {str(e)}", parent=window)
+
+        ModernButton(controls, "◀", lambda: safely(lambda: calendar.shift(-1)), "secondary").pack(side="left", padx=2)
+        ModernButton(controls, "Today", lambda: safely(lambda: calendar.go_to(date.today())), "secondary").pack(side="left", padx=2)
+        ModernButton(controls, "▶", lambda: safely(lambda: calendar.shift(1)), "secondary").pack(side="left", padx=2)
+        for value in ("day", "week"):
+            tk.Radiobutton(controls, text=value.title(), value=value, variable=mode, command=lambda: safely(lambda: calendar.set_mode(mode.get())),
+                           font=self.body_font, bg=ModernColors.BACKGROUND, activebackground=ModernColors.BACKGROUND).pack(side="left", padx=5)
+        scope_box = ttk.Combobox(controls, values=["All", "Doctor", "Department"], textvariable=scope, state="readonly", width=12, font=self.body_font)
+        scope_box.pack(side="left", padx=(20, 5))
+        scope_id.pack(side="left", padx=5)
+        ModernButton(controls, "Apply", lambda: safely(apply_scope), "primary").pack(side="left", padx=5)
+
+        body = tk.Frame(window, bg=ModernColors.SURFACE, relief="solid", bd=1)
+        body.pack(fill="both", expand=True, padx=15)
+        v_scrollbar = ttk.Scrollbar(body, orient="vertical")
+        calendar = AppointmentCalendar(body, load_range, accepts, on_select=selected, width=940, height=480, yscrollcommand=v_scrollbar.set)
+        v_scrollbar.configure(command=calendar.yview)
+        v_scrollbar.pack(side="right", fill="y")
+        calendar.pack(side="left", fill="both", expand=True)
+        calendar.bind("<MouseWheel>", lambda e: calendar.yview_scroll(-1 if e.delta > 0 else 1, "units"))
+
+        status = tk.Label(window, text="Click an appointment for details.", font=self.body_font, bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_SECONDARY)
+        status.pack(fill="x", padx=15, pady=8)
+
+        self.calendar = calendar
+        safely(calendar.refresh)
+        # Start the working day in view
+        calendar.yview_moveto((AppointmentCalendar.HEADER_HEIGHT + 7 * AppointmentCalendar.HOUR_HEIGHT) / (AppointmentCalendar.HEADER_HEIGHT + 24 * AppointmentCalendar.HOUR_HEIGHT))
+
+    def open_queue(self):
+        window = tk.Toplevel(self.root)
+        window.title("Today's Queue")
+        window.configure(bg=ModernColors.BACKGROUND)
+        window.geometry("820x600")
+
+        controls = tk.Frame(window, bg=ModernColors.BACKGROUND)
+        controls.pack(fill="x", padx=15, pady=10)
+        tk.Label(controls, text="Doctor ID:", font=self.body_font, bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY).pack(side="left", padx=5)
+        doctor_entry = ModernEntry(controls, placeholder="All doctors", width=10)
+        doctor_entry.pack(side="left", padx=5)
+
+        body = tk.Frame(window, bg=ModernColors.SURFACE, relief="solid", bd=1)
+        body.pack(fill="both", expand=True, padx=15)
+        v_scrollbar = ttk.Scrollbar(body, orient="vertical")
+        tree = ttk.Treeview(body, columns=("TIME", "PATIENT", "STATUS", "PRIORITY"), show="tree headings", yscrollcommand=v_scrollbar.set)
+        v_scrollbar.configure(command=tree.yview)
+        tree.heading("#0", text="Doctor / Appointment")
+        tree.column("#0", width=220)
+        for col, heading, width in [("TIME", "Slot", 80), ("PATIENT", "Patient", 260), ("STATUS", "Status", 100), ("PRIORITY", "Priority", 70)]:
+            tree.heading(col, text=heading)
+            tree.column(col, width=width, minwidth=60)
+        tree.tag_configure("IN_ROOM", foreground=ModernColors.PRIMARY)
+        tree.tag_configure("ARRIVED", foreground=ModernColors.SUCCESS)
+        tree.tag_configure("DONE", foreground=ModernColors.TEXT_SECONDARY)
+        tree.tag_configure("NO_SHOW", foreground=ModernColors.ERROR)
+        v_scrollbar.pack(side="right", fill="y")
+        tree.pack(side="left", fill="both", expand=True)
+
+        state = {"queues": None}
+
+        def render(dids):
+            # Only queues touched since the last render are rebuilt
+            queues = state["queues"]
+            for did in sorted(dids, key=lambda value: (value is None, value or 0)):
+                node = f"doctor:{did}"
+                entries = queues.entries(did)
+                waiting = sum(1 for entry in entries if entry[4] in ("ARRIVED", "IN_ROOM"))
+                label = f"Dr. {did}  ({waiting} waiting, {len(entries)} today)"
+                if not tree.exists(node):
+                    tree.insert("", tk.END, iid=node, text=label, open=True)
+                else:
+                    tree.item(node, text=label)
+                    tree.delete(*tree.get_children(node))
+                for aid, pid, name, minutes, status, priority in entries:
+                    tree.insert(node, tk.END, iid=str(aid), text=f"Appointment {aid}",
+                                values=(f"{minutes // 60:02d}:{minutes % 60:02d}", f"{name} ({pid})", status, priority), tags=(status,))
+
+        def load():
+            try:
+                key = doctor_entry.get_value()
+                queues = PatientQueues(doctor=int(key) if key.isdigit() else None)
+                queues.load(conn, csr)
+            except Exception as e:
+                messagebox.showerror("Database Error", f"Error loading queue: {str(e)}", parent=window)
+                return
+            state["queues"] = queues
+            tree.delete(*tree.get_children())
+            render(queues.take_dirty())
+
+        def poll():
+            if not window.winfo_exists():
+                return
+            if state["queues"] is not None:
+                try:
+                    state["queues"].poll(conn, csr)
+                    render(state["queues"].take_dirty())
+                except Exception:
+                    # A missed poll is picked up by the next one
+                    pass
+            window.after(DeltaSync.POLL_INTERVAL_MS, poll)
+
+        def change(status=None, step=0):
+            selection = [iid for iid in tree.selection() if iid.isdigit()]
+            if not selection:
+                messagebox.showerror("Error", "Please select an appointment", parent=window)
+                return
+            queues = state["queues"]
+            try:
+                for iid in selection:
+                    current = queues.states.get(int(iid), ("BOOKED", 0, None))
+                    PatientQueues.set_status(conn, int(iid), status, max(0, min(9, current[1] + step)) if step else None, current)
+                queues.poll(conn, csr)
+                render(queues.take_dirty())
+            except Exception as e:
+                messagebox.showerror("Database Error", f"Error updating check-in: {str(e)}", parent=window)
+
+        ModernButton(controls, "Load", load, "primary").pack(side="left", padx=5)
+        actions = tk.Frame(window, bg=ModernColors.BACKGROUND)
+        actions.pack(fill="x", padx=15, pady=10)
+        ModernButton(actions, "Check In", lambda: change("ARRIVED"), "secondary").pack(side="left", padx=5)
+        ModernButton(actions, "Call In", lambda: change("IN_ROOM"), "primary").pack(side="left", padx=5)
+        ModernButton(actions, "Done", lambda: change("DONE"), "primary").pack(side="left", padx=5)
+        ModernButton(actions, "No Show", lambda: change("NO_SHOW"), "danger").pack(side="left", padx=5)
+        ModernButton(actions, "Priority +", lambda: change(step=1), "warning").pack(side="left", padx=5)
+        ModernButton(actions, "Priority -", lambda: change(step=-1), "warning").pack(side="left", padx=5)
+
+        load()
+        window.after(DeltaSync.POLL_INTERVAL_MS, poll)
+
     def create_appointment_form(self, parent):
         fields = [
-            ("Appointment ID:", "entry_aid", lambda x: ValidationUtils.validate_id(x, "Appointment ID")),
+            ("Appointment ID (blank = new):", "entry_aid", lambda x: ValidationUtils.validate_id(x, "Appointment ID")),
             ("Patient ID:", "entry_apid", lambda x: ValidationUtils.validate_id(x, "Patient ID")),
             ("Doctor ID:", "entry_adid", lambda x: ValidationUtils.validate_id(x, "Doctor ID")),
             ("Date (YYYY-MM-DD):", "entry_adate", ValidationUtils.validate_date),
@@ -1259,6 +5860,7 @@ class ModernHospitalManagement:
         for col, heading, width in headings:
             self.tree_appointment.heading(col, text=heading)
             self.tree_appointment.column(col, width=width, minwidth=80)
+        self.enable_local_sort("APPOINTMENT", self.tree_appointment)
         self.tree_appointment.pack(side="left", fill="both", expand=True)
         v_scrollbar.pack(side="right", fill="y")
         h_scrollbar.pack(side="bottom", fill="x")
@@ -1277,47 +5879,318 @@ class ModernHospitalManagement:
     def add_appointment(self):
         try:
             # Check if PID, DID, and DepID exist
-            csr.execute("SELECT COUNT(*) FROM PATIENT WHERE PID = %s", (self.entry_apid.get_value(),))
-            if csr.fetchone()[0] == 0: messagebox.showerror("Error", "Patient ID not found."); return
-            csr.execute("SELECT COUNT(*) FROM DOCTOR WHERE DID = %s", (self.entry_adid.get_value(),))
-            if csr.fetchone()[0] == 0: messagebox.showerror("Error", "Doctor ID not found."); return
-            csr.execute("SELECT COUNT(*) FROM DEPT WHERE DepID = %s", (self.entry_adepid.get_value(),))
-            if csr.fetchone()[0] == 0: messagebox.showerror("Error", "Department ID not found."); return
+            if Statements.query(conn, "exists", (self.entry_apid.get_value(),), table="PATIENT")[0][0] == 0: messagebox.showerror("Error", "Patient ID not found."); return
+            if Statements.query(conn, "exists", (self.entry_adid.get_value(),), table="DOCTOR")[0][0] == 0: messagebox.showerror("Error", "Doctor ID not found."); return
+            if Statements.query(conn, "exists", (self.entry_adepid.get_value(),), table="DEPT")[0][0] == 0: messagebox.showerror("Error", "Department ID not found."); return
             
-            csr.execute("INSERT INTO APPOINTMENT (AID, PID, DID, A_DATE, A_TIME, DepID) VALUES (%s, %s, %s, %s, %s, %s)",
-                        (self.entry_aid.get_value(), self.entry_apid.get_value(), self.entry_adid.get_value(),
-                         self.entry_adate.get_value(), self.entry_atime.get_value(), self.entry_adepid.get_value()))
+            typed_aid = self.entry_aid.get_value()
+            values = (typed_aid or self.allocate_id("APPOINTMENT"), self.entry_apid.get_value(), self.entry_adid.get_value(),
+                      self.entry_adate.get_value(), self.entry_atime.get_value(), self.entry_adepid.get_value())
+            Statements.execute(conn, "appointment_insert", values)
+            AppointmentRollup.apply(csr, self.entry_adate.get_value(), self.entry_adid.get_value(), self.entry_adepid.get_value(), 1)
+            if typed_aid:
+                self.reserve_id("APPOINTMENT", typed_aid)
             conn.commit()
-            messagebox.showinfo("Success", "Appointment added successfully!")
+            self.audit("INSERT", "APPOINTMENT", values[0], after=values)
+            self.search_cache.invalidate("APPOINTMENT")
+            messagebox.showinfo("Success", f"Appointment {values[0]} added successfully!")
             self.clear_appointment_form()
             self.view_appointments()
-        except Exception as e: messagebox.showerror("Database Error", f"Error adding appointment: {str(e)}")
+        except Exception as e:
+            conn.rollback()
+            messagebox.showerror("Database Error", f"Error adding appointment: {str(e)}")
     
     def update_appointment(self):
         if not self.tree_appointment.selection(): messagebox.showerror("Error", "Please select an appointment to update"); return
+        if self.is_archived_selection(self.tree_appointment): messagebox.showerror("Error", "Archived appointments are read-only"); return
         try:
             selected_item = self.tree_appointment.selection()[0]
-            old_aid = self.tree_appointment.item(selected_item, 'values')[0]
-            csr.execute("UPDATE APPOINTMENT SET AID=%s, PID=%s, DID=%s, A_DATE=%s, A_TIME=%s, DepID=%s WHERE AID=%s",
-                        (self.entry_aid.get_value(), self.entry_apid.get_value(), self.entry_adid.get_value(),
-                         self.entry_adate.get_value(), self.entry_atime.get_value(), self.entry_adepid.get_value(), old_aid))
+            old_values = self.tree_appointment.item(selected_item, 'values')
+            old_aid, version = old_values[0], old_values[-1]
+            old_key = AppointmentRollup.fetch_appointment_key(csr, old_aid)
+            values = (self.entry_aid.get_value(), self.entry_apid.get_value(), self.entry_adid.get_value(),
+                      self.entry_adate.get_value(), self.entry_atime.get_value(), self.entry_adepid.get_value())
+            updated = Statements.execute(conn, "appointment_update", values + (old_aid, version))
+            if updated == 0: self.show_conflict("appointment"); return
+            if str(old_aid) != self.entry_aid.get_value(): DeltaSync.record_delete(csr, "APPOINTMENT", old_aid)
+            if old_key:
+                AppointmentRollup.apply(csr, old_key[0], old_key[1], old_key[2], -1)
+                AppointmentRollup.apply(csr, self.entry_adate.get_value(), self.entry_adid.get_value(), self.entry_adepid.get_value(), 1)
             conn.commit()
+            self.audit("UPDATE", "APPOINTMENT", old_aid, before=old_values, after=values)
+            self.search_cache.invalidate("APPOINTMENT")
             messagebox.showinfo("Success", "Appointment updated successfully!")
             self.view_appointments()
-        except Exception as e: messagebox.showerror("Database Error", f"Error updating appointment: {str(e)}")
+        except Exception as e:
+            conn.rollback()
+            messagebox.showerror("Database Error", f"Error updating appointment: {str(e)}")
 
     def delete_appointment(self):
         if not self.tree_appointment.selection(): messagebox.showerror("Error", "Please select an appointment to delete"); return
+        if self.is_archived_selection(self.tree_appointment): messagebox.showerror("Error", "Archived appointments are read-only"); return
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this appointment?"):
             try:
                 selected_item = self.tree_appointment.selection()[0]
                 aid = self.tree_appointment.item(selected_item, 'values')[0]
-                csr.execute("DELETE FROM APPOINTMENT WHERE AID=%s", (aid,))
+                old_key = AppointmentRollup.fetch_appointment_key(csr, aid)
+                deleted = Statements.execute(conn, "delete", (aid,), table="APPOINTMENT")
+                if old_key and deleted:
+                    AppointmentRollup.apply(csr, old_key[0], old_key[1], old_key[2], -1)
+                DeltaSync.record_delete(csr, "APPOINTMENT", aid)
                 conn.commit()
-                self.tree_appointment.delete(selected_item)
+                self.audit("DELETE", "APPOINTMENT", aid, before=self.tree_appointment.item(selected_item, 'values'))
+                self.search_cache.invalidate("APPOINTMENT")
+                self.forget_rows("APPOINTMENT", self.tree_appointment, [selected_item])
                 messagebox.showinfo("Success", "Appointment deleted successfully!")
                 self.clear_appointment_form()
-            except Exception as e: messagebox.showerror("Database Error", f"Error deleting appointment: {str(e)}")
+            except Exception as e:
+                conn.rollback()
+                messagebox.showerror("Database Error", f"Error deleting appointment: {str(e)}")
+
+    def open_repeat(self):
+        """Expand the appointment in the form into a recurring series"""
+        fields = [(self.entry_apid.get_value(), lambda x: ValidationUtils.validate_id(x, "Patient ID")),
+                  (self.entry_adid.get_value(), lambda x: ValidationUtils.validate_id(x, "Doctor ID")),
+                  (self.entry_adepid.get_value(), lambda x: ValidationUtils.validate_id(x, "Department ID")),
+                  (self.entry_adate.get_value(), ValidationUtils.validate_date),
+                  (self.entry_atime.get_value(), ValidationUtils.validate_time)]
+        errors = []
+        for value, validator in fields:
+            is_valid, message = validator(value)
+            if not is_valid:
+                errors.append(message)
+        if errors:
+            messagebox.showerror("Error", "Fill in the appointment to repeat first:\n" + "\n".join(errors))
+            return
+        pid, did, depid, first_day, a_time = (value for value, _ in fields)
+        try:
+            # The references are checked once for the whole series
+            for key, table, label in ((pid, "PATIENT", "Patient"), (did, "DOCTOR", "Doctor"), (depid, "DEPT", "Department")):
+                if Statements.query(conn, "exists", (key,), table=table)[0][0] == 0:
+                    messagebox.showerror("Error", f"{label} ID not found.")
+                    return
+        except Exception as e:
+            messagebox.showerror("Database Error", f"Error checking appointment: {str(e)}")
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title(f"Repeat appointment for patient {pid}")
+        window.configure(bg=ModernColors.BACKGROUND)
+        window.geometry("560x520")
+
+        controls = tk.Frame(window, bg=ModernColors.BACKGROUND)
+        controls.pack(fill="x", padx=15, pady=10)
+        frequencies = {"Daily": "daily", "Weekly": "weekly", "Monthly (same date)": "monthly", "Monthly (same weekday)": "monthly-weekday"}
+        tk.Label(controls, text="Repeat:", font=self.body_font, bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY).grid(row=0, column=0, sticky="w", padx=5, pady=3)
+        frequency = ttk.Combobox(controls, values=list(frequencies), state="readonly", font=self.body_font, width=22)
+        frequency.set("Weekly")
+        frequency.grid(row=0, column=1, sticky="w", padx=5, pady=3)
+        tk.Label(controls, text="Every:", font=self.body_font, bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY).grid(row=1, column=0, sticky="w", padx=5, pady=3)
+        interval_entry = ModernEntry(controls, width=6)
+        interval_entry.insert(0, "1")
+        interval_entry.grid(row=1, column=1, sticky="w", padx=5, pady=3)
+        tk.Label(controls, text="Occurrences:", font=self.body_font, bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY).grid(row=2, column=0, sticky="w", padx=5, pady=3)
+        count_entry = ModernEntry(controls, width=6)
+        count_entry.insert(0, "12")
+        count_entry.grid(row=2, column=1, sticky="w", padx=5, pady=3)
+        tk.Label(controls, text="Until (optional):", font=self.body_font, bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY).grid(row=3, column=0, sticky="w", padx=5, pady=3)
+        until_entry = ModernEntry(controls, placeholder="YYYY-MM-DD", width=12)
+        until_entry.grid(row=3, column=1, sticky="w", padx=5, pady=3)
+        skip_booked = tk.BooleanVar(value=False)
+        tk.Checkbutton(controls, text="Skip dates the doctor is already booked", variable=skip_booked, font=self.body_font,
+                       bg=ModernColors.BACKGROUND, activebackground=ModernColors.BACKGROUND).grid(row=4, column=0, columnspan=2, sticky="w", padx=5, pady=3)
+
+        preview = ttk.Treeview(window, columns=("DATE", "STATUS"), show="headings", height=10)
+        for column, heading, width in (("DATE", "Date", 160), ("STATUS", "Doctor's schedule", 300)):
+            preview.heading(column, text=heading)
+            preview.column(column, width=width, minwidth=60)
+        preview.tag_configure("booked", foreground=ModernColors.ERROR)
+        preview.pack(fill="both", expand=True, padx=15)
+        status = tk.Label(window, text="", font=self.body_font, bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_SECONDARY, justify="left")
+        status.pack(padx=15, anchor="w")
+
+        def rule():
+            """(dates, rule text) from the controls; raises ValueError for bad input"""
+            start = datetime.strptime(first_day, "%Y-%m-%d").date()
+            until_text = until_entry.get_value().strip()
+            if until_text in ("", until_entry.placeholder):
+                until = None
+            elif ValidationUtils.validate_date(until_text)[0]:
+                until = datetime.strptime(until_text, "%Y-%m-%d").date()
+            else:
+                raise ValueError("Until must be a date in YYYY-MM-DD format")
+            try:
+                interval = int(interval_entry.get_value() or 1)
+                count = int(count_entry.get_value()) if count_entry.get_value().strip() else None
+            except ValueError:
+                raise ValueError("Every and Occurrences must be whole numbers")
+            kind = frequencies[frequency.get()]
+            return (AppointmentSeries.expand(start, kind, interval, count, until),
+                    AppointmentSeries.describe(start, kind, interval, count, until))
+
+        def show_preview():
+            try:
+                dates, text = rule()
+                clashes = AppointmentSeries.conflicts(csr, did, a_time, dates)
+            except ValueError as e:
+                status.configure(text=str(e), fg=ModernColors.ERROR)
+                return None
+            except Exception as e:
+                messagebox.showerror("Database Error", f"Error checking the doctor's schedule: {str(e)}", parent=window)
+                return None
+            preview.delete(*preview.get_children())
+            for day in dates:
+                clash = clashes.get(str(day))
+                preview.insert("", "end", values=(f"{day} {AppointmentSeries.WEEKDAYS[day.weekday()][:3]}",
+                                                  f"booked (appointment {clash})" if clash else "free"),
+                               tags=("booked",) if clash else ())
+            summary = f"{text} at {a_time}: {len(dates)} appointments"
+            if clashes:
+                summary += f", {len(clashes)} clash with the doctor's schedule"
+            status.configure(text=summary, fg=ModernColors.WARNING if clashes else ModernColors.TEXT_SECONDARY)
+            return dates, text
+
+        def create():
+            checked = show_preview()
+            if checked is None:
+                return
+            dates, text = checked
+            try:
+                series_id, rows, skipped = AppointmentSeries.create(conn, pid, did, depid, a_time, dates, text, skip_booked.get())
+            except ValueError as e:
+                status.configure(text=str(e), fg=ModernColors.ERROR)
+                return
+            except Exception as e:
+                messagebox.showerror("Database Error", f"Error creating series: {str(e)}", parent=window)
+                return
+            for row in rows:
+                self.audit("INSERT", "APPOINTMENT", row[0], after=row)
+            self.search_cache.invalidate("APPOINTMENT")
+            skipped_text = f"\nSkipped {len(skipped)} booked dates." if skipped else ""
+            messagebox.showinfo("Success", f"Series {series_id} added: appointments {rows[0][0]} to {rows[-1][0]}.{skipped_text}", parent=window)
+            window.destroy()
+            if self.active_table == "APPOINTMENT":
+                self.view_appointments()
+
+        button_frame = tk.Frame(window, bg=ModernColors.BACKGROUND)
+        button_frame.pack(pady=10)
+        ModernButton(button_frame, "Preview", show_preview, "secondary").pack(side="left", padx=5)
+        ModernButton(button_frame, "Create Series", create, "primary").pack(side="left", padx=5)
+        ModernButton(button_frame, "Close", window.destroy, "danger").pack(side="left", padx=5)
+        show_preview()
+
+    def open_series(self):
+        """Move or cancel the rest of the selected appointment's series"""
+        if not self.tree_appointment.selection(): messagebox.showerror("Error", "Please select an appointment of the series"); return
+        selected = self.tree_appointment.item(self.tree_appointment.selection()[0], 'values')
+        try:
+            series = AppointmentSeries.of_appointment(csr, selected[0])
+            members = AppointmentSeries.members(csr, series[0]) if series else []
+        except Exception as e:
+            messagebox.showerror("Database Error", f"Error loading series: {str(e)}")
+            return
+        if not series:
+            messagebox.showinfo("Series", f"Appointment {selected[0]} is not part of a series.")
+            return
+        series_id, rule_text = series
+
+        window = tk.Toplevel(self.root)
+        window.title(f"Appointment series {series_id}")
+        window.configure(bg=ModernColors.BACKGROUND)
+        window.geometry("620x520")
+        tk.Label(window, text=f"Series {series_id}: {rule_text}", font=self.subheading_font, bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY).pack(padx=15, pady=(10, 5), anchor="w")
+
+        listing = ttk.Treeview(window, columns=AppointmentSeries.COLUMNS, show="headings", height=10)
+        for column in AppointmentSeries.COLUMNS:
+            listing.heading(column, text=column)
+            listing.column(column, width=90, minwidth=60)
+        listing.pack(fill="both", expand=True, padx=15)
+
+        controls = tk.Frame(window, bg=ModernColors.BACKGROUND)
+        controls.pack(fill="x", padx=15, pady=10)
+        entries = {}
+        for row, (key, label) in enumerate((("FROM", "From date:"), ("DID", "Doctor ID:"), ("A_TIME", "Time:"), ("DepID", "Department ID:"))):
+            tk.Label(controls, text=label, font=self.body_font, bg=ModernColors.BACKGROUND, fg=ModernColors.TEXT_PRIMARY).grid(row=row, column=0, sticky="w", padx=5, pady=3)
+            entries[key] = ModernEntry(controls, width=14)
+            entries[key].grid(row=row, column=1, sticky="w", padx=5, pady=3)
+        # Changes apply from the selected appointment onwards unless another date is given
+        entries["FROM"].insert(0, str(selected[3]))
+        entries["DID"].insert(0, str(selected[2]))
+        minutes = AppointmentCalendar.minutes(selected[4])
+        entries["A_TIME"].insert(0, f"{minutes // 60:02d}:{minutes % 60:02d}")
+        entries["DepID"].insert(0, str(selected[5]))
+
+        def fill(rows):
+            listing.delete(*listing.get_children())
+            for values in rows:
+                listing.insert("", "end", values=values)
+
+        def from_day():
+            is_valid, message = ValidationUtils.validate_date(entries["FROM"].get_value())
+            if not is_valid:
+                messagebox.showerror("Error", message, parent=window)
+                return None
+            return entries["FROM"].get_value()
+
+        def finish(message):
+            self.search_cache.invalidate("APPOINTMENT")
+            try:
+                fill(AppointmentSeries.members(csr, series_id))
+            except Exception as e:
+                message += f"\nThe list could not be reloaded: {str(e)}"
+            messagebox.showinfo("Success", message, parent=window)
+            if self.active_table == "APPOINTMENT":
+                self.view_appointments()
+
+        def move():
+            day = from_day()
+            if day is None:
+                return
+            for (value, validator) in ((entries["DID"].get_value(), lambda x: ValidationUtils.validate_id(x, "Doctor ID")),
+                                       (entries["A_TIME"].get_value(), ValidationUtils.validate_time),
+                                       (entries["DepID"].get_value(), lambda x: ValidationUtils.validate_id(x, "Department ID"))):
+                is_valid, message = validator(value)
+                if not is_valid:
+                    messagebox.showerror("Error", message, parent=window)
+                    return
+            did, a_time, depid = entries["DID"].get_value(), entries["A_TIME"].get_value(), entries["DepID"].get_value()
+            try:
+                for key, table, label in ((did, "DOCTOR", "Doctor"), (depid, "DEPT", "Department")):
+                    if Statements.query(conn, "exists", (key,), table=table)[0][0] == 0:
+                        messagebox.showerror("Error", f"{label} ID not found.", parent=window)
+                        return
+                before, after = AppointmentSeries.update(conn, series_id, day, did, a_time, depid)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e), parent=window)
+                return
+            except Exception as e:
+                messagebox.showerror("Database Error", f"Error updating series: {str(e)}", parent=window)
+                return
+            for old, new in zip(before, after):
+                self.audit("UPDATE", "APPOINTMENT", old[0], before=old, after=new)
+            finish(f"Updated {len(after)} appointments from {day}.")
+
+        def cancel():
+            day = from_day()
+            if day is None:
+                return
+            if not messagebox.askyesno("Confirm Cancel", f"Cancel every appointment of this series from {day}?", parent=window):
+                return
+            try:
+                removed = AppointmentSeries.cancel(conn, series_id, day)
+            except Exception as e:
+                messagebox.showerror("Database Error", f"Error cancelling series: {str(e)}", parent=window)
+                return
+            for row in removed:
+                self.audit("DELETE", "APPOINTMENT", row[0], before=row)
+            finish(f"Cancelled {len(removed)} appointments from {day}.")
+
+        button_frame = tk.Frame(window, bg=ModernColors.BACKGROUND)
+        button_frame.pack(pady=(0, 10))
+        ModernButton(button_frame, "Update From Date", move, "secondary").pack(side="left", padx=5)
+        ModernButton(button_frame, "Cancel From Date", cancel, "danger").pack(side="left", padx=5)
+        ModernButton(button_frame, "Close", window.destroy, "warning").pack(side="left", padx=5)
+        fill(members)
 
     def clear_appointment_form(self):
         entries = [self.entry_aid, self.entry_apid, self.entry_adid, self.entry_adate, self.entry_atime, self.entry_adepid]
@@ -1325,29 +6198,26 @@ class ModernHospitalManagement:
 
     def view_appointments(self):
         try:
-            for row in self.tree_appointment.get_children(): self.tree_appointment.delete(row)
-            csr.execute("SELECT * FROM APPOINTMENT")
-            rows = csr.fetchall()
-            for row in rows: self.tree_appointment.insert("", tk.END, values=row)
+            self.load_table_rows("APPOINTMENT", self.tree_appointment, include_archive=self.include_archive_appointment.get())
         except Exception as e: messagebox.showerror("Database Error", f"Error loading appointments: {str(e)}")
 
     def search_appointment(self):
         try:
-            for row in self.tree_appointment.get_children(): self.tree_appointment.delete(row)
+            self.cancel_render("APPOINTMENT"); self.tree_appointment.delete(*self.tree_appointment.get_children())
             search_field = self.search_field_appointment.get()
             search_value = self.search_entry_appointment.get_value()
             if not search_field or not search_value: messagebox.showerror("Error", "Please select search field and enter search value"); return
             # Correctly use parameterized query
-            query = f"SELECT * FROM APPOINTMENT WHERE {search_field} LIKE %s"
-            csr.execute(query, (f"%{search_value}%",))
-            rows = csr.fetchall()
-            for row in rows: self.tree_appointment.insert("", tk.END, values=row)
+            self.load_table_rows("APPOINTMENT", self.tree_appointment, "search_like",
+                                 (f"%{search_value}%",), field=search_field, filtered=True, include_archive=self.include_archive_appointment.get(),
+                                 cache_key=("APPOINTMENT", search_field, search_value, self.include_archive_appointment.get()))
         except Exception as e: messagebox.showerror("Database Error", f"Error searching appointments: {str(e)}")
 
     # ------------------ MEDICAL RECORDS MANAGEMENT ------------------
     def show_medical_records(self):
         self.clear_main_frame()
         self.highlight_nav_button(4)
+        self.active_table = "MED_RECORD"
         
         medical_record_frame = tk.Frame(self.main_frame, bg=ModernColors.BACKGROUND)
         medical_record_frame.pack(fill="both", expand=True)
@@ -1368,6 +6238,8 @@ class ModernHospitalManagement:
         ModernButton(button_frame, "Update Record", self.update_medical_record, "secondary").pack(side="left", padx=5)
         ModernButton(button_frame, "Delete Record", self.delete_medical_record, "danger").pack(side="left", padx=5)
         ModernButton(button_frame, "Clear Form", self.clear_medical_record_form, "warning").pack(side="left", padx=5)
+        ModernButton(button_frame, "Batch Entry", lambda: self.open_batch_entry("MED_RECORD"), "primary").pack(side="left", padx=5)
+        ModernButton(button_frame, "History", lambda: self.show_history("MED_RECORD"), "secondary").pack(side="left", padx=5)
 
         search_frame = tk.Frame(medical_record_frame, bg=ModernColors.SURFACE, relief="solid", bd=1)
         # MODIFIED: Reduced ipady and pady to make search section smaller.
@@ -1382,6 +6254,11 @@ class ModernHospitalManagement:
         self.search_entry_medrecord.pack(side="left", padx=5)
         ModernButton(search_controls, "Search", self.search_medical_record, "primary").pack(side="left", padx=5)
         ModernButton(search_controls, "View All", self.view_medical_records, "secondary").pack(side="left", padx=5)
+        self.add_local_filter(search_controls, "MED_RECORD")
+        self.include_archive_medrecord = tk.BooleanVar(value=False)
+        tk.Checkbutton(search_controls, text="Include archive", variable=self.include_archive_medrecord, command=self.view_medical_records, font=self.body_font,
+                       bg=ModernColors.SURFACE, activebackground=ModernColors.SURFACE,
+                       state="disabled" if REPLICA_PATH else "normal").pack(side="left", padx=5)
 
         table_frame = tk.Frame(medical_record_frame, bg=ModernColors.SURFACE, relief="solid", bd=1)
         # The table now has more vertical space to expand into.
@@ -1391,7 +6268,7 @@ class ModernHospitalManagement:
 
     def create_medical_record_form(self, parent):
         fields = [
-            ("Record ID:", "entry_rid", lambda x: ValidationUtils.validate_id(x, "Record ID")),
+            ("Record ID (blank = new):", "entry_rid", lambda x: ValidationUtils.validate_id(x, "Record ID")),
             ("Patient ID:", "entry_rpid", lambda x: ValidationUtils.validate_id(x, "Patient ID")),
             ("Doctor ID:", "entry_rdid", lambda x: ValidationUtils.validate_id(x, "Doctor ID")),
             ("Last Visit (YYYY-MM-DD):", "entry_last_visit", ValidationUtils.validate_date)
@@ -1431,6 +6308,7 @@ class ModernHospitalManagement:
         for col, heading, width in headings:
             self.tree_medrecord.heading(col, text=heading)
             self.tree_medrecord.column(col, width=width, minwidth=80)
+        self.enable_local_sort("MED_RECORD", self.tree_medrecord)
         self.tree_medrecord.pack(side="left", fill="both", expand=True)
         v_scrollbar.pack(side="right", fill="y")
         h_scrollbar.pack(side="bottom", fill="x")
@@ -1445,73 +6323,121 @@ class ModernHospitalManagement:
                 entry.delete(0, tk.END)
                 if i < len(values): entry.insert(0, values[i])
             self.text_diagnosis.delete(1.0, tk.END)
-            if len(values) > 4: self.text_diagnosis.insert(1.0, values[4])
+            if len(values) > 4:
+                diagnosis = self.fetch_full_diagnosis(values[0], values[-1])
+                self.diagnosis_incomplete = diagnosis is None
+                self.text_diagnosis.insert(1.0, values[4] if diagnosis is None else diagnosis)
+
+    def fetch_full_diagnosis(self, rid, version):
+        """The table only holds a preview; load the full text for one record, cached by (RID, VERSION)"""
+        key = (str(rid), str(version))
+        diagnosis = self.diagnosis_cache.get(key)
+        if diagnosis is not None:
+            return diagnosis
+        try:
+            rows = Statements.query(conn, "diagnosis", (rid,), table="MED_RECORD")
+            if not rows and not REPLICA_PATH:
+                rows = Statements.query(conn, "diagnosis", (rid,), table="MED_RECORD", archive=True)
+            row = rows[0] if rows else None
+        except Exception as e:
+            messagebox.showerror("Database Error", f"Error loading diagnosis: {str(e)}")
+            return None
+        diagnosis = (row[0] or "") if row else ""
+        self.diagnosis_cache.put(key, diagnosis)
+        return diagnosis
 
     def add_medical_record(self):
         try:
-            csr.execute("INSERT INTO MED_RECORD (RID, PID, DID, LAST_VISIT, DIAGNOSIS) VALUES (%s, %s, %s, %s, %s)",
-                        (self.entry_rid.get_value(), self.entry_rpid.get_value(), self.entry_rdid.get_value(),
-                         self.entry_last_visit.get_value(), self.text_diagnosis.get(1.0, tk.END).strip()))
+            typed_rid = self.entry_rid.get_value()
+            values = (typed_rid or self.allocate_id("MED_RECORD"), self.entry_rpid.get_value(), self.entry_rdid.get_value(),
+                      self.entry_last_visit.get_value(), self.text_diagnosis.get(1.0, tk.END).strip())
+            Statements.execute(conn, "medrecord_insert", values)
+            if typed_rid:
+                self.reserve_id("MED_RECORD", typed_rid)
+            self.refresh_visit_summary(values[1])
             conn.commit()
-            messagebox.showinfo("Success", "Medical Record added successfully!")
+            self.audit("INSERT", "MED_RECORD", values[0], after=values)
+            self.search_cache.invalidate("MED_RECORD")
+            messagebox.showinfo("Success", f"Medical Record {values[0]} added successfully!")
             self.clear_medical_record_form()
             self.view_medical_records()
-        except Exception as e: messagebox.showerror("Database Error", f"Error adding medical record: {str(e)}")
+        except Exception as e:
+            conn.rollback()
+            messagebox.showerror("Database Error", f"Error adding medical record: {str(e)}")
 
     def update_medical_record(self):
         if not self.tree_medrecord.selection(): messagebox.showerror("Error", "Please select a medical record to update"); return
+        if self.is_archived_selection(self.tree_medrecord): messagebox.showerror("Error", "Archived medical records are read-only"); return
+        # Saving a truncated preview would cut the stored diagnosis short
+        if self.diagnosis_incomplete: messagebox.showerror("Error", "The full diagnosis could not be loaded. Please reselect the record."); return
         try:
             selected_item = self.tree_medrecord.selection()[0]
-            old_rid = self.tree_medrecord.item(selected_item, 'values')[0]
-            csr.execute("UPDATE MED_RECORD SET RID=%s, PID=%s, DID=%s, LAST_VISIT=%s, DIAGNOSIS=%s WHERE RID=%s",
-                        (self.entry_rid.get_value(), self.entry_rpid.get_value(), self.entry_rdid.get_value(),
-                         self.entry_last_visit.get_value(), self.text_diagnosis.get(1.0, tk.END).strip(), old_rid))
+            old_values = self.tree_medrecord.item(selected_item, 'values')
+            old_rid, version = old_values[0], old_values[-1]
+            values = (self.entry_rid.get_value(), self.entry_rpid.get_value(), self.entry_rdid.get_value(),
+                      self.entry_last_visit.get_value(), self.text_diagnosis.get(1.0, tk.END).strip())
+            updated = Statements.execute(conn, "medrecord_update", values + (old_rid, version))
+            if updated == 0: self.show_conflict("medical record"); return
+            if str(old_rid) != self.entry_rid.get_value(): DeltaSync.record_delete(csr, "MED_RECORD", old_rid)
+            self.refresh_visit_summary(old_values[1], values[1])
             conn.commit()
+            self.audit("UPDATE", "MED_RECORD", old_rid, before=old_values, after=values)
+            self.search_cache.invalidate("MED_RECORD")
             messagebox.showinfo("Success", "Medical Record updated successfully!")
             self.view_medical_records()
-        except Exception as e: messagebox.showerror("Database Error", f"Error updating medical record: {str(e)}")
+        except Exception as e:
+            conn.rollback()
+            messagebox.showerror("Database Error", f"Error updating medical record: {str(e)}")
     
     def delete_medical_record(self):
         if not self.tree_medrecord.selection(): messagebox.showerror("Error", "Please select a medical record to delete"); return
+        if self.is_archived_selection(self.tree_medrecord): messagebox.showerror("Error", "Archived medical records are read-only"); return
         if messagebox.askyesno("Confirm Delete", "Are you sure you want to delete this record?"):
             try:
                 selected_item = self.tree_medrecord.selection()[0]
-                rid = self.tree_medrecord.item(selected_item, 'values')[0]
-                csr.execute("DELETE FROM MED_RECORD WHERE RID=%s", (rid,))
+                rid, pid = self.tree_medrecord.item(selected_item, 'values')[:2]
+                Statements.execute(conn, "delete", (rid,), table="MED_RECORD")
+                DeltaSync.record_delete(csr, "MED_RECORD", rid)
+                self.refresh_visit_summary(pid)
                 conn.commit()
-                self.tree_medrecord.delete(selected_item)
+                self.audit("DELETE", "MED_RECORD", rid, before=self.tree_medrecord.item(selected_item, 'values'))
+                self.search_cache.invalidate("MED_RECORD")
+                self.forget_rows("MED_RECORD", self.tree_medrecord, [selected_item])
                 messagebox.showinfo("Success", "Medical Record deleted successfully!")
                 self.clear_medical_record_form()
-            except Exception as e: messagebox.showerror("Database Error", f"Error deleting medical record: {str(e)}")
+            except Exception as e:
+                conn.rollback()
+                messagebox.showerror("Database Error", f"Error deleting medical record: {str(e)}")
 
     def clear_medical_record_form(self):
         entries = [self.entry_rid, self.entry_rpid, self.entry_rdid, self.entry_last_visit]
         for entry in entries: entry.delete(0, tk.END)
         self.text_diagnosis.delete(1.0, tk.END)
+        self.diagnosis_incomplete = False
 
     def view_medical_records(self):
         try:
-            for row in self.tree_medrecord.get_children(): self.tree_medrecord.delete(row)
-            csr.execute("SELECT * FROM MED_RECORD")
-            rows = csr.fetchall()
-            for row in rows: self.tree_medrecord.insert("", tk.END, values=row)
+            self.load_table_rows("MED_RECORD", self.tree_medrecord, include_archive=self.include_archive_medrecord.get())
         except Exception as e: messagebox.showerror("Database Error", f"Error loading medical records: {str(e)}")
 
     def search_medical_record(self):
         try:
-            for row in self.tree_medrecord.get_children(): self.tree_medrecord.delete(row)
+            self.cancel_render("MED_RECORD"); self.tree_medrecord.delete(*self.tree_medrecord.get_children())
             search_field = self.search_field_medrecord.get()
             search_value = self.search_entry_medrecord.get_value()
             if not search_field or not search_value: messagebox.showerror("Error", "Please select search field and enter search value"); return
             # Correctly use parameterized query
-            query = f"SELECT * FROM MED_RECORD WHERE {search_field} LIKE %s"
-            csr.execute(query, (f"%{search_value}%",))
-            rows = csr.fetchall()
-            for row in rows: self.tree_medrecord.insert("", tk.END, values=row)
+            self.load_table_rows("MED_RECORD", self.tree_medrecord, "search_like",
+                                 (f"%{search_value}%",), field=search_field, filtered=True, include_archive=self.include_archive_medrecord.get(),
+                                 cache_key=("MED_RECORD", search_field, search_value, self.include_archive_medrecord.get()))
         except Exception as e: messagebox.showerror("Database Error", f"Error searching medical records: {str(e)}")
 
     def on_closing(self):
         if messagebox.askokcancel("Quit", "Do you want to quit?"):
+            if replica_sync:
+                replica_sync.stop()
+            if audit_log:
+                audit_log.stop()
             try:
                 if conn.is_connected():
                     conn.close()
@@ -1519,6 +6445,209 @@ class ModernHospitalManagement:
                 pass
             self.root.destroy()
 
+def open_job_connection():
+    """Dedicated connection for command-line maintenance jobs"""
+    connection = mysql_connector().connect(**DB_CONFIG)
+    cursor = connection.cursor()
+    if installed_schema_version(cursor) != SCHEMA_VERSION:
+        create_schema(cursor)
+        connection.commit()
+        PhoneKeys.backfill(connection)
+    return connection
+
+def main():
+    parser = argparse.ArgumentParser(description="Hospital Management System")
+    commands = parser.add_subparsers(dest="command")
+
+    archive_parser = commands.add_parser("archive", help="move old appointments and medical records to the archive tables")
+    archive_parser.add_argument("--older-than-days", type=int, default=Archiver.DEFAULT_AGE_DAYS)
+    archive_parser.add_argument("--batch-size", type=int, default=Archiver.BATCH_SIZE)
+
+    duplicates_parser = commands.add_parser("find-duplicates", help="list likely duplicate patients in PATIENT_MERGE_CANDIDATE")
+    duplicates_parser.add_argument("--csv", help="also write the open candidates to this CSV file")
+
+    remove_parser = commands.add_parser("remove", help="delete or anonymize a patient or doctor that still has appointments or records")
+    remove_parser.add_argument("table", choices=["patient", "doctor"])
+    remove_parser.add_argument("key", type=int, help="PID or DID")
+    remove_parser.add_argument("--mode", choices=["archive", "purge", "anonymize"], default="archive",
+                               help="doctors can only be archived")
+    remove_parser.add_argument("--batch-size", type=int, default=RecordRemover.BATCH_SIZE)
+    remove_parser.add_argument("--include-future", action="store_true",
+                               help="also archive a doctor's upcoming appointments, taking them off the schedule")
+
+    reminders_parser = commands.add_parser("send-reminders", help="send reminders for a day's appointments (tomorrow by default)")
+    reminders_parser.add_argument("--day", type=date.fromisoformat, default=date.today() + timedelta(days=1), help="YYYY-MM-DD")
+    reminders_parser.add_argument("--channel", choices=ReminderJob.CHANNELS, default="email")
+    reminders_parser.add_argument("--sink", choices=["smtp", "sms", "file"], default="file")
+    reminders_parser.add_argument("--out", help="output file for --sink file (default reminders.jsonl)")
+    reminders_parser.add_argument("--workers", type=int, default=ReminderJob.WORKERS)
+    reminders_parser.add_argument("--rate", type=float, default=ReminderJob.RATE_PER_SECOND, help="messages per second across all workers")
+    reminders_parser.add_argument("--batch-size", type=int, default=ReminderJob.BATCH_SIZE)
+
+    backup_parser = commands.add_parser("backup", help="write a consistent backup of the core tables while the app is in use")
+    backup_parser.add_argument("--out", help=f"backup directory (default {Backup.DEFAULT_DIR}/backup-<timestamp>)")
+    backup_parser.add_argument("--chunk-rows", type=int, default=Backup.CHUNK_ROWS)
+
+    restore_parser = commands.add_parser("restore", help="replace the core tables with a backup")
+    restore_parser.add_argument("directory")
+    restore_parser.add_argument("--yes", action="store_true", help="confirm that the current rows may be replaced")
+    restore_parser.add_argument("--verify-only", action="store_true", help="only check the backup's checksums")
+
+    reports_parser = commands.add_parser("reports", help="write HTML summary reports for some or all patients")
+    reports_parser.add_argument("pids", nargs="*", type=int, help="PIDs to report on (default: every patient)")
+    reports_parser.add_argument("--out", default=PatientReports.DEFAULT_DIR)
+    reports_parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    reports_parser.add_argument("--chunk-size", type=int, default=PatientReports.CHUNK_SIZE)
+
+    scan_parser = commands.add_parser("scan-data", help="check stored rows against the form rules and for orphaned references")
+    scan_parser.add_argument("--tables", nargs="+", type=str.upper, choices=list(DataQualityScan.RULES))
+    scan_parser.add_argument("--out", default="data-quality.csv", help="CSV report of every problem found")
+    scan_parser.add_argument("--fix", action="store_true", help="correct whitespace, phone formatting and stale PH_KEY values in place")
+    scan_parser.add_argument("--workers", type=int, help="worker processes (default: CPU count)")
+    scan_parser.add_argument("--chunk-size", type=int, default=DataQualityScan.CHUNK_SIZE)
+
+    load_parser = commands.add_parser("load-test", help="simulate concurrent front desks and report latency per operation")
+    load_parser.add_argument("--target", choices=["sqlite", "mysql"], default="sqlite",
+                             help="sqlite: a throwaway local stand-in; mysql: a scratch database on the configured server")
+    load_parser.add_argument("--sqlite-path", default="loadtest.db")
+    load_parser.add_argument("--database", default="HospitalLoadTest",
+                             help="scratch MySQL database, created with the app's schema if missing")
+    load_parser.add_argument("--force", action="store_true", help="allow --database HospitalManagement, the live database")
+    load_parser.add_argument("--clients", default="1,2,4,8,16,32", help="comma-separated client counts to ramp through")
+    load_parser.add_argument("--seconds", type=float, default=10, help="duration of each stage")
+    load_parser.add_argument("--mix", type=LoadTest.parse_mix, help="weights, e.g. view=5,search=40,add=20,update=15,delete=10,dashboard=10")
+    load_parser.add_argument("--patients", type=int, default=5000)
+
+    audit_parser = commands.add_parser("audit", help="show audit events for one record or a time range, newest first")
+    audit_parser.add_argument("--table", type=str.upper, choices=list(DeltaSync.TABLES), help="required with --id")
+    audit_parser.add_argument("--id", help="primary key of the record")
+    audit_parser.add_argument("--since", type=datetime.fromisoformat, help="YYYY-MM-DD[ HH:MM[:SS]]")
+    audit_parser.add_argument("--until", type=datetime.fromisoformat, help="YYYY-MM-DD[ HH:MM[:SS]]")
+    audit_parser.add_argument("--limit", type=int, default=AuditLog.HISTORY_LIMIT)
+    audit_parser.add_argument("--files", action="store_true", help="read the segment files instead of AUDIT_LOG")
+
+    args = parser.parse_args()
+    if args.command == "archive":
+        connection = open_job_connection()
+        try:
+            totals = Archiver.run(connection, args.older_than_days, args.batch_size)
+            print("Archived: " + ", ".join(f"{table} {count}" for table, count in totals.items()))
+        finally:
+            connection.close()
+    elif args.command == "find-duplicates":
+        connection = open_job_connection()
+        try:
+            found = PatientMatcher.run(connection)
+            print(f"Merge candidates found: {found}")
+            if args.csv:
+                cursor = connection.cursor()
+                cursor.execute("SELECT PID_A, PID_B, SCORE, REASON FROM PATIENT_MERGE_CANDIDATE WHERE STATUS = 'OPEN' ORDER BY SCORE DESC")
+                with open(args.csv, "w", newline="") as handle:
+                    writer = csv.writer(handle)
+                    writer.writerow(["PID_A", "PID_B", "SCORE", "REASON"])
+                    writer.writerows(cursor.fetchall())
+        finally:
+            connection.close()
+    elif args.command == "send-reminders":
+        connection = open_job_connection()
+        sink = ReminderJob.make_sink(args.sink, args.out)
+        try:
+            ReminderJob(connection, sink, args.channel, args.workers, args.rate, args.batch_size).run(args.day)
+        finally:
+            sink.close()
+            connection.close()
+    elif args.command == "remove":
+        connection = open_job_connection()
+        if args.table == "doctor" and not args.include_future:
+            upcoming = RecordRemover.future_appointments(connection.cursor(), "DOCTOR", args.key)
+            connection.rollback()
+            if upcoming:
+                for aid, a_date, a_time, pid in upcoming:
+                    print(f"{a_date} {a_time}  appointment {aid}  patient {pid}")
+                connection.close()
+                parser.error(f"doctor {args.key} has {len(upcoming)} upcoming appointment(s) listed above; "
+                             "reassign or cancel them, or pass --include-future to archive them too")
+        start_audit_log()
+        try:
+            RecordRemover.run(connection, args.table.upper(), args.key, args.mode, args.batch_size, include_future=args.include_future)
+        finally:
+            audit_log.stop()
+            connection.close()
+    elif args.command == "backup":
+        connection = open_job_connection()
+        try:
+            Backup.run(connection, args.out, args.chunk_rows)
+        finally:
+            connection.close()
+    elif args.command == "restore":
+        if args.verify_only:
+            manifest = Backup.verify(args.directory)
+            print(f"Backup of {manifest['taken_at']} is intact: " +
+                  ", ".join(f"{table} {entry['rows']}" for table, entry in manifest["tables"].items()))
+            return
+        if not args.yes:
+            parser.error("restore replaces every row of " + ", ".join(Backup.TABLES) + "; pass --yes to go ahead")
+        connection = open_job_connection()
+        start_audit_log()
+        try:
+            Backup.restore(connection, args.directory)
+        finally:
+            audit_log.stop()
+            connection.close()
+    elif args.command == "reports":
+        connection = open_job_connection()
+        try:
+            PatientReports.run(connection, args.out, args.pids, args.workers, args.chunk_size)
+        finally:
+            connection.close()
+    elif args.command == "scan-data":
+        connection = open_job_connection()
+        if args.fix:
+            start_audit_log()
+        try:
+            DataQualityScan.run(connection, args.out, args.tables, args.fix, args.workers, args.chunk_size)
+        finally:
+            if audit_log:
+                audit_log.stop()
+            connection.close()
+    elif args.command == "load-test":
+        if args.target == "mysql":
+            if not re.fullmatch(r"\w+", args.database):
+                parser.error("--database must be a plain database name")
+            if args.database.lower() == "hospitalmanagement" and not args.force:
+                parser.error("refusing to load-test the live database; name a scratch --database, or pass --force")
+            connection = mysql_connector().connect(**DB_CONFIG)
+            try:
+                cursor = connection.cursor()
+                if installed_schema_version(cursor, args.database) != SCHEMA_VERSION:
+                    create_schema(cursor, args.database)
+                    connection.commit()
+            finally:
+                connection.close()
+            connect = lambda: mysql_connector().connect(database=args.database, **DB_CONFIG)
+        else:
+            connect = LoadTest.sqlite_stand_in(args.sqlite_path)
+        LoadTest(connect, args.mix, args.patients).run([int(n) for n in args.clients.split(",")], args.seconds)
+    elif args.command == "audit":
+        if args.id is not None and not args.table:
+            parser.error("--id needs --table")
+        if args.files or AUDIT_DIR or REPLICA_PATH:
+            rows = AuditLog.read_segments(audit_directory(), args.table, args.id, args.since, args.until)[:args.limit]
+        else:
+            connection = open_job_connection()
+            try:
+                rows = AuditLog.history(connection, args.table, args.id, args.since, args.until, args.limit)
+            finally:
+                connection.close()
+        for at, actor, action, table, key, before, after in rows:
+            print(f"{at} {actor} {action} {table} {key}")
+            if before:
+                print(f"    before: {before}")
+            if after:
+                print(f"    after:  {after}")
+    else:
+        ModernHospitalManagement()
+
 # Main entry point for the application
 if __name__ == "__main__":
-    app = ModernHospitalManagement()
\ No newline at end of file
+    main()
\ No newline at end of file